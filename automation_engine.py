@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+"""
+Automation Rules Engine
+Compiles automation rule conditions into callables and indexes them by the
+state keys they read, so each tick only re-evaluates rules whose inputs changed
+
+Optional rule fields:
+    'trigger': 'edge' (default) fires once when the condition turns true,
+               'while_true' fires on every tick while it holds
+    'cooldown': minimum seconds between two firings of the rule
+    condition['hysteresis']: for numeric >, >=, <, <= conditions, how far the
+               value must move back past the threshold before the condition clears
+
+Clock-driven conditions are not polled: 'time' == HH:MM and 'cron' conditions
+(value is a 5-field "minute hour day month weekday" expression) fire exactly
+once per occurrence from a heap of next-fire timestamps, and 'time' > / <
+conditions are only re-evaluated when the clock crosses their boundaries
+"""
+
+import heapq
+import itertools
+import operator
+import time
+from datetime import datetime, timedelta
+
+# Comparison operators supported by rule conditions
+OPERATORS = {
+    '>': operator.gt,
+    '<': operator.lt,
+    '>=': operator.ge,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne
+}
+
+# Rule trigger modes
+TRIGGER_EDGE = 'edge'
+TRIGGER_WHILE_TRUE = 'while_true'
+
+# Schedule modes: fire the rule at each event, or re-evaluate its condition
+SCHEDULE_FIRE = 'fire'
+SCHEDULE_WAKE = 'wake'
+
+# Scheduled occurrences later than this (e.g. after a stall) are skipped, not fired
+SCHEDULE_GRACE = 60.0
+
+# Cron field ranges: minute, hour, day of month, month, day of week (0 or 7 = Sunday)
+CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def _never(state, now, previous):
+    """Predicate for conditions that can never match (unknown type or operator)"""
+    return False
+
+
+def read_key(state, key, now):
+    """Read the value of an input key (a path tuple) from the state"""
+    value = state
+    for part in key:
+        value = value[part]
+    return value
+
+
+class CronExpression:
+    def __init__(self, expression):
+        """
+        Parse a 5-field cron expression; each field accepts *, N, A-B, */S,
+        A-B/S and comma-separated lists of those
+        Raises ValueError if the expression is invalid
+        """
+        fields = str(expression).split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: {expression!r}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self._parse_field(field, low, high) for field, (low, high) in zip(fields, CRON_FIELDS))
+        # Cron counts Sunday as 0 (or 7); datetime.weekday() counts Monday as 0
+        self.weekdays = {(day - 1) % 7 for day in weekdays}
+        # Like cron, a restricted day of month OR day of week matches when both are set
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    @staticmethod
+    def _parse_field(field, low, high):
+        """Expand one field into the set of values it matches"""
+        values = set()
+        for part in field.split(','):
+            spec, _, step = part.partition('/')
+            step = int(step) if step else 1
+            if spec == '*':
+                start, end = low, high
+            elif '-' in spec:
+                start, end = (int(bound) for bound in spec.split('-', 1))
+            else:
+                start = int(spec)
+                end = high if step > 1 else start
+            if step < 1 or start < low or end > high or start > end:
+                raise ValueError(f"Invalid cron field {field!r}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def day_matches(self, moment):
+        """Check the day of month, month and day of week of a datetime"""
+        if moment.month not in self.months:
+            return False
+        day = moment.day in self.days
+        weekday = moment.weekday() in self.weekdays
+        if self.any_day:
+            return weekday
+        if self.any_weekday:
+            return day
+        return day or weekday
+
+    def matches(self, moment):
+        """Check whether a datetime falls in a matching minute"""
+        return moment.minute in self.minutes and moment.hour in self.hours and self.day_matches(moment)
+
+    def next_after(self, moment):
+        """Get the first matching minute strictly after a datetime (None within 5 years)"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * 5)
+        while candidate < limit:
+            if not self.day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            else:
+                later = [minute for minute in self.minutes if minute >= candidate.minute]
+                if later:
+                    return candidate.replace(minute=min(later))
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+        return None
+
+
+def next_time_of_day(seconds_of_day, after):
+    """Get the first datetime strictly after `after` whose time of day is in the given seconds"""
+    midnight = after.replace(hour=0, minute=0, second=0, microsecond=0)
+    for day in (0, 1):
+        for seconds in sorted(seconds_of_day):
+            candidate = midnight + timedelta(days=day, seconds=seconds)
+            if candidate > after:
+                return candidate
+    return None
+
+
+def compile_schedule(condition):
+    """
+    Compile a clock-driven condition into a schedule
+    Returns (mode, next_event) where next_event(after) -> datetime of the next
+    event strictly after `after`; SCHEDULE_FIRE rules fire at each event and
+    SCHEDULE_WAKE rules re-evaluate their condition at each event
+    Returns None for conditions that are not driven by the clock
+    """
+    condition_type = condition.get('type')
+    if condition_type == 'cron':
+        try:
+            cron = CronExpression(condition.get('value'))
+        except (TypeError, ValueError):
+            return None
+        return SCHEDULE_FIRE, cron.next_after
+
+    if condition_type == 'time':
+        try:
+            target = datetime.strptime(condition.get('value'), "%H:%M").time()
+        except (TypeError, ValueError):
+            return None
+        target_seconds = target.hour * 3600 + target.minute * 60
+        op = condition.get('operator')
+        if op == '==':
+            return SCHEDULE_FIRE, lambda after: next_time_of_day((target_seconds,), after)
+        if op in ('>', '<'):
+            # The result flips at midnight and just after the target time
+            boundaries = (0, target_seconds, target_seconds + 1)
+            return SCHEDULE_WAKE, lambda after: next_time_of_day(boundaries, after)
+    return None
+
+
+def compile_threshold(op, value, hysteresis=0.0):
+    """
+    Compile a numeric comparison with an optional hysteresis band
+    Returns match(current, previous) -> bool; once matched, the condition only
+    clears after the value moves hysteresis units back past the threshold
+    """
+    compare = OPERATORS[op]
+    if not hysteresis or op not in ('>', '>=', '<', '<='):
+        return lambda current, previous: compare(current, value)
+
+    if op in ('>', '>='):
+        release = value - hysteresis
+        return lambda current, previous: current > release if previous else compare(current, value)
+    release = value + hysteresis
+    return lambda current, previous: current < release if previous else compare(current, value)
+
+
+def compile_condition(condition):
+    """
+    Compile a rule condition into a predicate
+    Returns (predicate, input_keys) where predicate(state, now, previous) -> bool,
+    previous being the last result, and input_keys is the set of state paths it reads
+    """
+    condition_type = condition.get('type')
+    compare = OPERATORS.get(condition.get('operator'))
+    value = condition.get('value')
+
+    if condition_type in ('temperature', 'humidity'):
+        if compare is None:
+            return _never, set()
+        try:
+            match = compile_threshold(condition['operator'], value,
+                                      float(condition.get('hysteresis') or 0.0))
+        except (TypeError, ValueError):
+            return _never, set()
+
+        def predicate(state, now, previous, key=condition_type):
+            # Climate readings are not trusted once the DHT11 cache goes stale
+            return not state['climate_stale'] and match(state[key], previous)
+        return predicate, {(condition_type,), ('climate_stale',)}
+
+    if condition_type == 'gas':
+        if compare is None:
+            return _never, set()
+        return (lambda state, now, previous: compare(state['gas_detected'], value)), {('gas_detected',)}
+
+    if condition_type == 'motion':
+        if compare is None:
+            return _never, set()
+        location = condition.get('location', 'any')
+        if location == 'any':
+            return (lambda state, now, previous: compare(any(state['motion'].values()), value)), {('motion',)}
+
+        def predicate(state, now, previous):
+            motion = state['motion']
+            return location in motion and compare(motion[location], value)
+        return predicate, {('motion',)}
+
+    if condition_type == 'time':
+        # Parse once at compile time instead of on every evaluation
+        try:
+            target = datetime.strptime(value, "%H:%M").time()
+        except (TypeError, ValueError):
+            return _never, set()
+        op = condition.get('operator')
+        if op not in ('>', '<'):
+            # '==' rules are fired by their timer (compile_schedule) and never evaluated
+            return _never, set()
+
+        def predicate(state, now, previous):
+            if op == '>':
+                return now.time() > target
+            return now.time() < target
+        # No state inputs: the rule engine's timers decide when to re-evaluate
+        return predicate, set()
+
+    if condition_type == 'cron':
+        try:
+            cron = CronExpression(value)
+        except (TypeError, ValueError):
+            return _never, set()
+        return (lambda state, now, previous: cron.matches(now)), set()
+
+    # Unknown condition type
+    return _never, set()
+
+
+class CompiledRule:
+    def __init__(self, rule):
+        """Compile a rule dict; the dict is kept so toggles are seen without recompiling"""
+        self.rule = rule
+        self.id = rule['id']
+        self.predicate, self.inputs = compile_condition(rule['condition'])
+        self.trigger = rule.get('trigger', TRIGGER_EDGE)
+        try:
+            self.cooldown = max(0.0, float(rule.get('cooldown') or 0.0))
+        except (TypeError, ValueError):
+            self.cooldown = 0.0
+        self.schedule = compile_schedule(rule['condition'])  # (mode, next_event) or None
+        self.result = False  # Last evaluated condition value
+        self.last_fired = None  # time.time() of the last firing
+
+    @property
+    def fires_on_schedule(self):
+        """True for rules fired by their timer rather than by evaluating the condition"""
+        return self.schedule is not None and self.schedule[0] == SCHEDULE_FIRE
+
+    def evaluate(self, state, now):
+        """Evaluate the compiled condition, treating read errors as False"""
+        try:
+            self.result = bool(self.predicate(state, now, self.result))
+        except (KeyError, TypeError):
+            self.result = False
+        return self.result
+
+    def cooling_down(self, timestamp):
+        """Check whether the rule fired less than its cooldown ago"""
+        return (self.cooldown > 0 and self.last_fired is not None and
+                timestamp - self.last_fired < self.cooldown)
+
+
+class RuleEngine:
+    def __init__(self, rules=None):
+        """Initialize an empty engine, optionally loading a list of rule dicts"""
+        self.compiled = {}      # Rule ID -> CompiledRule, in insertion order
+        self.index = {}         # Input key -> set of rule IDs reading it
+        self.last_values = {}   # Input key -> value seen on the previous tick
+        self.dirty = set()      # Rule IDs that must be evaluated on the next tick
+        self.holding = {}       # Rule ID -> matching while_true CompiledRule
+        self.timers = []        # Heap of (timestamp, token, rule ID) for clock-driven rules
+        self.timer_tokens = {}  # Rule ID -> token of its live heap entry (others are stale)
+        self.unscheduled = set()  # Clock-driven rule IDs waiting for their first timer
+        self.token_counter = itertools.count()
+        self.stats = {'ticks': 0, 'evaluations': 0, 'compiles': 0,
+                      'fired': 0, 'suppressed_by_cooldown': 0,
+                      'scheduled_fires': 0, 'scheduled_wakes': 0, 'missed_occurrences': 0}
+        if rules is not None:
+            self.load(rules)
+
+    def load(self, rules):
+        """Replace all rules with a freshly compiled set"""
+        self.compiled = {}
+        self.index = {}
+        self.last_values = {}
+        self.dirty = set()
+        self.holding = {}
+        self.timers = []
+        self.timer_tokens = {}
+        self.unscheduled = set()
+        for rule in rules:
+            self.add(rule)
+
+    def add(self, rule):
+        """Compile and index a rule (replacing any rule with the same ID)"""
+        if rule['id'] in self.compiled:
+            self.remove(rule['id'])
+        compiled = CompiledRule(rule)
+        self.compiled[compiled.id] = compiled
+        for key in compiled.inputs:
+            self.index.setdefault(key, set()).add(compiled.id)
+        if compiled.schedule is not None:
+            # The first timer is set on the next evaluate(), which knows the time
+            self.unscheduled.add(compiled.id)
+        if not compiled.fires_on_schedule:
+            self.dirty.add(compiled.id)
+        self.stats['compiles'] += 1
+        return compiled
+
+    def update(self, rule):
+        """Recompile a rule after its condition changed"""
+        return self.add(rule)
+
+    def remove(self, rule_id):
+        """Drop a rule from the engine and its indexes"""
+        compiled = self.compiled.pop(rule_id, None)
+        if compiled is None:
+            return False
+        for key in compiled.inputs:
+            ids = self.index.get(key)
+            if ids is not None:
+                ids.discard(rule_id)
+                if not ids:
+                    del self.index[key]
+                    self.last_values.pop(key, None)
+        self.dirty.discard(rule_id)
+        self.holding.pop(rule_id, None)
+        # Its heap entry becomes stale and is dropped when it reaches the top
+        self.timer_tokens.pop(rule_id, None)
+        self.unscheduled.discard(rule_id)
+        return True
+
+    def _schedule(self, compiled, now):
+        """Push the next event of a clock-driven rule onto the timer heap"""
+        next_event = compiled.schedule[1](now)
+        if next_event is None:
+            self.timer_tokens.pop(compiled.id, None)
+            return
+        token = next(self.token_counter)
+        self.timer_tokens[compiled.id] = token
+        heapq.heappush(self.timers, (next_event.timestamp(), token, compiled.id))
+
+    def run_timers(self, now, timestamp):
+        """
+        Handle timers that are due: returns the SCHEDULE_FIRE rules to fire and
+        marks SCHEDULE_WAKE rules for re-evaluation; costs O(1) when none are due
+        """
+        for rule_id in self.unscheduled:
+            self._schedule(self.compiled[rule_id], now)
+        self.unscheduled = set()
+
+        due = []
+        timers = self.timers
+        while timers and timers[0][0] <= timestamp:
+            event_time, token, rule_id = heapq.heappop(timers)
+            if self.timer_tokens.get(rule_id) != token:
+                continue  # Rule was removed or recompiled
+            compiled = self.compiled[rule_id]
+            if compiled.fires_on_schedule:
+                if timestamp - event_time <= SCHEDULE_GRACE:
+                    due.append(compiled)
+                    self.stats['scheduled_fires'] += 1
+                else:
+                    self.stats['missed_occurrences'] += 1
+            else:
+                self.dirty.add(rule_id)
+                self.stats['scheduled_wakes'] += 1
+            self._schedule(compiled, now)
+        return due
+
+    def upcoming(self, limit=20):
+        """Get the next clock events as [(timestamp, rule ID)], soonest first"""
+        live = [(event_time, rule_id) for event_time, token, rule_id in self.timers
+                if self.timer_tokens.get(rule_id) == token]
+        return heapq.nsmallest(limit, live)
+
+    def changed_rules(self, state, now):
+        """Collect IDs of rules whose input keys changed since the previous tick"""
+        rule_ids = self.dirty
+        self.dirty = set()
+        for key, ids in self.index.items():
+            try:
+                value = read_key(state, key, now)
+            except (KeyError, TypeError):
+                value = None
+            if key not in self.last_values or self.last_values[key] != value:
+                # Copy containers so later in-place mutation is still detected
+                self.last_values[key] = dict(value) if isinstance(value, dict) else value
+                rule_ids = rule_ids | ids
+        return rule_ids
+
+    def evaluate(self, state, now=None, timestamp=None):
+        """
+        Re-evaluate rules whose inputs changed and return the active compiled
+        rules that should fire on this tick
+        Edge rules fire on a false -> true transition, while_true rules on every
+        tick the condition holds, and scheduled (time == / cron) rules once per
+        occurrence; all are held back by their cooldown
+        """
+        if timestamp is None:
+            timestamp = now.timestamp() if now is not None else time.time()
+        if now is None:
+            now = datetime.fromtimestamp(timestamp)
+        self.stats['ticks'] += 1
+
+        # Clock-driven rules: fired directly by their timers, or woken for evaluation
+        to_fire = self.run_timers(now, timestamp)
+        rule_ids = self.changed_rules(state, now)
+        for rule_id in rule_ids:
+            compiled = self.compiled[rule_id]
+            if compiled.fires_on_schedule:
+                continue
+            was_true = compiled.result
+            if compiled.trigger == TRIGGER_WHILE_TRUE:
+                if compiled.evaluate(state, now):
+                    self.holding[rule_id] = compiled
+                else:
+                    self.holding.pop(rule_id, None)
+            elif compiled.evaluate(state, now) and not was_true:
+                to_fire.append(compiled)
+        self.stats['evaluations'] += len(rule_ids)
+
+        # Level-triggered rules fire again on every tick while they match
+        to_fire.extend(self.holding.values())
+
+        fired = []
+        for compiled in to_fire:
+            if not compiled.rule.get('active', True):
+                continue
+            if compiled.cooling_down(timestamp):
+                self.stats['suppressed_by_cooldown'] += 1
+                continue
+            compiled.last_fired = timestamp
+            fired.append(compiled)
+        self.stats['fired'] += len(fired)
+        return fired
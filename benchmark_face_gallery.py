@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark face matching on a large synthetic gallery: the original per-face
+compare_faces + face_distance over a list of per-user arrays against one
+vectorized FaceGallery.match() pass per batch of faces
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from face_gallery import FaceGallery, ENCODING_SIZE
+
+
+def face_distance(face_encodings, face_to_compare):
+    """face_recognition.face_distance"""
+    if len(face_encodings) == 0:
+        return np.empty((0))
+    return np.linalg.norm(face_encodings - face_to_compare, axis=1)
+
+
+def compare_faces(known_face_encodings, face_encoding_to_check, tolerance=0.6):
+    """face_recognition.compare_faces"""
+    return list(face_distance(known_face_encodings, face_encoding_to_check) <= tolerance)
+
+
+def make_gallery(users, per_user, seed):
+    """Random user centres with per-user jitter, roughly on the scale of dlib encodings"""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(0.0, 0.09, (users, ENCODING_SIZE))
+    samples = centres[:, None, :] + rng.normal(0.0, 0.02, (users, per_user, ENCODING_SIZE))
+    return centres, {f"user{i}": list(samples[i]) for i in range(users)}
+
+
+def main():
+    """Time both matchers on the same queries and check they pick the same users"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--per-user', type=int, default=5)
+    parser.add_argument('--faces', type=int, default=4, help='faces per frame (batch size)')
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    centres, users = make_gallery(args.users, args.per_user, args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    picked = rng.integers(0, args.users, (args.frames, args.faces))
+    frames = centres[picked] + rng.normal(0.0, 0.02, (args.frames, args.faces, ENCODING_SIZE))
+    print(f"Matching {args.frames} frames of {args.faces} faces against {args.users} users "
+          f"x {args.per_user} encodings\n")
+
+    # Original layout: a Python list of arrays and a parallel list of names
+    known_encodings = [encoding for samples in users.values() for encoding in samples]
+    known_names = [name for name, samples in users.items() for _ in samples]
+    started = time.perf_counter()
+    legacy = []
+    for faces in frames:
+        for face in faces:
+            matches = compare_faces(known_encodings, face)
+            distances = face_distance(known_encodings, face)
+            best = np.argmin(distances)
+            legacy.append(known_names[best] if matches[best] else None)
+    legacy_time = time.perf_counter() - started
+
+    gallery = FaceGallery(users)
+    started = time.perf_counter()
+    vectorized = []
+    for faces in frames:
+        for candidates in gallery.match(faces, k=3):
+            best = candidates[0]
+            vectorized.append(best['name'] if best['distance'] <= 0.6 else None)
+    gallery_time = time.perf_counter() - started
+
+    batches = args.frames
+    agree = sum(1 for a, b in zip(legacy, vectorized) if a == b)
+    print(f"{'matcher':>10} {'ms/frame':>10} {'us/face':>10}")
+    for label, seconds in (('legacy', legacy_time), ('gallery', gallery_time)):
+        print(f"{label:>10} {seconds / batches * 1000:10.3f} "
+              f"{seconds / (batches * args.faces) * 1e6:10.1f}")
+    print(f"\nSpeedup: {legacy_time / gallery_time:.1f}x")
+    print(f"Same best match: {agree}/{len(legacy)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Benchmark face recognition on a recorded video: full-frame detection and
+encoding on every frame (recognize_face) against the detect-then-track
+pipeline (track_faces) at one or more detection scale/upsample settings,
+comparing throughput, detection recall and identity agreement with the
+full-frame baseline
+"""
+
+import argparse
+import time
+
+import cv2
+
+from face_recognition_door import FaceRecognitionDoor, box_iou
+
+
+def load_frames(video, limit):
+    """Read up to limit frames of a video file (or camera index) into memory"""
+    capture = cv2.VideoCapture(int(video) if video.isdigit() else video)
+    frames = []
+    while len(frames) < limit:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        frames.append(cv2.resize(frame, (640, 480)))
+    capture.release()
+    return frames
+
+
+def run(method, frames):
+    """Run one recognizer over every frame; returns (seconds, per-frame lists of (name, location))"""
+    faces = []
+    started = time.perf_counter()
+    for frame in frames:
+        faces.append([(face['name'], face['location']) for face in method(frame.copy())])
+    return time.perf_counter() - started, faces
+
+
+def compare(baseline, tracked, min_iou=0.3):
+    """
+    Match each frame's faces to the baseline's by overlap
+    Returns (baseline faces, found, same name, extra faces not in the baseline)
+    """
+    total = found = same = extra = 0
+    for expected, actual in zip(baseline, tracked):
+        pairs = sorted(((box_iou(a[1], b[1]), i, j)
+                        for i, a in enumerate(expected) for j, b in enumerate(actual)),
+                       reverse=True)
+        used_expected, used_actual = set(), set()
+        for iou, i, j in pairs:
+            if iou < min_iou:
+                break
+            if i in used_expected or j in used_actual:
+                continue
+            used_expected.add(i)
+            used_actual.add(j)
+            same += expected[i][0] == actual[j][0]
+        total += len(expected)
+        found += len(used_expected)
+        extra += len(actual) - len(used_actual)
+    return total, found, same, extra
+
+
+def parse_settings(text):
+    """Parse "scale:upsample,..." into [(scale, upsample)]"""
+    settings = []
+    for item in text.split(','):
+        scale, _, upsample = item.partition(':')
+        settings.append((float(scale), int(upsample or 1)))
+    return settings
+
+
+def main():
+    """Run the baseline and each tracking setting over the same frames and print the comparison"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('video', help='video file, or a camera index to record from')
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--config', default='face_config.json')
+    parser.add_argument('--interval', type=int, help='detection interval (frames)')
+    parser.add_argument('--settings', default='0.25:1,0.5:1,0.5:2',
+                        help='detection scale:upsample pairs to compare, e.g. 0.5:1,0.5:2')
+    args = parser.parse_args()
+
+    frames = load_frames(args.video, args.frames)
+    if not frames:
+        print(f"No frames could be read from {args.video}")
+        return
+
+    door = FaceRecognitionDoor(args.config)
+    print(f"Benchmarking {len(frames)} frames against {len(door.known_names)} known faces\n")
+    full_time, full_faces = run(door.recognize_face, frames)
+    door.cleanup()
+
+    print(f"{'pipeline':>18} {'ms/frame':>10} {'speedup':>8} {'recall':>8} {'same name':>10} "
+          f"{'extra':>6} {'encodings':>10}")
+    print(f"{'every frame':>18} {full_time / len(frames) * 1000:10.1f} {1.0:8.1f} "
+          f"{1.0:8.1%} {1.0:10.1%} {0:6d} {sum(len(faces) for faces in full_faces):10d}")
+    for scale, upsample in parse_settings(args.settings):
+        # A fresh instance per setting so no tracks carry over
+        door = FaceRecognitionDoor(args.config)
+        door.detection_scale = scale
+        door.detection_upsample = upsample
+        if args.interval:
+            door.detection_interval = args.interval
+        tracked_time, tracked_faces = run(door.track_faces, frames)
+        total, found, same, extra = compare(full_faces, tracked_faces)
+        stats = door.get_pipeline_stats()
+        door.cleanup()
+        label = f"track {scale:g} x{upsample}"
+        print(f"{label:>18} {tracked_time / len(frames) * 1000:10.1f} "
+              f"{full_time / tracked_time:8.1f} {found / total if total else 1.0:8.1%} "
+              f"{same / found if found else 1.0:10.1%} {extra:6d} {stats['encodings']:10d}")
+
+    print("\nrecall: baseline faces the pipeline also reported (overlap >= 0.3); "
+          "same name: of those, faces given the same identity")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Benchmark rule CRUD on the indexed RuleStore against the original list-scanning
+add/update/delete/toggle/get functions with a large rule set
+"""
+
+import argparse
+import copy
+import random
+import time
+
+from benchmark_rules import make_rules, ROOMS
+from rule_store import RuleStore
+
+ACTIONS = [{'type': 'fan', 'command': 'on'},
+           {'type': 'door', 'command': 'lock'},
+           {'type': 'garage', 'command': 'close'},
+           {'type': 'alert', 'command': 'gas'}] + \
+          [{'type': 'light', 'command': 'on', 'location': room} for room in ROOMS]
+
+
+class LegacyRules:
+    """Original list-based rule functions, kept here as the baseline"""
+
+    def __init__(self, rules):
+        self.rules = rules
+
+    def add(self, rule):
+        if 'id' not in rule:
+            rule['id'] = f"rule{len(self.rules) + 1}"
+        if 'active' not in rule:
+            rule['active'] = True
+        self.rules.append(rule)
+        return rule['id']
+
+    def get(self, rule_id):
+        for rule in self.rules:
+            if rule['id'] == rule_id:
+                return rule
+        return None
+
+    def update(self, rule_id, updated_rule):
+        for i, rule in enumerate(self.rules):
+            if rule['id'] == rule_id:
+                updated_rule['id'] = rule_id
+                self.rules[i] = updated_rule
+                return True
+        return False
+
+    def delete(self, rule_id):
+        for i, rule in enumerate(self.rules):
+            if rule['id'] == rule_id:
+                del self.rules[i]
+                return True
+        return False
+
+    def toggle(self, rule_id):
+        for rule in self.rules:
+            if rule['id'] == rule_id:
+                rule['active'] = not rule['active']
+                return True
+        return False
+
+    def find(self, condition_type):
+        return [rule for rule in self.rules if rule['condition']['type'] == condition_type]
+
+
+class IndexedRules:
+    """The same operations on a RuleStore"""
+
+    def __init__(self, rules):
+        self.store = RuleStore(rules)
+
+    def add(self, rule):
+        if 'active' not in rule:
+            rule['active'] = True
+        return self.store.add(rule)['id']
+
+    def get(self, rule_id):
+        return self.store.get(rule_id)
+
+    def update(self, rule_id, updated_rule):
+        return self.store.update(rule_id, updated_rule)
+
+    def delete(self, rule_id):
+        return self.store.remove(rule_id) is not None
+
+    def toggle(self, rule_id):
+        rule = self.store.get(rule_id)
+        if rule is None:
+            return False
+        rule['active'] = not rule['active']
+        return True
+
+    def find(self, condition_type):
+        return self.store.find(condition_type=condition_type)
+
+
+def make_store_rules(count, seed):
+    """Benchmark rules with a spread of action targets"""
+    rng = random.Random(seed)
+    rules = make_rules(count, seed)
+    for rule in rules:
+        rule['action'] = dict(rng.choice(ACTIONS))
+    return rules
+
+
+def run(impl_class, rules, ops, seed):
+    """Time each CRUD operation; returns ({op: seconds}, duplicate IDs after adds)"""
+    rng = random.Random(seed)
+    impl = impl_class(copy.deepcopy(rules))
+    ids = [rule['id'] for rule in rules]
+    targets = [rng.choice(ids) for _ in range(ops)]
+    timings = {}
+
+    started = time.perf_counter()
+    for rule_id in targets:
+        impl.get(rule_id)
+    timings['get'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for rule_id in targets:
+        impl.toggle(rule_id)
+    timings['toggle'] = time.perf_counter() - started
+
+    replacements = [copy.deepcopy(rules[rng.randrange(len(rules))]) for _ in range(ops)]
+    started = time.perf_counter()
+    for rule_id, rule in zip(targets, replacements):
+        impl.update(rule_id, rule)
+    timings['update'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for condition_type in ('temperature', 'humidity', 'gas', 'motion', 'time') * 4:
+        impl.find(condition_type)
+    timings['find x20'] = time.perf_counter() - started
+
+    deletes = rng.sample(ids, ops)
+    started = time.perf_counter()
+    for rule_id in deletes:
+        impl.delete(rule_id)
+    timings['delete'] = time.perf_counter() - started
+
+    new_rules = [{'name': 'new', 'condition': copy.deepcopy(rules[i % len(rules)]['condition']),
+                  'action': {'type': 'fan', 'command': 'on'}} for i in range(ops)]
+    started = time.perf_counter()
+    added = [impl.add(rule) for rule in new_rules]
+    timings['add'] = time.perf_counter() - started
+
+    # IDs the add path handed out that another rule already had
+    existing = set(ids) - set(deletes)
+    duplicates = sum(1 for rule_id in added if rule_id in existing)
+    return timings, duplicates
+
+
+def main():
+    """Run both implementations and print per-operation cost"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rules', type=int, default=50000)
+    parser.add_argument('--ops', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rules = make_store_rules(args.rules, args.seed)
+    print(f"Benchmarking CRUD on {args.rules} rules, {args.ops} operations each\n")
+
+    legacy, legacy_duplicates = run(LegacyRules, rules, args.ops, args.seed)
+    indexed, indexed_duplicates = run(IndexedRules, rules, args.ops, args.seed)
+
+    print(f"{'operation':>10} {'legacy us/op':>14} {'indexed us/op':>14} {'speedup':>9}")
+    for op in legacy:
+        count = 20 if op.startswith('find') else args.ops
+        print(f"{op:>10} {legacy[op] / count * 1e6:14.1f} {indexed[op] / count * 1e6:14.1f} "
+              f"{legacy[op] / indexed[op]:8.1f}x")
+
+    print(f"\nDuplicate IDs generated by add after {args.ops} deletes: "
+          f"legacy {legacy_duplicates}, indexed {indexed_duplicates}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Benchmark the compiled automation rules engine against the original
+per-tick string-dispatch evaluator with a large rule set
+"""
+
+import random
+import time
+import datetime
+import argparse
+
+from automation_engine import RuleEngine
+
+ROOMS = ['Room1', 'Room2', 'Room3', 'LivingRoom']
+
+
+def legacy_evaluate_condition(condition, system_state):
+    """Original evaluate_condition() logic, kept here as the baseline"""
+    condition_type = condition['type']
+    operator = condition['operator']
+    value = condition['value']
+
+    if condition_type == 'temperature':
+        current_value = system_state['temperature']
+    elif condition_type == 'humidity':
+        current_value = system_state['humidity']
+    elif condition_type == 'gas':
+        current_value = system_state['gas_detected']
+    elif condition_type == 'motion':
+        if condition.get('location', 'any') == 'any':
+            current_value = any(system_state['motion'].values())
+        else:
+            room = condition['location']
+            if room in system_state['motion']:
+                current_value = system_state['motion'][room]
+            else:
+                return False
+    elif condition_type == 'time':
+        current_time = datetime.datetime.now().time()
+        time_value = datetime.datetime.strptime(value, "%H:%M").time()
+        if operator == '>':
+            return current_time > time_value
+        elif operator == '<':
+            return current_time < time_value
+        elif operator == '==':
+            return abs((datetime.datetime.combine(datetime.date.today(), current_time) -
+                      datetime.datetime.combine(datetime.date.today(), time_value)).total_seconds()) < 60
+        else:
+            return False
+    else:
+        return False
+
+    if operator == '>':
+        return current_value > value
+    elif operator == '<':
+        return current_value < value
+    elif operator == '>=':
+        return current_value >= value
+    elif operator == '<=':
+        return current_value <= value
+    elif operator == '==':
+        return current_value == value
+    elif operator == '!=':
+        return current_value != value
+    else:
+        return False
+
+
+def legacy_process(rules, system_state):
+    """Original process_automation_rules() walk, without executing actions"""
+    fired = 0
+    for rule in rules:
+        if rule['active']:
+            if legacy_evaluate_condition(rule['condition'], system_state):
+                fired += 1
+    return fired
+
+
+def make_rules(count, seed=1):
+    """Generate a mixed rule set resembling what the UI produces"""
+    rng = random.Random(seed)
+    rules = []
+    for i in range(count):
+        kind = rng.choice(['temperature', 'humidity', 'gas', 'motion', 'time'])
+        op = rng.choice(['>', '<', '>=', '<=', '==', '!='])
+        if kind == 'temperature':
+            condition = {'type': kind, 'operator': op, 'value': rng.uniform(15, 35)}
+        elif kind == 'humidity':
+            condition = {'type': kind, 'operator': op, 'value': rng.uniform(20, 80)}
+        elif kind == 'gas':
+            condition = {'type': kind, 'operator': '==', 'value': True}
+        elif kind == 'motion':
+            condition = {'type': kind, 'operator': '==', 'value': True,
+                         'location': rng.choice(ROOMS + ['any'])}
+        else:
+            condition = {'type': kind, 'operator': rng.choice(['>', '<', '==']),
+                         'value': f"{rng.randrange(24):02d}:{rng.randrange(60):02d}"}
+        rules.append({
+            'id': f"rule{i + 1}",
+            'name': f"Rule {i + 1}",
+            'condition': condition,
+            'action': {'type': 'fan', 'command': 'on'},
+            'active': True
+        })
+    return rules
+
+
+def make_state():
+    """Build a system_state-shaped dict with the fields rules read"""
+    return {
+        'motion': {room: False for room in ROOMS},
+        'temperature': 24.0,
+        'humidity': 45.0,
+        'climate_stale': False,
+        'gas_detected': False
+    }
+
+
+def step_state(state, tick, rng):
+    """Advance the simulated sensors the way the real loop sees them"""
+    # PIR edges are the most frequent change, DHT updates every 2 s at 10 ticks/s
+    if rng.random() < 0.1:
+        room = rng.choice(ROOMS)
+        state['motion'][room] = not state['motion'][room]
+    if tick % 20 == 0:
+        state['temperature'] = round(state['temperature'] + rng.uniform(-0.5, 0.5), 1)
+        state['humidity'] = round(state['humidity'] + rng.uniform(-1, 1), 1)
+
+
+def run_legacy(rules, ticks, seed):
+    """Time the original engine over a number of ticks"""
+    rng = random.Random(seed)
+    state = make_state()
+    started = time.perf_counter()
+    for tick in range(ticks):
+        step_state(state, tick, rng)
+        legacy_process(rules, state)
+    return time.perf_counter() - started
+
+
+def run_compiled(rules, ticks, seed):
+    """Time the compiled engine over a number of ticks"""
+    rng = random.Random(seed)
+    state = make_state()
+    compile_started = time.perf_counter()
+    engine = RuleEngine(rules)
+    compile_time = time.perf_counter() - compile_started
+    started = time.perf_counter()
+    for tick in range(ticks):
+        step_state(state, tick, rng)
+        engine.evaluate(state)
+    return time.perf_counter() - started, compile_time, engine.stats
+
+
+def main():
+    """Run both engines and print throughput"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rules', type=int, default=10000)
+    parser.add_argument('--ticks', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rules = make_rules(args.rules, args.seed)
+    print(f"Benchmarking {args.rules} rules over {args.ticks} ticks\n")
+
+    legacy_time = run_legacy(rules, args.ticks, args.seed)
+    compiled_time, compile_time, stats = run_compiled(rules, args.ticks, args.seed)
+
+    for name, elapsed in (('legacy', legacy_time), ('compiled', compiled_time)):
+        print(f"{name:>9}: {elapsed:8.3f} s total, "
+              f"{elapsed / args.ticks * 1000:8.3f} ms/tick, "
+              f"{args.ticks / elapsed:10.1f} ticks/s, "
+              f"{args.rules * args.ticks / elapsed:12.0f} rules/s")
+
+    print(f"\nCompile time: {compile_time * 1000:.1f} ms for {args.rules} rules")
+    print(f"Compiled engine evaluated {stats['evaluations']} conditions "
+          f"({stats['evaluations'] / args.ticks:.0f} per tick vs {args.rules} for legacy)")
+    print(f"Speedup: {legacy_time / compiled_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
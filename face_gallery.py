@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Face Gallery
+Enrolled face encodings held as one contiguous float32 matrix, grouped by user,
+with several encodings per user and a per-user centroid
+
+A batch of query faces is matched with a single matrix product: squared
+distances come from |q|^2 + |e|^2 - 2 q.e, the closest encoding per user is
+taken with one reduceat over the user groups, and the top-k users are picked
+with argpartition. The matrix is rebuilt only when enrollment changes
+"""
+
+import numpy as np
+
+ENCODING_SIZE = 128  # face_recognition / dlib embedding length
+
+
+class FaceGallery:
+    def __init__(self, users=None, size=ENCODING_SIZE):
+        """
+        users: optional {name: [encoding, ...]} to load
+        size: encoding length
+        """
+        self.size = size
+        self.samples = {}   # Name -> list of float32 encodings, oldest first
+        if users:
+            for name, encodings in users.items():
+                self.samples[name] = [self._vector(encoding) for encoding in encodings]
+        self._rebuild()
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    def __contains__(self, name):
+        return name in self.samples
+
+    def _vector(self, encoding):
+        """Check and convert one encoding to a float32 vector"""
+        vector = np.asarray(encoding, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self.size:
+            raise ValueError(f"Expected an encoding of length {self.size}, got {vector.shape[0]}")
+        return vector
+
+    def _rebuild(self):
+        """Pack the samples into the contiguous matrix, offsets, norms and centroids"""
+        self.names = [name for name, encodings in self.samples.items() if encodings]
+        counts = np.array([len(self.samples[name]) for name in self.names], dtype=np.intp)
+        if self.names:
+            self.embeddings = np.ascontiguousarray(
+                np.vstack([self.samples[name] for name in self.names]), dtype=np.float32)
+        else:
+            self.embeddings = np.empty((0, self.size), dtype=np.float32)
+        # Start of each user's rows; users own consecutive rows in self.names order
+        self.offsets = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.intp)
+        self.sq_norms = np.einsum('ij,ij->i', self.embeddings, self.embeddings)
+        if self.names:
+            self.centroids = np.ascontiguousarray(
+                np.add.reduceat(self.embeddings, self.offsets, axis=0) / counts[:, None],
+                dtype=np.float32)
+        else:
+            self.centroids = np.empty((0, self.size), dtype=np.float32)
+
+    def set(self, name, encodings):
+        """Replace every encoding of a user"""
+        self.samples[name] = [self._vector(encoding) for encoding in encodings]
+        self._rebuild()
+
+    def add(self, name, encoding, max_per_user=None):
+        """Enroll one more encoding for a user, dropping the oldest beyond max_per_user"""
+        samples = self.samples.setdefault(name, [])
+        samples.append(self._vector(encoding))
+        if max_per_user is not None and len(samples) > max_per_user:
+            del samples[:len(samples) - max_per_user]
+        self._rebuild()
+
+    def remove(self, name):
+        """Remove a user; returns False if unknown"""
+        if self.samples.pop(name, None) is None:
+            return False
+        self._rebuild()
+        return True
+
+    def encodings(self, name):
+        """Get a user's encodings as lists (for saving)"""
+        return [encoding.tolist() for encoding in self.samples.get(name, [])]
+
+    def match(self, queries, k=1):
+        """
+        Find the k closest users for each query encoding
+        A user's distance is that of their closest enrolled encoding
+        Returns one list per query of {'name', 'distance', 'centroid_distance'},
+        closest first (empty when nobody is enrolled)
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.size)
+        if not self.names or not len(queries):
+            return [[] for _ in range(len(queries))]
+
+        squared = np.einsum('ij,ij->i', queries, queries)[:, None] + self.sq_norms[None, :]
+        squared -= 2.0 * (queries @ self.embeddings.T)
+        np.maximum(squared, 0.0, out=squared)
+        per_user = np.minimum.reduceat(squared, self.offsets, axis=1)
+
+        k = max(1, min(k, len(self.names)))
+        if k < len(self.names):
+            top = np.argpartition(per_user, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(len(self.names)), per_user.shape)
+        order = np.argsort(np.take_along_axis(per_user, top, axis=1), axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        distances = np.sqrt(np.take_along_axis(per_user, top, axis=1))
+        centroid_distances = np.linalg.norm(queries[:, None, :] - self.centroids[top], axis=2)
+
+        return [[{'name': self.names[user], 'distance': float(distance),
+                  'centroid_distance': float(centroid_distance)}
+                 for user, distance, centroid_distance in zip(top[i], distances[i],
+                                                               centroid_distances[i])]
+                for i in range(len(queries))]
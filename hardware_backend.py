@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+Hardware Backends for the Smart Home System
+The real backend drives the Raspberry Pi (RPi.GPIO, DHT11, ADS1115 over I2C);
+the simulated backend models every sensor and actuator in memory so the full
+system, including Flask and SocketIO, can run on any Linux machine
+
+Select with the SMART_HOME_BACKEND environment variable: 'pi' (default) or 'sim'
+"""
+
+import os
+import json
+import random
+import threading
+import time
+
+# ADS1115 full-scale range in volts for each programmable gain
+ADS1115_GAIN_RANGES = {2 / 3: 6.144, 1: 4.096, 2: 2.048, 4: 1.024, 8: 0.512, 16: 0.256}
+
+# ADS1115 conversion rates in samples per second
+ADS1115_DATA_RATES = (8, 16, 32, 64, 128, 250, 475, 860)
+
+
+def adc_voltage(raw, gain):
+    """Convert a raw ADS1115 reading to volts (avoids AnalogIn.voltage's second conversion)"""
+    return raw * ADS1115_GAIN_RANGES.get(gain, 4.096) / 32767
+
+
+class RealBackend:
+    """Raspberry Pi hardware: RPi.GPIO, Adafruit_DHT and the ADS1115 ADC"""
+
+    name = 'pi'
+
+    def __init__(self):
+        """Import the Pi-only drivers"""
+        import RPi.GPIO as GPIO
+        import Adafruit_DHT
+        self.GPIO = GPIO
+        self._dht = Adafruit_DHT
+
+    def read_dht11(self, pin):
+        """Read (humidity, temperature) from a DHT11 once; either may be None"""
+        return self._dht.read(self._dht.DHT11, pin)
+
+    def open_gas_adc(self, data_rate=128, continuous=False):
+        """
+        Open the ADS1115 on I2C and return (ads, channel A0)
+        In continuous mode the ADC converts A0 back to back at data_rate and a
+        read only fetches the latest result instead of triggering a conversion
+        """
+        import board
+        import busio
+        import adafruit_ads1x15.ads1115 as ADS
+        from adafruit_ads1x15.ads1x15 import Mode
+        from adafruit_ads1x15.analog_in import AnalogIn
+        i2c = busio.I2C(board.SCL, board.SDA)
+        ads = ADS.ADS1115(i2c)
+        ads.data_rate = data_rate
+        if continuous:
+            ads.mode = Mode.CONTINUOUS
+        return ads, AnalogIn(ads, ADS.P0)
+
+
+class SimulatedPWM:
+    """In-memory stand-in for RPi.GPIO.PWM that records frequency and duty cycle"""
+
+    def __init__(self, gpio, pin, frequency):
+        self.gpio = gpio
+        self.pin = pin
+        self.frequency = frequency
+        self.duty_cycle = 0
+        self.running = False
+        gpio.pwm[pin] = self
+
+    def start(self, duty_cycle):
+        self.running = True
+        self.duty_cycle = duty_cycle
+
+    def ChangeDutyCycle(self, duty_cycle):
+        self.duty_cycle = duty_cycle
+
+    def ChangeFrequency(self, frequency):
+        self.frequency = frequency
+
+    def stop(self):
+        self.running = False
+        self.duty_cycle = 0
+
+
+class SimulatedGPIO:
+    """
+    In-memory stand-in for the RPi.GPIO module
+    Inputs are driven with set_input(), which fires edge callbacks like the real
+    library (respecting the edge type and bouncetime)
+    """
+
+    BCM = 11
+    BOARD = 10
+    IN = 1
+    OUT = 0
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.modes = {}        # Pin -> IN/OUT
+        self.levels = {}       # Pin -> current level
+        self.pwm = {}          # Pin -> SimulatedPWM
+        self.callbacks = {}    # Pin -> (edge, callback, bouncetime ms)
+        self.last_callback = {}
+        self.stats = {'outputs': 0, 'inputs': 0, 'edges': 0}
+
+    def setmode(self, mode):
+        pass
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, mode, pull_up_down=None, initial=None):
+        with self.lock:
+            self.modes[pin] = mode
+            if mode == self.IN:
+                # Pull-ups idle high, everything else idles low
+                self.levels.setdefault(pin, self.HIGH if pull_up_down == self.PUD_UP else self.LOW)
+            elif initial is not None:
+                self.levels[pin] = initial
+            else:
+                self.levels.setdefault(pin, self.LOW)
+
+    def input(self, pin):
+        with self.lock:
+            self.stats['inputs'] += 1
+            return self.levels.get(pin, self.LOW)
+
+    def output(self, pins, values):
+        if not isinstance(pins, (list, tuple)):
+            pins = [pins]
+        if not isinstance(values, (list, tuple)):
+            values = [values] * len(pins)
+        with self.lock:
+            for pin, value in zip(pins, values):
+                self.levels[pin] = self.HIGH if value else self.LOW
+                self.stats['outputs'] += 1
+
+    def PWM(self, pin, frequency):
+        return SimulatedPWM(self, pin, frequency)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=0):
+        with self.lock:
+            if pin in self.callbacks:
+                raise RuntimeError("Conflicting edge detection already enabled for this GPIO channel")
+            self.callbacks[pin] = (edge, callback, bouncetime or 0)
+
+    def remove_event_detect(self, pin):
+        with self.lock:
+            self.callbacks.pop(pin, None)
+
+    def cleanup(self):
+        with self.lock:
+            self.callbacks.clear()
+
+    def set_input(self, pin, level):
+        """Drive a simulated input pin, firing its edge callback on a change"""
+        level = self.HIGH if level else self.LOW
+        with self.lock:
+            previous = self.levels.get(pin, self.LOW)
+            self.levels[pin] = level
+            if previous == level or pin not in self.callbacks:
+                return
+            edge, callback, bouncetime = self.callbacks[pin]
+            now = time.time()
+            if now - self.last_callback.get(pin, 0.0) < bouncetime / 1000.0:
+                return
+            rising = level == self.HIGH
+            if (edge == self.RISING and not rising) or (edge == self.FALLING and rising):
+                return
+            self.last_callback[pin] = now
+            self.stats['edges'] += 1
+        if callback is not None:
+            # RPi.GPIO runs callbacks on its own thread
+            threading.Thread(target=callback, args=(pin,), daemon=True).start()
+
+
+class SimulatedADS1115:
+    """Minimal stand-in for adafruit_ads1x15.ads1115.ADS1115"""
+
+    def __init__(self):
+        self.gain = 1
+        self.data_rate = 128
+        self.mode = None
+        self.conversions = 0  # Number of reads of the conversion result
+
+
+class SimulatedAnalogIn:
+    """Stand-in for AnalogIn on A0 whose voltage is set by the simulator"""
+
+    def __init__(self, ads, voltage=0.4):
+        self.ads = ads
+        self.simulated_voltage = voltage
+        self.noise = 0.01
+
+    def _sample(self):
+        """One conversion: the set voltage plus a little noise"""
+        self.ads.conversions += 1
+        full_scale = ADS1115_GAIN_RANGES.get(self.ads.gain, 4.096)
+        voltage = self.simulated_voltage + random.uniform(-self.noise, self.noise)
+        return max(-32768, min(32767, int(voltage / full_scale * 32767)))
+
+    @property
+    def value(self):
+        return self._sample()
+
+    @property
+    def voltage(self):
+        return adc_voltage(self._sample(), self.ads.gain)
+
+
+class SimulatedBackend:
+    """
+    Simulated hardware with scriptable inputs
+    Sensors are driven through set_motion(), set_climate(), set_gas(), set_ir()
+    or apply_inputs(); run_script() replays timed steps and start_activity()
+    generates random household activity for load tests
+    """
+
+    name = 'sim'
+
+    def __init__(self):
+        self.GPIO = SimulatedGPIO()
+        self.temperature = 22.0
+        self.humidity = 45.0
+        self.dht_failure_rate = 0.0   # Fraction of DHT11 reads that fail
+        self.dht_read_delay = 0.0     # Seconds a DHT11 read blocks
+        self.ads = SimulatedADS1115()
+        self.gas_channel = SimulatedAnalogIn(self.ads)
+        # Pins are learned from the application so the simulator has no copy of them
+        self.pins = {}
+
+    def configure_pins(self, pir_pins, gas_digital_pin, ir_sensor_pin):
+        """Tell the simulator which pins the application uses for each input"""
+        self.pins = {
+            'motion': dict(pir_pins),
+            'gas': gas_digital_pin,
+            'ir': ir_sensor_pin
+        }
+        # Both sensors are active low, so idle (no gas, nothing at the IR sensor) is high
+        self.GPIO.levels[gas_digital_pin] = SimulatedGPIO.HIGH
+        self.GPIO.levels[ir_sensor_pin] = SimulatedGPIO.HIGH
+
+    def read_dht11(self, pin):
+        """Return the simulated climate, honouring the configured delay and failure rate"""
+        if self.dht_read_delay:
+            time.sleep(self.dht_read_delay)
+        if random.random() < self.dht_failure_rate:
+            return None, None
+        return self.humidity, self.temperature
+
+    def open_gas_adc(self, data_rate=128, continuous=False):
+        """Return the simulated (ads, channel A0)"""
+        self.ads.data_rate = data_rate
+        self.ads.mode = 'continuous' if continuous else 'single'
+        return self.ads, self.gas_channel
+
+    def set_motion(self, room, detected):
+        """Set a room's PIR output"""
+        self.GPIO.set_input(self.pins['motion'][room], detected)
+
+    def set_climate(self, temperature=None, humidity=None):
+        """Set what the DHT11 will report"""
+        if temperature is not None:
+            self.temperature = float(temperature)
+        if humidity is not None:
+            self.humidity = float(humidity)
+
+    def set_gas(self, detected=None, voltage=None):
+        """Set the MQ-7 digital output (active low) and/or analog voltage"""
+        if voltage is not None:
+            self.gas_channel.simulated_voltage = float(voltage)
+        if detected is not None:
+            self.GPIO.set_input(self.pins['gas'], not detected)
+
+    def set_ir(self, present):
+        """Set the IR sensor (active low when a finger/object is present)"""
+        self.GPIO.set_input(self.pins['ir'], not present)
+
+    def apply_inputs(self, inputs):
+        """
+        Apply a dict of inputs, e.g. {"motion": {"Room1": true}, "temperature": 27,
+        "humidity": 50, "gas": false, "gas_voltage": 0.4, "ir": false}
+        """
+        for room, detected in inputs.get('motion', {}).items():
+            self.set_motion(room, detected)
+        self.set_climate(inputs.get('temperature'), inputs.get('humidity'))
+        self.set_gas(inputs.get('gas'), inputs.get('gas_voltage'))
+        if 'ir' in inputs:
+            self.set_ir(inputs['ir'])
+        if 'dht_failure_rate' in inputs:
+            self.dht_failure_rate = float(inputs['dht_failure_rate'])
+        if 'dht_read_delay' in inputs:
+            self.dht_read_delay = float(inputs['dht_read_delay'])
+
+    def run_script(self, steps, loop=False):
+        """
+        Replay a list of {"delay": seconds, ...inputs} steps on a background thread
+        Each step waits its delay, then applies the remaining keys as inputs
+        """
+        def runner():
+            while True:
+                for step in steps:
+                    time.sleep(step.get('delay', 0))
+                    self.apply_inputs(step)
+                if not loop:
+                    break
+        thread = threading.Thread(target=runner, name='sim-script', daemon=True)
+        thread.start()
+        return thread
+
+    def start_activity(self, interval=0.5, seed=None):
+        """Randomly toggle motion and drift the climate to generate load"""
+        rng = random.Random(seed)
+
+        def runner():
+            while True:
+                time.sleep(interval)
+                if rng.random() < 0.5:
+                    room = rng.choice(list(self.pins['motion']))
+                    pin = self.pins['motion'][room]
+                    self.set_motion(room, not self.GPIO.levels.get(pin))
+                self.set_climate(self.temperature + rng.uniform(-0.2, 0.2),
+                                 min(100.0, max(0.0, self.humidity + rng.uniform(-0.5, 0.5))))
+        thread = threading.Thread(target=runner, name='sim-activity', daemon=True)
+        thread.start()
+        return thread
+
+    def get_outputs(self):
+        """Snapshot of output pin levels, PWM devices and simulated sensor values"""
+        gpio = self.GPIO
+        with gpio.lock:
+            outputs = {pin: level for pin, level in gpio.levels.items() if gpio.modes.get(pin) == gpio.OUT}
+            pwm = {pin: {'frequency': p.frequency, 'duty_cycle': p.duty_cycle, 'running': p.running}
+                   for pin, p in gpio.pwm.items()}
+            inputs = {pin: level for pin, level in gpio.levels.items() if gpio.modes.get(pin) == gpio.IN}
+            stats = dict(gpio.stats)
+        return {
+            'outputs': outputs,
+            'pwm': pwm,
+            'inputs': inputs,
+            'temperature': self.temperature,
+            'humidity': self.humidity,
+            'gas_voltage': self.gas_channel.simulated_voltage,
+            'adc_conversions': self.ads.conversions,
+            'gpio_stats': stats
+        }
+
+
+def load_backend(name=None):
+    """
+    Create the hardware backend named by name or SMART_HOME_BACKEND
+    'pi' loads the real drivers, 'sim' the simulator
+    """
+    name = name or os.environ.get('SMART_HOME_BACKEND', 'pi')
+    if name == 'sim':
+        return SimulatedBackend()
+    if name == 'pi':
+        return RealBackend()
+    raise ValueError(f"Unknown hardware backend: {name}")
+
+
+def load_script(path):
+    """Load a simulator script (a JSON list of steps) from a file"""
+    with open(path, 'r') as f:
+        return json.load(f)
@@ -0,0 +1,599 @@
+#!/usr/bin/env python3
+"""
+Sensor History Store
+Embedded append-only time-series storage for sensor readings: recent samples
+stay in memory, older samples are written to compact per-metric segment files
+(uint32 millisecond offsets + float32 values, 8 bytes per sample) that are
+memory-mapped and binary-searched for range queries
+
+Every reading also updates per-metric min/max/mean/count/last rollups at minute,
+hour and day resolution, so long-range queries read a few hundred rollup rows
+instead of scanning raw samples
+
+Samples in the open head buffer are appended to a per-metric 'head' file and the
+rollup rows to their files every checkpoint interval, so a crash loses at most
+that much history; the head file is replayed on load and cleared once sealed
+"""
+
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# On-disk sample layout: milliseconds since the segment start, and the value
+SEGMENT_DTYPE = np.dtype([('offset_ms', '<u4'), ('value', '<f4')])
+
+# Head file layout: samples of the open head buffer, appended at each checkpoint
+HEAD_DTYPE = np.dtype([('timestamp', '<f8'), ('value', '<f4')])
+
+# Rollup bucket layout (memory and disk); mean is sum / count
+ROLLUP_DTYPE = np.dtype([('start', '<f8'), ('min', '<f4'), ('max', '<f4'),
+                         ('sum', '<f8'), ('count', '<u4'), ('last', '<f4')])
+
+# Rollup resolutions, finest first: (name, bucket seconds, retention days or
+# None to follow the store's retention); buckets are aligned to the epoch (UTC)
+ROLLUP_RESOLUTIONS = (
+    ('minute', 60, 14),
+    ('hour', 3600, None),
+    ('day', 86400, None)
+)
+
+# Statistics a query can return
+STATS = ('mean', 'min', 'max', 'count', 'last')
+
+
+class Segment:
+    """A sealed, immutable block of samples for one metric"""
+
+    def __init__(self, start, end, timestamps=None, values=None, path=None):
+        self.start = start      # Timestamp of the first sample
+        self.end = end          # Timestamp of the last sample
+        self.path = path
+        self._timestamps = timestamps
+        self._values = values
+
+    @classmethod
+    def from_file(cls, path):
+        """Describe a segment file from its name (<start_ms>-<end_ms>.seg) without reading it"""
+        start_ms, end_ms = os.path.basename(path)[:-4].split('-')
+        return cls(int(start_ms) / 1000.0, int(end_ms) / 1000.0, path=path)
+
+    def arrays(self):
+        """Get (timestamps float64, values float32), loading from disk if needed"""
+        if self._timestamps is None:
+            data = np.memmap(self.path, dtype=SEGMENT_DTYPE, mode='r')
+            self._timestamps = self.start + data['offset_ms'] / 1000.0
+            self._values = np.array(data['value'])
+            del data
+        return self._timestamps, self._values
+
+    def to_bytes(self):
+        """Encode the samples in the on-disk layout"""
+        timestamps, values = self.arrays()
+        data = np.empty(len(timestamps), dtype=SEGMENT_DTYPE)
+        data['offset_ms'] = np.round((timestamps - self.start) * 1000.0)
+        data['value'] = values
+        return data.tobytes()
+
+    def file_name(self):
+        """File name encoding the segment's time span"""
+        return f"{int(round(self.start * 1000))}-{int(round(self.end * 1000))}.seg"
+
+
+class Rollup:
+    """Incrementally maintained aggregate buckets of one metric at one resolution"""
+
+    def __init__(self, name, seconds, retention_days):
+        self.name = name
+        self.seconds = seconds
+        self.retention_days = retention_days
+        self.closed = np.empty(0, dtype=ROLLUP_DTYPE)  # Closed buckets ordered by start
+        self.pending = []   # Closed bucket rows not yet merged into self.closed
+        self.unsaved = []   # Closed bucket rows not yet written to disk
+        self.bucket = None  # Open bucket: [start, min, max, sum, count, last]
+        self.bucket_saved = None  # Open bucket as last written to the .open file
+
+    def add(self, timestamp, value):
+        """Fold one reading into the open bucket, closing it when a new bucket starts"""
+        start = timestamp - timestamp % self.seconds
+        bucket = self.bucket
+        if bucket is not None and start == bucket[0]:
+            if value < bucket[1]:
+                bucket[1] = value
+            if value > bucket[2]:
+                bucket[2] = value
+            bucket[3] += value
+            bucket[4] += 1
+            bucket[5] = value
+            return
+        if bucket is not None:
+            if start < bucket[0]:
+                # Late reading for a bucket that is already closed
+                return
+            row = tuple(bucket)
+            self.pending.append(row)
+            self.unsaved.append(row)
+        self.bucket = [start, value, value, value, 1, value]
+
+    def rows(self, start, end):
+        """Get the buckets overlapping [start, end], including the open one"""
+        if self.pending:
+            self.closed = np.concatenate([self.closed, np.array(self.pending, dtype=ROLLUP_DTYPE)])
+            self.pending = []
+        starts = self.closed['start']
+        lo = np.searchsorted(starts, start - self.seconds, side='right')
+        hi = np.searchsorted(starts, end, side='right')
+        rows = self.closed[lo:hi]
+        bucket = self.bucket
+        if bucket is not None and bucket[0] + self.seconds > start and bucket[0] <= end:
+            rows = np.concatenate([rows, np.array([tuple(bucket)], dtype=ROLLUP_DTYPE)])
+        return rows
+
+    def take_unsaved(self):
+        """Get the closed rows that still need to be appended to disk"""
+        rows = np.array(self.unsaved, dtype=ROLLUP_DTYPE)
+        self.unsaved = []
+        return rows
+
+    def covers(self, start, now, store_retention_days):
+        """Check whether buckets starting at start are still within retention"""
+        retention_days = self.retention_days or store_retention_days
+        return start >= now - retention_days * 86400
+
+    def trim(self, cutoff):
+        """Drop closed buckets that ended before the cutoff; returns True if any were dropped"""
+        self.rows(cutoff, cutoff)
+        keep = self.closed['start'] + self.seconds >= cutoff
+        if keep.all():
+            return False
+        self.closed = self.closed[keep]
+        return True
+
+
+class MetricSeries:
+    """All samples of one metric: sealed segments plus the open head buffer"""
+
+    def __init__(self, name):
+        self.name = name
+        self.segments = []          # Sealed segments ordered by start time
+        self.head_timestamps = []   # Open (unsealed) samples
+        self.head_values = []
+        self.head_saved = 0         # Head samples already appended to the head file
+        self.last_timestamp = None
+        self.rollups = [Rollup(name, seconds, retention_days)
+                        for name, seconds, retention_days in ROLLUP_RESOLUTIONS]
+
+
+class TimeSeriesStore:
+    def __init__(self, directory='history', segment_seconds=21600, cache_segments=8,
+                 min_interval=1.0, retention_days=400, expire_interval=3600,
+                 checkpoint_interval=30):
+        """
+        directory: where segment files are kept (one sub-directory per metric)
+        segment_seconds: span of the open head buffer before it is sealed to disk
+        cache_segments: sealed segments kept decoded in memory (the recent ring)
+        min_interval: raw samples closer together than this for one metric are
+                      dropped (rollups still see every reading)
+        retention_days: segments older than this are deleted
+        expire_interval: seconds between retention passes on the writer thread
+                         (None to leave expire() to the caller)
+        checkpoint_interval: seconds between saves of the head buffers and rollup
+                             rows on the writer thread (None to save only on
+                             seal and flush())
+        """
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.cache_segments = cache_segments
+        self.min_interval = min_interval
+        self.retention_days = retention_days
+        self.expire_interval = expire_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.series = {}
+        self.cache = OrderedDict()  # Segments with decoded arrays, oldest first
+        self.lock = threading.Lock()
+        self.write_queue = queue.Queue()
+        self.stats = {'appended': 0, 'dropped': 0, 'segments_written': 0, 'write_errors': 0,
+                      'segments_expired': 0, 'checkpoints': 0, 'queries': 0, 'rollup_queries': 0}
+        self._load_index()
+
+        self.writer = threading.Thread(target=self._writer_loop, name='history-writer')
+        self.writer.daemon = True
+        self.writer.start()
+
+    def _load_index(self):
+        """Discover existing segment files on disk"""
+        os.makedirs(self.directory, exist_ok=True)
+        for metric in os.listdir(self.directory):
+            metric_dir = os.path.join(self.directory, metric)
+            if not os.path.isdir(metric_dir):
+                continue
+            series = self._series(metric)
+            for file_name in os.listdir(metric_dir):
+                if file_name.endswith('.seg'):
+                    try:
+                        series.segments.append(Segment.from_file(os.path.join(metric_dir, file_name)))
+                    except ValueError:
+                        continue
+            series.segments.sort(key=lambda segment: segment.start)
+            if series.segments:
+                series.last_timestamp = series.segments[-1].end
+            for rollup in series.rollups:
+                self._load_rollup(metric_dir, rollup)
+            self._load_head(metric_dir, series)
+
+    def _load_rollup(self, metric_dir, rollup):
+        """Load the closed buckets and the last saved open bucket of a rollup"""
+        path = os.path.join(metric_dir, rollup.name + '.rollup')
+        if os.path.exists(path):
+            data = np.fromfile(path, dtype=np.uint8)
+            # Ignore a partially written trailing row
+            usable = len(data) - len(data) % ROLLUP_DTYPE.itemsize
+            rollup.closed = data[:usable].view(ROLLUP_DTYPE).copy()
+
+        open_path = os.path.join(metric_dir, rollup.name + '.open')
+        if os.path.exists(open_path):
+            data = np.fromfile(open_path, dtype=ROLLUP_DTYPE)
+            # Stale if buckets after it were already persisted
+            if len(data) == 1 and (not len(rollup.closed) or data[0]['start'] > rollup.closed['start'][-1]):
+                rollup.bucket = [float(data[0]['start']), float(data[0]['min']), float(data[0]['max']),
+                                 float(data[0]['sum']), int(data[0]['count']), float(data[0]['last'])]
+
+    def _load_head(self, metric_dir, series):
+        """Replay the samples of the head buffer saved before the last shutdown or crash"""
+        path = os.path.join(metric_dir, 'head')
+        if not os.path.exists(path):
+            return
+        data = np.fromfile(path, dtype=np.uint8)
+        # Ignore a partially written trailing sample
+        usable = len(data) - len(data) % HEAD_DTYPE.itemsize
+        head = data[:usable].view(HEAD_DTYPE)
+        if series.last_timestamp is not None:
+            # Samples already sealed into a segment (crash before the head was cleared)
+            head = head[head['timestamp'] > series.last_timestamp]
+        series.head_timestamps = head['timestamp'].tolist()
+        series.head_values = head['value'].tolist()
+        series.head_saved = len(series.head_timestamps)
+        if series.head_timestamps:
+            series.last_timestamp = series.head_timestamps[-1]
+
+    def _series(self, metric):
+        """Get or create the series for a metric"""
+        series = self.series.get(metric)
+        if series is None:
+            series = self.series[metric] = MetricSeries(metric)
+        return series
+
+    def metrics(self):
+        """Names of all metrics with data"""
+        with self.lock:
+            return sorted(self.series)
+
+    def append(self, metric, value, timestamp=None):
+        """
+        Append one reading; it always updates the rollups, and returns False if
+        it was not kept as a raw sample (None, too soon or out of order)
+        """
+        if value is None:
+            return False
+        if timestamp is None:
+            timestamp = time.time()
+        value = float(value)
+
+        with self.lock:
+            series = self._series(metric)
+            for rollup in series.rollups:
+                rollup.add(timestamp, value)
+            if series.last_timestamp is not None and timestamp - series.last_timestamp < self.min_interval:
+                self.stats['dropped'] += 1
+                return False
+            series.head_timestamps.append(timestamp)
+            series.head_values.append(value)
+            series.last_timestamp = timestamp
+            self.stats['appended'] += 1
+
+            if timestamp - series.head_timestamps[0] >= self.segment_seconds:
+                self._seal(series)
+        return True
+
+    def _seal(self, series):
+        """
+        Turn the head buffer into a sealed segment and queue it, together with
+        the rollup buckets closed since the last seal, for writing (lock held)
+        """
+        for rollup in series.rollups:
+            if rollup.unsaved:
+                self.write_queue.put(('rollup', series.name, (rollup.name, rollup.take_unsaved())))
+        if not series.head_timestamps:
+            return
+        timestamps = np.array(series.head_timestamps, dtype=np.float64)
+        values = np.array(series.head_values, dtype=np.float32)
+        segment = Segment(timestamps[0], timestamps[-1], timestamps, values)
+        series.segments.append(segment)
+        series.head_timestamps = []
+        series.head_values = []
+        self._remember(segment)
+        self.write_queue.put(('segment', series.name, segment))
+        if series.head_saved:
+            # Queued after the segment, so the samples are never only in memory
+            self.write_queue.put(('head_clear', series.name, None))
+            series.head_saved = 0
+
+    def checkpoint(self):
+        """
+        Queue the head samples, closed rollup rows and open rollup buckets added
+        since the last checkpoint for writing
+        """
+        with self.lock:
+            for series in self.series.values():
+                if len(series.head_timestamps) > series.head_saved:
+                    head = np.empty(len(series.head_timestamps) - series.head_saved, dtype=HEAD_DTYPE)
+                    head['timestamp'] = series.head_timestamps[series.head_saved:]
+                    head['value'] = series.head_values[series.head_saved:]
+                    self.write_queue.put(('head', series.name, head))
+                    series.head_saved = len(series.head_timestamps)
+                for rollup in series.rollups:
+                    if rollup.unsaved:
+                        self.write_queue.put(('rollup', series.name, (rollup.name, rollup.take_unsaved())))
+                    if rollup.bucket is not None and rollup.bucket != rollup.bucket_saved:
+                        rollup.bucket_saved = list(rollup.bucket)
+                        row = np.array([tuple(rollup.bucket)], dtype=ROLLUP_DTYPE)
+                        self.write_queue.put(('rollup_open', series.name, (rollup.name, row)))
+            self.stats['checkpoints'] += 1
+
+    def _remember(self, segment):
+        """Keep a decoded segment in the bounded in-memory cache (lock held)"""
+        self.cache[id(segment)] = segment
+        self.cache.move_to_end(id(segment))
+        while len(self.cache) > self.cache_segments:
+            _, evicted = self.cache.popitem(last=False)
+            if evicted.path is not None:
+                # Written to disk already, so the arrays can be reloaded on demand
+                evicted._timestamps = None
+                evicted._values = None
+
+    def _writer_loop(self):
+        """
+        Write sealed segments and rollup buckets to disk off the sensor thread,
+        checkpoint every checkpoint_interval seconds and apply retention every
+        expire_interval seconds (first pass at startup)
+        """
+        next_expire = time.monotonic()
+        next_checkpoint = time.monotonic() + (self.checkpoint_interval or 0)
+        while True:
+            deadlines = []
+            if self.expire_interval:
+                if time.monotonic() >= next_expire:
+                    self.stats['segments_expired'] += self.expire()
+                    next_expire = time.monotonic() + self.expire_interval
+                deadlines.append(next_expire)
+            if self.checkpoint_interval:
+                if time.monotonic() >= next_checkpoint:
+                    self.checkpoint()
+                    next_checkpoint = time.monotonic() + self.checkpoint_interval
+                deadlines.append(next_checkpoint)
+            timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            try:
+                kind, metric, payload = self.write_queue.get(timeout=timeout)
+            except queue.Empty:
+                continue
+            try:
+                if kind == 'segment':
+                    self._write_segment(metric, payload)
+                    self.stats['segments_written'] += 1
+                    with self.lock:
+                        if id(payload) not in self.cache:
+                            # Already evicted from the ring; reload from disk when queried
+                            payload._timestamps = None
+                            payload._values = None
+                elif kind == 'rollup':
+                    self._append_rollup(metric, *payload)
+                elif kind == 'rollup_rewrite':
+                    self._write_atomic(os.path.join(self.directory, metric, payload[0] + '.rollup'),
+                                       payload[1].tobytes())
+                elif kind == 'rollup_open':
+                    self._write_atomic(os.path.join(self.directory, metric, payload[0] + '.open'),
+                                       payload[1].tobytes())
+                elif kind == 'head':
+                    self._append_head(metric, payload)
+                elif kind == 'head_clear':
+                    path = os.path.join(self.directory, metric, 'head')
+                    if os.path.exists(path):
+                        os.remove(path)
+            except OSError as e:
+                self.stats['write_errors'] += 1
+                print(f"Error writing history {kind} for {metric}: {e}")
+            finally:
+                self.write_queue.task_done()
+
+    def _write_atomic(self, path, data):
+        """Replace a file atomically (temp file + rename)"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def _append_rollup(self, metric, name, rows):
+        """Append closed buckets to a rollup file (whole rows; a torn tail is ignored on load)"""
+        metric_dir = os.path.join(self.directory, metric)
+        os.makedirs(metric_dir, exist_ok=True)
+        with open(os.path.join(metric_dir, name + '.rollup'), 'ab') as f:
+            f.write(rows.tobytes())
+
+    def _append_head(self, metric, samples):
+        """Append head samples and sync them (whole samples; a torn tail is ignored on load)"""
+        metric_dir = os.path.join(self.directory, metric)
+        os.makedirs(metric_dir, exist_ok=True)
+        with open(os.path.join(metric_dir, 'head'), 'ab') as f:
+            f.write(samples.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_segment(self, metric, segment):
+        """Write one segment atomically"""
+        path = os.path.join(self.directory, metric, segment.file_name())
+        self._write_atomic(path, segment.to_bytes())
+        segment.path = path
+
+    def flush(self):
+        """
+        Seal every head buffer, save the open rollup buckets, and wait until
+        everything is on disk
+        """
+        with self.lock:
+            for series in self.series.values():
+                self._seal(series)
+                for rollup in series.rollups:
+                    if rollup.bucket is not None:
+                        row = np.array([tuple(rollup.bucket)], dtype=ROLLUP_DTYPE)
+                        self.write_queue.put(('rollup_open', series.name, (rollup.name, row)))
+        self.write_queue.join()
+
+    def expire(self, now=None):
+        """Delete segments and rollup buckets older than their retention period"""
+        now = now or time.time()
+        cutoff = now - self.retention_days * 86400
+        removed = []
+        with self.lock:
+            for series in self.series.values():
+                keep = []
+                for segment in series.segments:
+                    if segment.end < cutoff and segment.path is not None:
+                        removed.append(segment.path)
+                        self.cache.pop(id(segment), None)
+                    else:
+                        keep.append(segment)
+                series.segments = keep
+
+                for rollup in series.rollups:
+                    retention_days = rollup.retention_days or self.retention_days
+                    # Save pending rows first so the rewrite cannot be followed by a stale append
+                    if rollup.unsaved:
+                        self.write_queue.put(('rollup', series.name, (rollup.name, rollup.take_unsaved())))
+                    if rollup.trim(now - retention_days * 86400):
+                        self.write_queue.put(('rollup_rewrite', series.name, (rollup.name, rollup.closed.copy())))
+        for path in removed:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return len(removed)
+
+    def resolution_for(self, metric, start, step, now=None):
+        """
+        Pick the coarsest rollup whose buckets evenly divide the step and that
+        still covers the start of the range; None means raw samples are needed
+        """
+        if not step:
+            return None
+        now = now or time.time()
+        with self.lock:
+            series = self.series.get(metric)
+            if series is None:
+                return None
+            for rollup in reversed(series.rollups):
+                if step >= rollup.seconds and step % rollup.seconds == 0 and \
+                        rollup.covers(start, now, self.retention_days):
+                    return rollup.name
+        return None
+
+    def query(self, metric, start, end, step=None, stat='mean'):
+        """
+        Get samples of a metric between start and end (inclusive, epoch seconds)
+        With a step (seconds), samples are aggregated into step-aligned buckets
+        using stat ('mean', 'min', 'max', 'count' or 'last'), read from the
+        coarsest rollup that fits the step when there is one
+        Returns (timestamps, values) numpy arrays
+        """
+        timestamps, values, _ = self.query_with_resolution(metric, start, end, step, stat)
+        return timestamps, values
+
+    def query_with_resolution(self, metric, start, end, step=None, stat='mean'):
+        """Same as query(), also returning the resolution used ('raw' or a rollup name)"""
+        if stat not in STATS:
+            raise ValueError(f"Unknown stat {stat!r}, expected one of {', '.join(STATS)}")
+        resolution = self.resolution_for(metric, start, step)
+        if resolution is not None:
+            with self.lock:
+                self.stats['queries'] += 1
+                self.stats['rollup_queries'] += 1
+                rollup = next(rollup for rollup in self.series[metric].rollups if rollup.name == resolution)
+                rows = rollup.rows(start, end)
+            timestamps, values = combine_rollup(rows, step, stat)
+            return timestamps, values, resolution
+
+        with self.lock:
+            self.stats['queries'] += 1
+            series = self.series.get(metric)
+            if series is None:
+                return np.empty(0), np.empty(0, dtype=np.float32), 'raw'
+            segments = [segment for segment in series.segments
+                        if segment.end >= start and segment.start <= end]
+            head_timestamps = np.array(series.head_timestamps, dtype=np.float64)
+            head_values = np.array(series.head_values, dtype=np.float32)
+
+        parts_t = []
+        parts_v = []
+        for segment in segments:
+            timestamps, values = segment.arrays()
+            with self.lock:
+                if segment in series.segments:
+                    self._remember(segment)
+            lo = np.searchsorted(timestamps, start, side='left')
+            hi = np.searchsorted(timestamps, end, side='right')
+            parts_t.append(timestamps[lo:hi])
+            parts_v.append(values[lo:hi])
+        if len(head_timestamps):
+            lo = np.searchsorted(head_timestamps, start, side='left')
+            hi = np.searchsorted(head_timestamps, end, side='right')
+            parts_t.append(head_timestamps[lo:hi])
+            parts_v.append(head_values[lo:hi])
+
+        if not parts_t:
+            return np.empty(0), np.empty(0, dtype=np.float32), 'raw'
+        timestamps = np.concatenate(parts_t)
+        values = np.concatenate(parts_v)
+
+        if step and len(timestamps):
+            timestamps, values = downsample(timestamps, values, step, stat)
+        return timestamps, values, 'raw'
+
+
+def downsample(timestamps, values, step, stat='mean'):
+    """Aggregate samples into step-aligned buckets; returns (bucket starts, values)"""
+    buckets = np.floor(timestamps / step) * step
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    counts = np.diff(np.r_[starts, len(values)])
+    if stat == 'min':
+        result = np.minimum.reduceat(values, starts)
+    elif stat == 'max':
+        result = np.maximum.reduceat(values, starts)
+    elif stat == 'count':
+        result = counts
+    elif stat == 'last':
+        result = values[starts + counts - 1]
+    else:
+        result = np.add.reduceat(values.astype(np.float64), starts) / counts
+    return buckets[starts], result.astype(np.float32)
+
+
+def combine_rollup(rows, step, stat='mean'):
+    """Merge rollup buckets into step-aligned buckets; returns (bucket starts, values)"""
+    if not len(rows):
+        return np.empty(0), np.empty(0, dtype=np.float32)
+    buckets = np.floor(rows['start'] / step) * step
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    if stat == 'min':
+        result = np.minimum.reduceat(rows['min'], starts)
+    elif stat == 'max':
+        result = np.maximum.reduceat(rows['max'], starts)
+    elif stat == 'count':
+        result = np.add.reduceat(rows['count'].astype(np.int64), starts)
+    elif stat == 'last':
+        result = rows['last'][np.r_[starts[1:], len(rows)] - 1]
+    else:
+        result = np.add.reduceat(rows['sum'], starts) / np.add.reduceat(rows['count'].astype(np.int64), starts)
+    return buckets[starts], result.astype(np.float32)
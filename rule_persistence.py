@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Automation Rules Persistence
+Write-behind storage for the automation rules: changes are recorded in memory
+and a background thread coalesces them into one atomic file write (temp file,
+fsync, rename) once the burst has been quiet for a short window
+
+With the journal enabled, each batch of changes is appended to
+<path>.journal instead of rewriting the whole file, and the journal is folded
+back into the rules file (compacted) once it grows past a number of entries.
+Journal entries are idempotent, so replaying them over a newer rules file is
+harmless
+
+With a meta callable, the file is saved as {"rules": [...], "meta": {...}} and
+each journal batch ends with a 'meta' entry, so state that is not in the rules
+themselves (e.g. the rule ID counter) survives restarts. Plain list files are
+still read
+"""
+
+import copy
+import json
+import os
+import threading
+import time
+
+
+class RulePersistence:
+    def __init__(self, path, rules, delay=0.5, max_delay=5.0, journal=False, compact_after=200,
+                 meta=None, lock=None):
+        """
+        path: rules file (a JSON list of rule dicts, or {"rules", "meta"} with meta)
+        rules: callable returning the live list of rule dicts to save
+        delay: seconds without changes before a write starts
+        max_delay: longest a change may wait during a continuous burst
+        journal: append changes to <path>.journal and compact periodically
+        compact_after: journal entries that trigger a compaction
+        meta: optional callable returning a JSON-able dict saved with the rules
+              (read back into self.meta by load())
+        lock: the lock callers already hold while they change the rules (default:
+              a new RLock); the writer holds it only to snapshot, never to serialize
+        """
+        self.path = path
+        self.rules = rules
+        self.delay = delay
+        self.max_delay = max_delay
+        self.journal_path = path + '.journal' if journal else None
+        self.compact_after = compact_after
+        self.meta_source = meta
+        self.meta = {}              # Meta saved with the rules, as of the last load()
+        # Held by callers while they change the rules and record the change, so a
+        # snapshot always matches exactly the journal entries recorded before it
+        self.lock = lock if lock is not None else threading.RLock()
+        self.condition = threading.Condition(self.lock)
+        self.write_lock = threading.Lock()  # Keeps file writes in recording order
+        self.pending = []           # Journal entries not yet written
+        self.first_change = None    # time.time() of the oldest unsaved change
+        self.last_change = None     # time.time() of the newest unsaved change
+        self.journal_entries = 0    # Entries in the journal file since the last compaction
+        self.stats = {'changes': 0, 'writes': 0, 'journal_appends': 0, 'compactions': 0,
+                      'errors': 0, 'last_error': None, 'last_write': None,
+                      'last_write_duration': 0.0}
+
+        self.writer = threading.Thread(target=self._writer_loop, name='rules-writer')
+        self.writer.daemon = True
+        self.writer.start()
+
+    def load(self):
+        """
+        Read the rules file and replay the journal over it
+        Returns the list of rules, or None if there is nothing saved
+        """
+        with self.lock:
+            has_journal = self.journal_path is not None and os.path.exists(self.journal_path)
+            self.meta = {}
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as f:
+                    rules = json.load(f)
+                if isinstance(rules, dict):
+                    self.meta = rules.get('meta', {})
+                    rules = rules['rules']
+            elif has_journal:
+                rules = []
+            else:
+                return None
+
+            if has_journal:
+                replayed = 0
+                with open(self.journal_path, 'r') as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            # Torn final line from a crash mid-append
+                            break
+                        if entry.get('op') == 'meta':
+                            self.meta = entry['meta']
+                        else:
+                            rules = apply_entry(rules, entry)
+                        replayed += 1
+                self.journal_entries = replayed
+                if replayed:
+                    print(f"Replayed {replayed} rule changes from {self.journal_path}")
+            return rules
+
+    def put(self, rule):
+        """Record that a rule was added or changed"""
+        self._record({'op': 'put', 'rule': copy.deepcopy(rule)})
+
+    def delete(self, rule_id):
+        """Record that a rule was deleted"""
+        self._record({'op': 'delete', 'id': rule_id})
+
+    def replace(self, rules):
+        """Record that the whole rule list was replaced"""
+        self._record({'op': 'replace', 'rules': copy.deepcopy(rules)})
+
+    def _record(self, entry):
+        """Queue a change and wake the writer"""
+        now = time.time()
+        with self.condition:
+            if self.journal_path:
+                self.pending.append(entry)
+            if self.first_change is None:
+                self.first_change = now
+            self.last_change = now
+            self.stats['changes'] += 1
+            self.condition.notify()
+
+    def _writer_loop(self):
+        """Wait for a quiet window (or max_delay) after changes, then write them"""
+        while True:
+            with self.condition:
+                while self.first_change is None:
+                    self.condition.wait()
+                while True:
+                    now = time.time()
+                    due = min(self.last_change + self.delay, self.first_change + self.max_delay)
+                    if now >= due:
+                        break
+                    self.condition.wait(due - now)
+            self._write()
+
+    def _write(self):
+        """Write everything recorded so far (journal append or full atomic rewrite)"""
+        with self.write_lock:
+            self._write_locked()
+
+    def _write_locked(self):
+        """Body of _write(); the write lock is held"""
+        with self.lock:
+            if self.first_change is None:
+                return
+            entries = self.pending
+            self.pending = []
+            self.first_change = None
+            self.last_change = None
+            compact = (not self.journal_path or not os.path.exists(self.path) or
+                       self.journal_entries + len(entries) >= self.compact_after)
+            if self.meta_source is not None:
+                meta = self.meta_source()
+                entries.append({'op': 'meta', 'meta': meta})
+            if compact:
+                # Snapshot under the lock so it matches the recorded changes; a rule
+                # changed in place after this is recorded again and rewritten
+                saved = list(self.rules())
+                if self.meta_source is not None:
+                    saved = {'rules': saved, 'meta': meta}
+
+        # Serialize outside the lock so rule changes and evaluation never wait on it
+        if compact:
+            data = json.dumps(saved, indent=4)
+        else:
+            data = ''.join(json.dumps(entry) + '\n' for entry in entries)
+
+        started = time.time()
+        try:
+            if compact:
+                write_atomic(self.path, data)
+                if self.journal_path and os.path.exists(self.journal_path):
+                    os.remove(self.journal_path)
+                    self.stats['compactions'] += 1
+                self.journal_entries = 0
+                self.stats['writes'] += 1
+            else:
+                with open(self.journal_path, 'a') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.journal_entries += len(entries)
+                self.stats['journal_appends'] += 1
+            self.stats['last_write'] = time.time()
+            self.stats['last_write_duration'] = time.time() - started
+        except OSError as e:
+            self.stats['errors'] += 1
+            self.stats['last_error'] = str(e)
+            print(f"Error saving rules: {e}")
+            # Retry with a full rewrite on the next change or flush
+            with self.condition:
+                self.journal_entries = self.compact_after
+                if self.first_change is None:
+                    self.first_change = self.last_change = time.time()
+
+    def flush(self):
+        """Write any unsaved changes now, compacting the journal (used at shutdown)"""
+        with self.lock:
+            if self.journal_path and self.journal_entries:
+                self.journal_entries = self.compact_after
+                if self.first_change is None:
+                    self.first_change = self.last_change = time.time()
+        self._write()
+
+    def get_stats(self):
+        """Get write statistics and the amount of unsaved work"""
+        with self.lock:
+            stats = dict(self.stats)
+            stats['unsaved_changes'] = self.first_change is not None
+            stats['journal'] = self.journal_path is not None
+            stats['journal_entries'] = self.journal_entries
+        return stats
+
+
+def apply_entry(rules, entry):
+    """Apply one journal entry to a list of rules and return the new list"""
+    op = entry.get('op')
+    if op == 'replace':
+        return entry['rules']
+    if op == 'put':
+        rule = entry['rule']
+        for i, existing in enumerate(rules):
+            if existing.get('id') == rule.get('id'):
+                rules[i] = rule
+                return rules
+        rules.append(rule)
+        return rules
+    if op == 'delete':
+        return [rule for rule in rules if rule.get('id') != entry.get('id')]
+    return rules
+
+
+def write_atomic(path, data):
+    """Replace a text file atomically (temp file + fsync + rename)"""
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
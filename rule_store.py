@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Automation Rule Store
+Ordered, ID-keyed storage for automation rules with O(1) lookup, update and
+delete, collision-free ID generation and secondary indexes by condition type
+and by action target (e.g. 'fan', 'light:Room1', 'garage')
+"""
+
+import re
+import uuid
+
+# IDs the store generates itself: rule<N>
+GENERATED_ID = re.compile(r'^rule(\d+)$')
+
+
+def action_target(action):
+    """Get the device an action drives; lights are qualified by location"""
+    action_type = action.get('type')
+    if action_type == 'light':
+        return f"light:{action.get('location', 'all')}"
+    return action_type
+
+
+def index_keys(rule):
+    """Get the (condition type, action target) a rule is indexed under"""
+    return rule.get('condition', {}).get('type'), action_target(rule.get('action', {}))
+
+
+class RuleStore:
+    def __init__(self, rules=None, id_style='sequential'):
+        """
+        Initialize the store, optionally loading a list of rule dicts
+        id_style: 'sequential' (rule<N>, never reusing a number seen by this
+        store) or 'uuid'
+        """
+        self.id_style = id_style
+        self.rules = {}                # Rule ID -> rule dict, in insertion order
+        self.by_condition_type = {}    # Condition type -> {rule ID: None} (ordered set)
+        self.by_action_target = {}     # Action target -> {rule ID: None}
+        self.highest = 0               # Highest rule<N> number handed out or seen
+        if rules is not None:
+            self.replace(rules)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def __contains__(self, rule_id):
+        return rule_id in self.rules
+
+    def __iter__(self):
+        return iter(self.rules.values())
+
+    def values(self):
+        """Live view of the rules in insertion order (no copy)"""
+        return self.rules.values()
+
+    def to_list(self):
+        """Get the rules as a list (for JSON responses and saving)"""
+        return list(self.rules.values())
+
+    def get(self, rule_id):
+        """Get a rule by ID, or None"""
+        return self.rules.get(rule_id)
+
+    def new_id(self):
+        """Generate an ID that no current or earlier rule in this store has used"""
+        if self.id_style == 'uuid':
+            return uuid.uuid4().hex
+        self.highest += 1
+        return f"rule{self.highest}"
+
+    def _note_id(self, rule_id):
+        """Keep the sequence ahead of rule<N> IDs that were loaded or supplied"""
+        match = GENERATED_ID.match(str(rule_id))
+        if match:
+            self.highest = max(self.highest, int(match.group(1)))
+
+    def _index(self, rule):
+        """Add a rule to the secondary indexes"""
+        condition_type, target = index_keys(rule)
+        self.by_condition_type.setdefault(condition_type, {})[rule['id']] = None
+        self.by_action_target.setdefault(target, {})[rule['id']] = None
+
+    def _unindex(self, rule):
+        """Remove a rule from the secondary indexes"""
+        rule_id = rule['id']
+        condition_type, target = index_keys(rule)
+        for index, key in ((self.by_condition_type, condition_type),
+                           (self.by_action_target, target)):
+            ids = index.get(key)
+            if ids is not None:
+                ids.pop(rule_id, None)
+                if not ids:
+                    del index[key]
+
+    def add(self, rule):
+        """
+        Add a rule, generating its ID if it has none
+        Raises ValueError if a rule with the same ID already exists
+        """
+        if 'id' not in rule:
+            rule['id'] = self.new_id()
+        elif rule['id'] in self.rules:
+            raise ValueError(f"Rule {rule['id']} already exists")
+        else:
+            self._note_id(rule['id'])
+        self.rules[rule['id']] = rule
+        self._index(rule)
+        return rule
+
+    def update(self, rule_id, rule):
+        """Replace a rule in place (keeping its position); returns False if unknown"""
+        old = self.rules.get(rule_id)
+        if old is None:
+            return False
+        rule['id'] = rule_id
+        if index_keys(old) != index_keys(rule):
+            self._unindex(old)
+            self._index(rule)
+        self.rules[rule_id] = rule
+        return True
+
+    def remove(self, rule_id):
+        """Delete a rule; returns the removed rule or None"""
+        rule = self.rules.pop(rule_id, None)
+        if rule is not None:
+            self._unindex(rule)
+        return rule
+
+    def replace(self, rules, highest=0):
+        """
+        Replace every rule with a new list
+        highest: rule<N> number already handed out (saved with the rules), so
+        IDs of deleted rules are not generated again
+        """
+        self.highest = max(self.highest, highest)
+        self.rules = {}
+        self.by_condition_type = {}
+        self.by_action_target = {}
+        for rule in rules:
+            if 'id' in rule:
+                self._note_id(rule['id'])
+        for rule in rules:
+            if 'id' in rule and rule['id'] in self.rules:
+                # Older versions could write duplicate IDs; give the later rule a new one
+                rule['id'] = self.new_id()
+            self.add(rule)
+
+    def find(self, condition_type=None, target=None):
+        """Get the rules matching a condition type and/or action target, in index order"""
+        if condition_type is None and target is None:
+            return self.to_list()
+        candidates = None
+        for index, key in ((self.by_condition_type, condition_type),
+                           (self.by_action_target, target)):
+            if key is None:
+                continue
+            ids = index.get(key, {})
+            candidates = ids if candidates is None else {rule_id: None for rule_id in candidates
+                                                         if rule_id in ids}
+        return [self.rules[rule_id] for rule_id in candidates]
@@ -5,19 +5,27 @@ Integrates motion detection, temperature monitoring, and gas leak detection
 with automated door lock
 """
 
-import RPi.GPIO as GPIO
-import Adafruit_DHT
 import time
 import threading
-import board
-import busio
-import adafruit_ads1x15.ads1115 as ADS
-from adafruit_ads1x15.analog_in import AnalogIn
 import json
 import os
+import copy
+import gzip
+import hashlib
+import re
+from collections import deque, OrderedDict
+import itertools
+import heapq
 from flask import Flask, render_template, jsonify, request
-from flask_socketio import SocketIO
+from flask_socketio import SocketIO, emit
+from automation_engine import RuleEngine
+from rule_persistence import RulePersistence
+from rule_store import RuleStore
+from state_store import StateStore
+import hardware_backend
+from history_store import TimeSeriesStore, STATS as HISTORY_STATS
 import logging
+from datetime import datetime
 import pandas as pd
 import numpy as np
 
@@ -25,6 +33,11 @@ import numpy as np
 log = logging.getLogger('werkzeug')
 log.setLevel(logging.ERROR)
 
+# Load the hardware backend ('pi' or 'sim', from SMART_HOME_BACKEND)
+hardware = hardware_backend.load_backend()
+GPIO = hardware.GPIO
+print(f"Using '{hardware.name}' hardware backend")
+
 # Setup GPIO
 GPIO.setmode(GPIO.BCM)
 GPIO.setwarnings(False)
@@ -45,6 +58,8 @@ RGB_PINS = {
 }
 
 DHT_PIN = 4  # DHT11 data pin
+DHT_SAMPLE_INTERVAL = 2.0  # Seconds between DHT11 reads (sensor allows ~1 read/s)
+DHT_STALE_AFTER = 30.0     # Seconds after which the last good reading is stale
 
 # L298N Motor Driver pin connections for fan control
 MOTOR_IN1 = 18  # Motor A direction control 1 (GPIO 18, Pin 12)
@@ -55,6 +70,15 @@ MOTOR_IN4 = 7   # Motor B direction control 2 (GPIO 7, Pin 26)
 GAS_DIGITAL_PIN = 24  # Digital output from MQ-7
 TEMPERATURE_THRESHOLD = 25.0  # Temperature threshold in Celsius
 
+# MQ-7 analog acquisition through the ADS1115 (A0)
+GAS_ADC_DATA_RATE = 250      # ADS1115 continuous conversion rate (8-860 samples/s)
+GAS_SAMPLE_INTERVAL = 0.02   # Seconds between reads of the latest conversion (50 Hz)
+GAS_MEDIAN_WINDOW = 5        # Samples in the median filter that rejects spikes
+GAS_EWMA_ALPHA = 0.2         # Weight of each new median in the smoothed voltage
+GAS_ALARM_VOLTAGE = 1.5      # Smoothed voltage at which the analog alarm raises
+GAS_ALARM_HYSTERESIS = 0.2   # Volts below the threshold before the analog alarm clears
+GAS_STALE_AFTER = 1.0        # Seconds after which the analog reading is ignored
+
 # Component pins
 SERVO_PIN = 10  # Door lock servo control pin
 BUZZER_PIN = 9  # Buzzer for audio alerts
@@ -64,25 +88,88 @@ GARAGE_SERVO_PIN = 11  # Garage door servo control pin
 IR_SENSOR_PIN = 15     # IR sensor for garage fingerprint detection
 GARAGE_AUTO_CLOSE_DELAY = 120  # Auto-close delay in seconds (2 minutes)
 
-# Global state variables
-system_state = {
+# Digital input backend: 'edge' uses GPIO interrupts, 'poll' reads pins every tick
+INPUT_BACKEND = 'edge'
+PIR_DEBOUNCE_MS = 50   # Debounce for PIR motion edges
+IR_DEBOUNCE_MS = 200   # Debounce for IR fingerprint edges
+GAS_DEBOUNCE_MS = 100  # Debounce for MQ-7 digital output edges
+INPUT_EVENT_HISTORY = 256  # Number of recent input edges kept for /api/inputs
+INPUT_RECONCILE_INTERVAL = 1.0  # Seconds between edge-mode pin reads that catch debounced edges
+GAS_EDGE_PERIOD = 1.0      # Gas handler period with edge inputs (keeps gas history sampled)
+COMMAND_HISTORY = 256      # Number of actuator command results kept for polling
+
+# Sensor history storage
+HISTORY_DIR = 'history'          # Directory for on-disk history segments
+HISTORY_DEFAULT_RANGE = 3600     # Seconds returned by /api/history when 'from' is omitted
+
+# Automation rules persistence (write-behind, see rule_persistence.py)
+RULES_FILE = 'automation_rules.json'
+RULES_SAVE_DELAY = 0.5       # Quiet seconds after a change before the rules are written
+RULES_SAVE_MAX_DELAY = 5.0   # Longest a change waits during a burst of edits
+RULES_JOURNAL = False        # Append changes to a journal instead of rewriting the file
+RULES_JOURNAL_COMPACT = 200  # Journal entries before it is folded back into RULES_FILE
+
+# Scenes and batched control
+SCENES_FILE = 'scenes.json'
+CONTROL_BATCH_MAX = 50        # Most commands accepted in one batch
+CONTROL_BATCH_MAX_WAIT = 10.0 # Longest a batch may wait for its door/garage commands (seconds)
+
+# Global state variables, kept in a copy-on-write store: system_state reads and
+# writes through it, state_store.snapshot() gives a consistent read-only version
+state_store = StateStore({
     'motion': {room: False for room in PIR_PINS.keys()},
     'temperature': 0.0,
     'humidity': 0.0,
+    'climate_stale': True,  # True when the DHT11 has no recent good reading
     'gas_detected': False,
     'fans_on': False,
     'emergency_mode': False,
     'door_locked': True,  # New state for door lock
     'garage_door_open': False,  # New state for garage door
     'garage_auto_close_time': None,  # Time when garage should auto-close
+    'last_input_change': {},  # Input name -> time.time() of its last edge
+    'leds': {room: 'off' for room in RGB_PINS.keys()},  # Room -> LED color name
     'manual_override': {
         'fans': False,
         'lights': {room: False for room in RGB_PINS.keys()},
         'door': False,  # New manual override for door
         'garage': False  # New manual override for garage
-    },
-    'automation_rules': []  # Store automation rules
+    }
+})
+system_state = state_store.view()
+
+# Last known good DHT11 reading, maintained by the dht_sampler() thread
+dht_cache = {
+    'temperature': None,
+    'humidity': None,
+    'timestamp': None,  # time.time() of the last good reading
+    'stats': {
+        'reads': 0,
+        'successes': 0,
+        'failures': 0,
+        'consecutive_failures': 0,
+        'last_read_duration': 0.0,
+        'max_read_duration': 0.0,
+        'last_error': None
+    }
 }
+dht_lock = threading.Lock()
+
+# Filtered MQ-7 analog reading, maintained by the gas_sampler() thread
+gas_cache = {
+    'raw': None,              # Last raw ADS1115 value
+    'voltage': None,          # Last unfiltered voltage
+    'filtered_voltage': None, # Median then EWMA filtered voltage
+    'analog_alarm': False,    # Filtered voltage past GAS_ALARM_VOLTAGE (with hysteresis)
+    'timestamp': None,        # time.time() of the last good sample
+    'stats': {
+        'samples': 0,
+        'errors': 0,
+        'alarms': 0,
+        'last_error': None
+    }
+}
+gas_lock = threading.Lock()
 
 # Default automation rules
 default_rules = [
@@ -146,8 +233,58 @@ default_rules = [
     }
 ]
 
-# Initialize the automation rules
-system_state['automation_rules'] = default_rules.copy()
+# Default scenes: named lists of control commands run as one batch
+default_scenes = [
+    {
+        'id': 'leaving_home',
+        'name': 'Leaving Home',
+        'commands': [
+            {'device': 'fan', 'state': False},
+            {'device': 'light', 'room': 'all', 'state': False},
+            {'device': 'door', 'state': True},
+            {'device': 'garage', 'state': False}
+        ]
+    },
+    {
+        'id': 'arriving_home',
+        'name': 'Arriving Home',
+        'commands': [
+            {'device': 'door', 'state': False},
+            {'device': 'light', 'room': 'all', 'auto': True},
+            {'device': 'fan', 'auto': True}
+        ]
+    }
+]
+
+# Automation rules keyed by ID (kept out of system_state so state broadcasts stay small)
+rule_store = RuleStore(copy.deepcopy(default_rules))
+
+# Compiled, input-indexed view of the automation rules
+rule_engine = RuleEngine(rule_store.values())
+
+# Guards rule_store and rule_engine: held by the API mutators while they change
+# and record the rules, by the sensor loop while it evaluates them, and briefly
+# by the rules writer while it snapshots them
+rules_lock = threading.RLock()
+
+# Coalesced, atomic saving of the automation rules off the request threads
+rules_persistence = RulePersistence(RULES_FILE, rule_store.to_list,
+                                    RULES_SAVE_DELAY, RULES_SAVE_MAX_DELAY,
+                                    RULES_JOURNAL, RULES_JOURNAL_COMPACT,
+                                    meta=lambda: {'highest_id': rule_store.highest},
+                                    lock=rules_lock)
+
+# Scenes keyed by ID, saved with the same write-behind persistence as the rules
+scenes = {scene['id']: scene for scene in copy.deepcopy(default_scenes)}
+scenes_persistence = RulePersistence(SCENES_FILE, lambda: list(scenes.values()),
+                                     RULES_SAVE_DELAY, RULES_SAVE_MAX_DELAY)
+
+# Append-only history of sensor readings (at most one sample per second per metric)
+history = TimeSeriesStore(HISTORY_DIR)
+
+# Tell the simulator which pins to drive for each sensor
+if hardware.name == 'sim':
+    hardware.configure_pins(PIR_PINS, GAS_DIGITAL_PIN, IR_SENSOR_PIN)
 
 # Setup PIR sensors as inputs
 for room, pin in PIR_PINS.items():
@@ -193,9 +330,8 @@ buzzer.start(0)  # Initialize with 0% duty cycle (no sound)
 print(f"Set up alert buzzer on GPIO {BUZZER_PIN}")
 
 # Setup I2C for ADS1115
-i2c = busio.I2C(board.SCL, board.SDA)
-ads = ADS.ADS1115(i2c)
-gas_channel = AnalogIn(ads, ADS.P0)  # Connect MQ-7 analog output to A0
+# Continuous mode: each sample is a single read of the latest conversion result
+ads, gas_channel = hardware.open_gas_adc(GAS_ADC_DATA_RATE, continuous=True)  # Connect MQ-7 analog output to A0
 
 # Create Flask app
 app = Flask(__name__)
@@ -205,12 +341,71 @@ socketio = SocketIO(app)
 os.makedirs('templates', exist_ok=True)
 os.makedirs('static', exist_ok=True)
 
+# GPIO output shadow registers
+# Last level written to each output pin, so writes that change nothing are skipped
+output_shadow = {}
+output_stats = {'issued': 0, 'suppressed': 0, 'batches': 0}
+output_lock = threading.Lock()
+
+def gpio_write_many(levels):
+    """
+    Write several output pins in one GPIO.output call
+    levels: dict of pin -> level; pins already at their level are skipped
+    Returns the number of pins actually written
+    """
+    with output_lock:
+        pins = []
+        values = []
+        for pin, level in levels.items():
+            level = GPIO.HIGH if level else GPIO.LOW
+            if output_shadow.get(pin) != level:
+                pins.append(pin)
+                values.append(level)
+        
+        output_stats['suppressed'] += len(levels) - len(pins)
+        if not pins:
+            return 0
+        
+        GPIO.output(pins, values)
+        for pin, level in zip(pins, values):
+            output_shadow[pin] = level
+        output_stats['issued'] += len(pins)
+        output_stats['batches'] += 1
+        return len(pins)
+
+def gpio_write(pin, level):
+    """Write one output pin unless it is already at that level"""
+    return gpio_write_many({pin: level})
+
 # LED control functions
+def _led_levels(room, r_state, g_state, b_state):
+    """Map a room's RGB states to a pin -> level dict"""
+    pins = RGB_PINS[room]
+    return {pins['R']: r_state, pins['G']: g_state, pins['B']: b_state}
+
 def set_led_color(room, r_state, g_state, b_state):
     """Set the RGB LED color for a specific room"""
-    GPIO.output(RGB_PINS[room]['R'], r_state)
-    GPIO.output(RGB_PINS[room]['G'], g_state)
-    GPIO.output(RGB_PINS[room]['B'], b_state)
+    set_led_colors({room: (r_state, g_state, b_state)})
+
+# (R, G, B) levels -> color name reported in system_state['leds']
+LED_COLOR_NAMES = {
+    (GPIO.LOW, GPIO.LOW, GPIO.LOW): 'off',
+    (GPIO.HIGH, GPIO.HIGH, GPIO.HIGH): 'white',
+    (GPIO.HIGH, GPIO.LOW, GPIO.LOW): 'red',
+    (GPIO.LOW, GPIO.HIGH, GPIO.LOW): 'green',
+    (GPIO.LOW, GPIO.LOW, GPIO.HIGH): 'blue'
+}
+
+def set_led_colors(colors):
+    """Set several rooms at once; colors maps room -> (r_state, g_state, b_state)"""
+    levels = {}
+    for room, (r_state, g_state, b_state) in colors.items():
+        levels.update(_led_levels(room, r_state, g_state, b_state))
+    with state_store.transaction():
+        for room, color in colors.items():
+            system_state['leds'][room] = LED_COLOR_NAMES.get(tuple(color), 'custom')
+        # Pins are written once the new state is published, outside the store lock
+        state_store.after_commit(lambda: gpio_write_many(levels))
 
 def led_white(room):
     """Turn on white color (R+G+B ON)"""
@@ -226,13 +421,11 @@ def led_off(room):
 
 def all_leds_red():
     """Turn all LEDs red for emergency alert"""
-    for room in RGB_PINS.keys():
-        led_red(room)
+    set_led_colors({room: (GPIO.HIGH, GPIO.LOW, GPIO.LOW) for room in RGB_PINS})
 
 def all_leds_off():
     """Turn off all LEDs"""
-    for room in RGB_PINS.keys():
-        led_off(room)
+    set_led_colors({room: (GPIO.LOW, GPIO.LOW, GPIO.LOW) for room in RGB_PINS})
 
 # Buzzer control functions
 def buzzer_on(frequency=440, duty_cycle=50):
@@ -260,51 +453,132 @@ def buzzer_beep(frequency=440, duty_cycle=50, duration=0.2, pause=0.2, count=1):
         if _ < count - 1:  # No pause after the last beep
             time.sleep(pause)
 
-def play_alert_pattern(pattern_type):
+# Alert patterns as tone tables of (frequency Hz, duty cycle %, seconds);
+# a duty cycle of 0 is a rest. Lower priority values preempt higher ones.
+ALERT_PATTERNS = {
+    'gas': {
+        # Urgent high-pitch triple beeps, 5 cycles
+        'priority': 0,
+        'tones': ([(880, 70, 0.2), (880, 0, 0.1)] * 2 + [(880, 70, 0.2), (880, 0, 0.3)]) * 5
+    },
+    'unauthorized': {
+        # Two low beeps
+        'priority': 1,
+        'tones': [(330, 70, 0.3), (330, 0, 0.1), (330, 70, 0.3)]
+    },
+    'door_open': {
+        # Ascending C major chord: C5, E5, G5
+        'priority': 2,
+        'tones': [(523, 50, 0.15), (523, 0, 0.05), (659, 50, 0.15), (659, 0, 0.05),
+                  (784, 50, 0.15), (784, 0, 0.05)]
+    },
+    'door_close': {
+        # Descending C major chord: G5, E5, C5
+        'priority': 2,
+        'tones': [(784, 50, 0.15), (784, 0, 0.05), (659, 50, 0.15), (659, 0, 0.05),
+                  (523, 50, 0.15), (523, 0, 0.05)]
+    },
+    'welcome': {
+        # Pleasant melody: C5, E5, G5
+        'priority': 2,
+        'tones': [(523, 50, 0.1), (523, 0, 0.05), (659, 50, 0.1), (659, 0, 0.05),
+                  (784, 50, 0.2), (784, 0, 0.05)]
+    }
+}
+
+class BuzzerScheduler:
     """
-    Play predefined alert patterns
-    pattern_type: 'gas', 'door_open', 'door_close', 'unauthorized', 'welcome'
+    Plays alert patterns on the single buzzer from one worker thread.
+    Requests wait in a priority queue; a pattern already queued is merged, and
+    a higher priority request (gas) cuts off a lower priority one in progress.
     """
-    # Start in a new thread to avoid blocking
-    alert_thread = threading.Thread(
-        target=_play_alert_pattern_thread,
-        args=(pattern_type,)
-    )
-    alert_thread.daemon = True
-    alert_thread.start()
-
-def _play_alert_pattern_thread(pattern_type):
-    """Thread function to play alert patterns"""
-    if pattern_type == 'gas':
-        # Urgent, continuous alternating high-low pattern
-        for _ in range(5):  # Play pattern for 5 cycles
-            buzzer_beep(880, 70, 0.2, 0.1, 3)  # High pitch, multiple beeps
-            time.sleep(0.3)
     
-    elif pattern_type == 'door_open':
-        # Ascending tones
-        frequencies = [523, 659, 784]  # C5, E5, G5 (C major chord)
-        for freq in frequencies:
-            buzzer_beep(freq, 50, 0.15, 0, 1)
-            time.sleep(0.05)
+    def __init__(self, patterns):
+        """Create the scheduler and start its worker thread"""
+        self.patterns = patterns
+        self.queue = []         # Heap of (priority, sequence, pattern name)
+        self.queued = set()     # Pattern names waiting in the queue
+        self.playing = None     # (priority, pattern name) currently playing
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.stats = {'requested': 0, 'merged': 0, 'played': 0, 'preempted': 0, 'unknown': 0}
+        self.thread = threading.Thread(target=self._run, name='buzzer-worker')
+        self.thread.daemon = True
+        self.thread.start()
     
-    elif pattern_type == 'door_close':
-        # Descending tones
-        frequencies = [784, 659, 523]  # G5, E5, C5 (C major chord reversed)
-        for freq in frequencies:
-            buzzer_beep(freq, 50, 0.15, 0, 1)
-            time.sleep(0.05)
+    def play(self, pattern_type):
+        """Queue a pattern; returns False for unknown patterns"""
+        pattern = self.patterns.get(pattern_type)
+        with self.condition:
+            self.stats['requested'] += 1
+            if pattern is None:
+                self.stats['unknown'] += 1
+                return False
+            if pattern_type in self.queued:
+                self.stats['merged'] += 1
+                return True
+            
+            heapq.heappush(self.queue, (pattern['priority'], next(self.sequence), pattern_type))
+            self.queued.add(pattern_type)
+            self.condition.notify()
+            return True
     
-    elif pattern_type == 'unauthorized':
-        # Two low beeps
-        buzzer_beep(330, 70, 0.3, 0.1, 2)  # Low pitch, two beeps
+    def _preempted(self, priority):
+        """Check (with the lock held) whether a more urgent pattern is waiting"""
+        return bool(self.queue) and self.queue[0][0] < priority
+    
+    def _run(self):
+        """Worker loop: play queued patterns one at a time in priority order"""
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                priority, _, pattern_type = heapq.heappop(self.queue)
+                self.queued.discard(pattern_type)
+                self.playing = (priority, pattern_type)
+            
+            completed = True
+            for frequency, duty_cycle, duration in self.patterns[pattern_type]['tones']:
+                if duty_cycle:
+                    buzzer_on(frequency, duty_cycle)
+                else:
+                    buzzer_off()
+                
+                # Wait out the tone, waking early if something more urgent arrives
+                with self.condition:
+                    deadline = time.time() + duration
+                    while not self._preempted(priority):
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            break
+                        self.condition.wait(remaining)
+                    if self._preempted(priority):
+                        completed = False
+                        break
+            
+            buzzer_off()
+            with self.condition:
+                self.playing = None
+                self.stats['played' if completed else 'preempted'] += 1
     
-    elif pattern_type == 'welcome':
-        # Pleasant melody
-        melody = [(523, 0.1), (659, 0.1), (784, 0.2)]  # C5, E5, G5
-        for freq, dur in melody:
-            buzzer_beep(freq, 50, dur, 0, 1)
-            time.sleep(0.05)
+    def get_status(self):
+        """Get the playing pattern, queued patterns and counters"""
+        with self.condition:
+            return {
+                'playing': self.playing[1] if self.playing else None,
+                'queued': [name for _, _, name in sorted(self.queue)],
+                'stats': dict(self.stats)
+            }
+
+buzzer_scheduler = BuzzerScheduler(ALERT_PATTERNS)
+
+def play_alert_pattern(pattern_type):
+    """
+    Play predefined alert patterns
+    pattern_type: 'gas', 'door_open', 'door_close', 'unauthorized', 'welcome'
+    """
+    # Handed to the buzzer worker, so this never blocks or starts a thread
+    return buzzer_scheduler.play(pattern_type)
 
 # Door lock control functions
 def set_door_lock(lock_state):
@@ -384,13 +658,146 @@ def set_garage_door(open_state):
         print(f"Error controlling garage door: {e}")
         return "error"
 
+# Actuator command workers
+class ActuatorWorker:
+    """
+    Runs commands for one actuator on its own thread so callers never wait for
+    servo settle time. Only one command is pending at a time: a newer command
+    replaces an unstarted one (last one wins) and a repeat of an in-flight
+    command is merged into it.
+    """
+    
+    # Command ID -> status dict, shared by all workers for polling
+    commands = OrderedDict()
+    commands_lock = threading.Lock()
+    finished = threading.Condition()  # Notified whenever any command stops being pending/running
+    _ids = itertools.count(1)
+    
+    def __init__(self, name, apply_command):
+        """Create the worker and start its thread; apply_command(value) does the work"""
+        self.name = name
+        self.apply_command = apply_command
+        self.pending = None   # Status dict of the command waiting to run
+        self.running = None   # Status dict of the command being applied
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name=f"{name}-worker")
+        self.thread.daemon = True
+        self.thread.start()
+    
+    @classmethod
+    def _record(cls, command):
+        """Store a command status, dropping the oldest beyond COMMAND_HISTORY"""
+        with cls.commands_lock:
+            cls.commands[command['id']] = command
+            while len(cls.commands) > COMMAND_HISTORY:
+                cls.commands.popitem(last=False)
+    
+    @classmethod
+    def get_command(cls, command_id):
+        """Get a copy of a command's status, or None if unknown or expired"""
+        with cls.commands_lock:
+            command = cls.commands.get(command_id)
+            return dict(command) if command else None
+    
+    @classmethod
+    def wait_for(cls, command_ids, timeout):
+        """
+        Wait until none of the commands is pending or running, or the timeout passes
+        Returns {command ID: status copy}; commands on different actuators run in parallel
+        """
+        deadline = time.time() + timeout
+        with cls.finished:
+            while True:
+                commands = {command_id: cls.get_command(command_id) for command_id in command_ids}
+                busy = any(command and command['status'] in ('pending', 'running')
+                           for command in commands.values())
+                remaining = deadline - time.time()
+                if not busy or remaining <= 0:
+                    return commands
+                cls.finished.wait(remaining)
+    
+    @classmethod
+    def _notify_finished(cls):
+        with cls.finished:
+            cls.finished.notify_all()
+    
+    def submit(self, value):
+        """Queue a command and return its status dict without waiting for it"""
+        with self.condition:
+            # Merge with the command that will decide the final position
+            latest = self.pending or self.running
+            if latest is not None and latest['value'] == value:
+                return dict(latest)
+            
+            command = {
+                'id': f"{self.name}-{next(self._ids)}",
+                'actuator': self.name,
+                'value': value,
+                'status': 'pending',
+                'result': None,
+                'submitted_at': time.time(),
+                'completed_at': None
+            }
+            superseded = self.pending is not None
+            if superseded:
+                self.pending['status'] = 'superseded'
+                self.pending['completed_at'] = time.time()
+            self.pending = command
+            self._record(command)
+            self.condition.notify()
+        if superseded:
+            self._notify_finished()
+        return dict(command)
+    
+    def is_in_flight(self, value):
+        """Check whether the latest pending or running command is for value"""
+        with self.condition:
+            latest = self.pending or self.running
+            return latest is not None and latest['value'] == value
+    
+    def _run(self):
+        """Worker loop: apply the latest pending command"""
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                command = self.pending
+                self.pending = None
+                self.running = command
+                command['status'] = 'running'
+            
+            try:
+                result = self.apply_command(command['value'])
+                status = 'error' if result == 'error' else 'done'
+            except Exception as e:
+                result = str(e)
+                status = 'error'
+            
+            with self.condition:
+                command['result'] = result
+                command['status'] = status
+                command['completed_at'] = time.time()
+                self.running = None
+            self._notify_finished()
+
+door_worker = ActuatorWorker('door', set_door_lock)
+garage_worker = ActuatorWorker('garage', set_garage_door)
+
+def request_door_lock(lock_state):
+    """Queue a door lock command; returns its status dict immediately"""
+    return door_worker.submit(bool(lock_state))
+
+def request_garage_door(open_state):
+    """Queue a garage door command; returns its status dict immediately"""
+    return garage_worker.submit(bool(open_state))
+
 def fingerprint_detected():
     """
     Check if a fingerprint is detected by the IR sensor
     Returns True if detected, False otherwise
     """
     # IR sensor returns LOW (0) when object is detected
-    return GPIO.input(IR_SENSOR_PIN) == 0
+    return read_input(IR_SENSOR_PIN) == 0
 
 def handle_garage_auto_close():
     """
@@ -404,7 +811,7 @@ def handle_garage_auto_close():
     if (system_state['garage_auto_close_time'] is not None and 
             time.time() >= system_state['garage_auto_close_time']):
         print("Auto-closing garage door after timeout")
-        set_garage_door(False)  # Close the garage
+        request_garage_door(False)  # Close the garage
         system_state['garage_auto_close_time'] = None
 
 def handle_ir_fingerprint():
@@ -412,31 +819,274 @@ def handle_ir_fingerprint():
     Handle IR fingerprint detection for garage door
     """
     if fingerprint_detected():
-        # Only take action if garage is currently closed
-        if not system_state['garage_door_open']:
+        # Only take action if garage is closed and not already opening
+        if not system_state['garage_door_open'] and not garage_worker.is_in_flight(True):
             print("Fingerprint detected - opening garage door")
             # Welcome sound alert
             play_alert_pattern('welcome')
             # Open the garage door
-            set_garage_door(True)
+            request_garage_door(True)
+
+# Digital input functions
+# Edge-driven inputs: pin -> (input name, sensor task to release, debounce in ms)
+EDGE_INPUTS = {pin: (room, 'motion', PIR_DEBOUNCE_MS) for room, pin in PIR_PINS.items()}
+EDGE_INPUTS[IR_SENSOR_PIN] = ('ir_fingerprint', 'ir_fingerprint', IR_DEBOUNCE_MS)
+EDGE_INPUTS[GAS_DIGITAL_PIN] = ('gas', 'gas', GAS_DEBOUNCE_MS)
+
+input_state = {
+    'backend': 'poll',  # Switched to 'edge' by setup_input_backend() on success
+    'levels': {},       # Pin -> last level seen by an edge callback or reconcile_inputs()
+    'events': deque(maxlen=INPUT_EVENT_HISTORY),
+    'pending': []       # Edges not yet handed to the sensor loop
+}
+input_lock = threading.Lock()
+input_wakeup = threading.Event()  # Set by edge callbacks to wake sensor_monitor()
+
+def _record_input_level(channel, level, now, missed=False):
+    """
+    Adopt a new level for an edge input and queue its event
+    Returns False when the level is the one already known
+    """
+    with input_lock:
+        if input_state['levels'].get(channel) == level:
+            return False
+        input_state['levels'][channel] = level
+        event = {'input': EDGE_INPUTS[channel][0], 'pin': channel, 'level': level,
+                 'timestamp': now, 'task': EDGE_INPUTS[channel][1]}
+        if missed:
+            event['missed'] = True
+        input_state['events'].append(event)
+        input_state['pending'].append(event)
+    return True
+
+def _on_input_edge(channel):
+    """GPIO edge callback: record a timestamped event and wake the sensor loop"""
+    # A bounce that settled back to the known level is not an event
+    if _record_input_level(channel, GPIO.input(channel), time.time()):
+        input_wakeup.set()
+
+def setup_input_backend():
+    """Register edge detection on PIR, IR and gas pins, falling back to polling"""
+    if INPUT_BACKEND != 'edge':
+        print("Using polled digital inputs")
+        return input_state['backend']
+    
+    registered = []
+    try:
+        for pin, (name, _, debounce_ms) in EDGE_INPUTS.items():
+            input_state['levels'][pin] = GPIO.input(pin)
+            GPIO.add_event_detect(pin, GPIO.BOTH, callback=_on_input_edge,
+                                  bouncetime=debounce_ms)
+            registered.append(pin)
+            print(f"Edge detection enabled for {name} on GPIO {pin} ({debounce_ms} ms debounce)")
+        input_state['backend'] = 'edge'
+    except Exception as e:
+        print(f"Edge detection unavailable ({e}), falling back to polling")
+        for pin in registered:
+            GPIO.remove_event_detect(pin)
+        input_state['backend'] = 'poll'
+    return input_state['backend']
+
+def read_input(pin):
+    """Read a digital input from the edge cache, or from the pin when polling"""
+    if input_state['backend'] == 'edge':
+        level = input_state['levels'].get(pin)
+        if level is not None:
+            return level
+    return GPIO.input(pin)
+
+def reconcile_inputs():
+    """
+    Read every edge input pin and record levels the callbacks missed (the last
+    transition fell inside the debounce window); their events release the
+    handlers like any other edge
+    """
+    now = time.time()
+    for pin in EDGE_INPUTS:
+        if _record_input_level(pin, GPIO.input(pin), now, missed=True):
+            input_wakeup.set()
+
+def drain_input_events():
+    """
+    Hand pending edges to the state and return the sensor tasks they release
+    Called from the sensor loop so all handlers keep running on one thread
+    """
+    with input_lock:
+        events = input_state['pending']
+        input_state['pending'] = []
+    
+    task_names = set()
+    for event in events:
+        system_state['last_input_change'][event['input']] = event['timestamp']
+        task_names.add(event['task'])
+    return task_names
+
+def get_input_events(limit=50):
+    """Get the input backend in use and the most recent input edges"""
+    with input_lock:
+        events = list(input_state['events'])[-limit:]
+    return {'backend': input_state['backend'], 'events': events}
 
 # Sensor reading functions
 def read_dht11():
-    """Read temperature and humidity from DHT11 sensor"""
-    humidity, temperature = Adafruit_DHT.read_retry(Adafruit_DHT.DHT11, DHT_PIN)
+    """
+    Read temperature and humidity from DHT11 sensor (single attempt)
+    Blocks for the duration of the read, so only dht_sampler() should call it
+    """
+    humidity, temperature = hardware.read_dht11(DHT_PIN)
     return humidity, temperature
 
+def dht_sampler():
+    """Background thread that keeps dht_cache filled with the last good reading"""
+    while True:
+        started = time.time()
+        try:
+            humidity, temperature = read_dht11()
+            error = None
+        except Exception as e:
+            humidity, temperature = None, None
+            error = str(e)
+        duration = time.time() - started
+        
+        with dht_lock:
+            stats = dht_cache['stats']
+            stats['reads'] += 1
+            stats['last_read_duration'] = duration
+            stats['max_read_duration'] = max(stats['max_read_duration'], duration)
+            
+            if humidity is not None and temperature is not None:
+                dht_cache['humidity'] = humidity
+                dht_cache['temperature'] = temperature
+                dht_cache['timestamp'] = time.time()
+                stats['successes'] += 1
+                stats['consecutive_failures'] = 0
+            else:
+                stats['failures'] += 1
+                stats['consecutive_failures'] += 1
+                stats['last_error'] = error or 'checksum or timeout'
+        
+        # Keep a steady cadence regardless of how long the read took
+        time.sleep(max(0.0, DHT_SAMPLE_INTERVAL - duration))
+
+def get_dht_reading():
+    """
+    Get the cached DHT11 reading without touching the sensor
+    Returns a dict with temperature, humidity, timestamp, age, stale and stats
+    """
+    with dht_lock:
+        reading = {
+            'temperature': dht_cache['temperature'],
+            'humidity': dht_cache['humidity'],
+            'timestamp': dht_cache['timestamp'],
+            'stats': dict(dht_cache['stats'])
+        }
+    
+    if reading['timestamp'] is None:
+        reading['age'] = None
+        reading['stale'] = True
+    else:
+        reading['age'] = time.time() - reading['timestamp']
+        reading['stale'] = reading['age'] > DHT_STALE_AFTER
+    return reading
+
+def gas_sampler():
+    """
+    Background thread that reads the ADS1115 at a fixed rate, filters the MQ-7
+    voltage (median, then EWMA) and raises/clears the analog alarm with hysteresis
+    """
+    # Never poll faster than the ADC produces new conversions
+    interval = max(GAS_SAMPLE_INTERVAL, 1.0 / GAS_ADC_DATA_RATE)
+    window = deque(maxlen=GAS_MEDIAN_WINDOW)
+    filtered = None
+    alarm = False
+    next_sample = time.time()
+    
+    while True:
+        try:
+            # One I2C read per sample; the voltage is derived from the raw value
+            raw = gas_channel.value
+            voltage = hardware_backend.adc_voltage(raw, ads.gain)
+            error = None
+        except Exception as e:
+            raw, voltage, error = None, None, str(e)
+        
+        changed = False
+        if voltage is not None:
+            window.append(voltage)
+            median = sorted(window)[len(window) // 2]
+            filtered = median if filtered is None else filtered + GAS_EWMA_ALPHA * (median - filtered)
+            if alarm:
+                alarm = filtered > GAS_ALARM_VOLTAGE - GAS_ALARM_HYSTERESIS
+            else:
+                alarm = filtered >= GAS_ALARM_VOLTAGE
+        
+        with gas_lock:
+            stats = gas_cache['stats']
+            if voltage is not None:
+                changed = alarm != gas_cache['analog_alarm']
+                gas_cache['raw'] = raw
+                gas_cache['voltage'] = voltage
+                gas_cache['filtered_voltage'] = filtered
+                gas_cache['analog_alarm'] = alarm
+                gas_cache['timestamp'] = time.time()
+                stats['samples'] += 1
+                if changed and alarm:
+                    stats['alarms'] += 1
+            else:
+                stats['errors'] += 1
+                stats['last_error'] = error
+        
+        if changed:
+            # Release the gas handler now instead of on its next period
+            event = {'input': 'gas_analog', 'pin': None, 'level': int(alarm),
+                     'timestamp': time.time(), 'task': 'gas'}
+            with input_lock:
+                input_state['events'].append(event)
+                input_state['pending'].append(event)
+            input_wakeup.set()
+        
+        next_sample += interval
+        delay = next_sample - time.time()
+        if delay < 0:
+            # Overran; resynchronize rather than bursting to catch up
+            next_sample = time.time()
+            delay = 0
+        time.sleep(delay)
+
 def check_gas_sensor():
-    """Read both digital and analog values from gas sensor"""
-    digital_value = GPIO.input(GAS_DIGITAL_PIN)
-    analog_value = gas_channel.value
-    analog_voltage = gas_channel.voltage
+    """Read the digital gas output and the filtered analog reading from the gas sampler"""
+    digital_value = read_input(GAS_DIGITAL_PIN)
+    with gas_lock:
+        timestamp = gas_cache['timestamp']
+        analog_raw = gas_cache['raw']
+        analog_voltage = gas_cache['filtered_voltage']
+        analog_alarm = gas_cache['analog_alarm']
+    stale = timestamp is None or time.time() - timestamp > GAS_STALE_AFTER
     
     return {
         'digital': digital_value,
-        'analog_raw': analog_value,
-        'analog_voltage': analog_voltage
+        'analog_raw': analog_raw,
+        'analog_voltage': analog_voltage,
+        'analog_alarm': analog_alarm and not stale,
+        'analog_stale': stale
+    }
+
+def get_gas_reading():
+    """Get the gas sampler cache, configuration and statistics"""
+    with gas_lock:
+        reading = dict(gas_cache)
+        reading['stats'] = dict(gas_cache['stats'])
+    reading['digital'] = read_input(GAS_DIGITAL_PIN)
+    reading['age'] = None if reading['timestamp'] is None else time.time() - reading['timestamp']
+    reading['config'] = {
+        'data_rate': GAS_ADC_DATA_RATE,
+        'sample_interval': GAS_SAMPLE_INTERVAL,
+        'median_window': GAS_MEDIAN_WINDOW,
+        'ewma_alpha': GAS_EWMA_ALPHA,
+        'alarm_voltage': GAS_ALARM_VOLTAGE,
+        'alarm_hysteresis': GAS_ALARM_HYSTERESIS
     }
+    return reading
 
 # Control functions
 def control_fans(turn_on=None):
@@ -447,172 +1097,455 @@ def control_fans(turn_on=None):
         else:
             turn_on = False
     
-    # Control motors using L298N motor driver
+    # Control motors using L298N motor driver (after the state is published
+    # when called inside a transaction)
     if turn_on:
-        motor_a_forward()  # Turn on Fan 1 (Motor A)
-        motor_b_forward()  # Turn on Fan 2 (Motor B)
+        state_store.after_commit(start_all_motors)  # Turn on Fans 1 and 2 (Motors A and B)
     else:
-        stop_all_motors()  # Turn off both fans
+        state_store.after_commit(stop_all_motors)  # Turn off both fans
     
     system_state['fans_on'] = turn_on
     return turn_on
 
 def handle_motion_detection():
     """Handle motion detection and LED control"""
-    for room, pin in PIR_PINS.items():
-        motion_detected = GPIO.input(pin)
-        system_state['motion'][room] = motion_detected
+    # Read the inputs first so the transaction does no I/O
+    levels = {room: read_input(pin) for room, pin in PIR_PINS.items()}
+    
+    # Motion flags and the LEDs they drive are published as one state version
+    with state_store.transaction():
+        colors = {}
+        for room, motion_detected in levels.items():
+            system_state['motion'][room] = motion_detected
+            
+            # If not in emergency mode and no manual override
+            if not system_state['emergency_mode'] and not system_state['manual_override']['lights'][room]:
+                if motion_detected:
+                    colors[room] = (GPIO.HIGH, GPIO.HIGH, GPIO.HIGH)
+                else:
+                    colors[room] = (GPIO.LOW, GPIO.LOW, GPIO.LOW)
         
-        # If not in emergency mode and no manual override
-        if not system_state['emergency_mode'] and not system_state['manual_override']['lights'][room]:
-            if motion_detected:
-                led_white(room)
-            else:
-                led_off(room)
+        # One batched write; rooms whose LEDs already match cost nothing
+        set_led_colors(colors)
 
 def handle_gas_detection():
     """Handle gas detection and emergency alerts"""
     gas_data = check_gas_sensor()
-    gas_detected = gas_data['digital'] == 0  # LOW means gas detected for most MQ sensors
+    # LOW means gas detected for most MQ sensors; the filtered analog alarm backs it up
+    gas_detected = gas_data['digital'] == 0 or gas_data['analog_alarm']
     
-    # Update system state
-    previous_state = system_state['gas_detected']
-    system_state['gas_detected'] = gas_detected
+    # Record history (the store keeps at most one sample per second)
+    now = time.time()
+    history.append('gas_voltage', gas_data['analog_voltage'], now)
+    history.append('gas_detected', 1.0 if gas_detected else 0.0, now)
     
-    # Handle emergency mode
-    if gas_detected:
-        if not previous_state:  # Only alert if this is a new detection
-            play_alert_pattern('gas')  # Play gas alert sound
+    # Gas flag, emergency mode and LED colors change together in one state version
+    with state_store.transaction():
+        previous_state = system_state['gas_detected']
+        system_state['gas_detected'] = gas_detected
         
-        system_state['emergency_mode'] = True
-        all_leds_red()  # Set all LEDs to red for alert
-    else:
-        if system_state['emergency_mode']:
-            system_state['emergency_mode'] = False
-            # Return to normal operation
-            handle_motion_detection()
+        # Handle emergency mode
+        if gas_detected:
+            if not previous_state:  # Only alert if this is a new detection
+                # Play gas alert sound once the emergency state is published
+                state_store.after_commit(lambda: play_alert_pattern('gas'))
+            
+            system_state['emergency_mode'] = True
+            all_leds_red()  # Set all LEDs to red for alert
+        else:
+            if system_state['emergency_mode']:
+                system_state['emergency_mode'] = False
+                # Return to normal operation
+                handle_motion_detection()
+
+# Timestamp of the last DHT11 sample written to history
+history_marks = {}
 
 def handle_temperature_control():
-    """Handle temperature reading and fan control"""
-    humidity, temperature = read_dht11()
+    """Handle temperature reading and fan control using the cached DHT11 reading"""
+    reading = get_dht_reading()
     
-    if humidity is not None and temperature is not None:
-        system_state['humidity'] = humidity
-        system_state['temperature'] = temperature
-        
-        # If no manual override
-        if not system_state['manual_override']['fans']:
-            control_fans()  # Automatic control based on temperature
+    # Never drive the fans from a missing or stale reading
+    if reading['stale']:
+        system_state['climate_stale'] = True
+        return
+    
+    state_store.update({
+        'climate_stale': False,
+        'humidity': reading['humidity'],
+        'temperature': reading['temperature']
+    })
+    
+    # Record each new DHT11 sample once, stamped with its read time
+    if history_marks.get('climate') != reading['timestamp']:
+        history_marks['climate'] = reading['timestamp']
+        history.append('temperature', reading['temperature'], reading['timestamp'])
+        history.append('humidity', reading['humidity'], reading['timestamp'])
+    
+    # If no manual override
+    if not system_state['manual_override']['fans']:
+        control_fans()  # Automatic control based on temperature
 
 # Motor control functions for L298N
 def motor_a_forward():
     """Motor A forward rotation (Fan 1 ON)"""
-    GPIO.output(MOTOR_IN1, GPIO.HIGH)
-    GPIO.output(MOTOR_IN2, GPIO.LOW)
+    gpio_write_many({MOTOR_IN1: GPIO.HIGH, MOTOR_IN2: GPIO.LOW})
 
 def motor_a_stop():
     """Motor A stop (Fan 1 OFF)"""
-    GPIO.output(MOTOR_IN1, GPIO.LOW)
-    GPIO.output(MOTOR_IN2, GPIO.LOW)
+    gpio_write_many({MOTOR_IN1: GPIO.LOW, MOTOR_IN2: GPIO.LOW})
 
 def motor_b_forward():
     """Motor B forward rotation (Fan 2 ON)"""
-    GPIO.output(MOTOR_IN3, GPIO.HIGH)
-    GPIO.output(MOTOR_IN4, GPIO.LOW)
+    gpio_write_many({MOTOR_IN3: GPIO.HIGH, MOTOR_IN4: GPIO.LOW})
 
 def motor_b_stop():
     """Motor B stop (Fan 2 OFF)"""
-    GPIO.output(MOTOR_IN3, GPIO.LOW)
-    GPIO.output(MOTOR_IN4, GPIO.LOW)
+    gpio_write_many({MOTOR_IN3: GPIO.LOW, MOTOR_IN4: GPIO.LOW})
+
+def start_all_motors():
+    """Run both motors forward (both fans on)"""
+    gpio_write_many({MOTOR_IN1: GPIO.HIGH, MOTOR_IN2: GPIO.LOW,
+                     MOTOR_IN3: GPIO.HIGH, MOTOR_IN4: GPIO.LOW})
 
 def stop_all_motors():
     """Stop both motors"""
-    motor_a_stop()
-    motor_b_stop()
+    gpio_write_many({MOTOR_IN1: GPIO.LOW, MOTOR_IN2: GPIO.LOW,
+                     MOTOR_IN3: GPIO.LOW, MOTOR_IN4: GPIO.LOW})
+
+# Sensor scheduling
+EMIT_HEARTBEAT = 5.0  # Seconds between version heartbeats when nothing has changed
+
+# /api/state response caching
+STATE_GZIP = True            # Offer gzip to clients that accept it
+STATE_GZIP_MIN_BYTES = 512   # Smaller bodies are sent uncompressed
+
+# Per-handler scheduling table, filled by build_sensor_tasks()
+# period: seconds between releases, priority: lower runs first when several are due,
+# deadline: seconds after release by which the handler must have finished
+sensor_tasks = []
+
+# Versioned view of system_state as last published to clients
+state_stream = {
+    'version': 0,        # Incremented every time a change is published
+    'snapshot': None,    # State store version published as 'version'
+    'last_emit': 0.0,
+    'stats': {'patches': 0, 'heartbeats': 0, 'snapshots': 0, 'patch_ops': 0}
+}
+state_stream_lock = threading.Lock()
 
-# Sensor monitoring thread function
-def sensor_monitor():
-    """Monitor sensors and update system state in a loop"""
-    while True:
-        # Handle motion detection and control LEDs
-        handle_motion_detection()
+def _escape_pointer(key):
+    """Escape a dict key for use in a JSON pointer path"""
+    return str(key).replace('~', '~0').replace('/', '~1')
+
+def compute_state_patch(old, new, path=''):
+    """
+    Compute JSON-patch style operations that turn old into new
+    Dicts are diffed key by key, any other changed value is replaced whole
+    """
+    if old is new:
+        # Branch shared between state store versions, so unchanged
+        return []
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = []
+        for key, value in new.items():
+            child = f"{path}/{_escape_pointer(key)}"
+            if key not in old:
+                ops.append({'op': 'add', 'path': child, 'value': value})
+            elif old[key] != value:
+                ops.extend(compute_state_patch(old[key], value, child))
+        for key in old:
+            if key not in new:
+                ops.append({'op': 'remove', 'path': f"{path}/{_escape_pointer(key)}"})
+        return ops
+    if old != new:
+        return [{'op': 'replace', 'path': path, 'value': new}]
+    return []
+
+def publish_state():
+    """
+    Diff system_state against the last published version and broadcast any change
+    Returns True when a new version was published
+    """
+    # Published store versions are immutable, so no copy is needed
+    state = state_store.snapshot()
+    with state_stream_lock:
+        if state_stream['snapshot'] is None:
+            state_stream['snapshot'] = state
+            state_stream['version'] += 1
+            return True
         
-        # Handle temperature monitoring and fan control
-        handle_temperature_control()
+        if state is state_stream['snapshot']:
+            return False
+        ops = compute_state_patch(state_stream['snapshot'], state)
+        state_stream['snapshot'] = state
+        if not ops:
+            return False
         
-        # Handle gas detection and emergency mode
-        handle_gas_detection()
+        state_stream['version'] += 1
+        # Emit under the lock so patches leave in version order
+        socketio.emit('state_patch', {
+            'version': state_stream['version'],
+            'base_version': state_stream['version'] - 1,
+            'ops': ops
+        })
+        state_stream['stats']['patches'] += 1
+        state_stream['stats']['patch_ops'] += len(ops)
+        state_stream['last_emit'] = time.time()
+        return True
+
+def get_state_snapshot():
+    """Publish any pending change, then get the latest state and its version"""
+    publish_state()
+    with state_stream_lock:
+        return state_stream['version'], state_stream['snapshot']
+
+# Serialized /api/state body of the last state version requested
+state_response_cache = {
+    'version': None,
+    'body': None,        # JSON bytes
+    'etag': None,        # Strong ETag of body (content hash)
+    'gzip_body': None,   # body compressed on first gzip request
+    'stats': {'requests': 0, 'serializations': 0, 'compressions': 0,
+              'cache_hits': 0, 'not_modified': 0, 'gzip_responses': 0}
+}
+state_response_lock = threading.Lock()
+
+def get_state_response(accept_gzip=False):
+    """
+    Get (version, etag, body, encoding) for the latest state, serializing and
+    compressing each state version at most once
+    """
+    version, snapshot = get_state_snapshot()
+    with state_response_lock:
+        cache = state_response_cache
+        stats = cache['stats']
+        stats['requests'] += 1
+        if cache['version'] != version:
+            body = json.dumps(snapshot, sort_keys=True, separators=(',', ':')).encode('utf-8')
+            cache['version'] = version
+            cache['body'] = body
+            cache['etag'] = hashlib.sha1(body).hexdigest()[:20]
+            cache['gzip_body'] = None
+            stats['serializations'] += 1
+        else:
+            stats['cache_hits'] += 1
         
-        # Handle IR fingerprint detection for garage
-        handle_ir_fingerprint()
+        if accept_gzip and STATE_GZIP and len(cache['body']) >= STATE_GZIP_MIN_BYTES:
+            if cache['gzip_body'] is None:
+                cache['gzip_body'] = gzip.compress(cache['body'], compresslevel=6)
+                stats['compressions'] += 1
+            # Each encoding is a different representation, so it gets its own strong ETag
+            return version, cache['etag'] + '-gz', cache['gzip_body'], 'gzip'
+        return version, cache['etag'], cache['body'], None
+
+def emit_state_if_changed():
+    """Push a compact patch to clients when the state changed, else a periodic heartbeat"""
+    if publish_state():
+        return
+    
+    if time.time() - state_stream['last_emit'] >= EMIT_HEARTBEAT:
+        # Lets clients notice missed patches even when nothing changes
+        socketio.emit('state_version', {'version': state_stream['version']})
+        state_stream['stats']['heartbeats'] += 1
+        state_stream['last_emit'] = time.time()
+
+def _new_task(name, handler, period, priority, deadline):
+    """Create a scheduler entry with empty timing statistics"""
+    return {
+        'name': name,
+        'handler': handler,
+        'period': period,
+        'priority': priority,
+        'deadline': deadline,
+        'next_run': 0.0,
+        'stats': {
+            'runs': 0,
+            'overruns': 0,
+            'skipped_periods': 0,
+            'errors': 0,
+            'last_duration': 0.0,
+            'max_duration': 0.0,
+            'total_duration': 0.0,
+            'last_jitter': 0.0,
+            'max_jitter': 0.0,
+            'total_jitter': 0.0
+        }
+    }
+
+def build_sensor_tasks():
+    """
+    Build the scheduling table for the sensor loop
+    With edge inputs, motion and IR run only when an input event releases them
+    (period None), gas slows to GAS_EDGE_PERIOD, and a reconcile task reads the
+    pins every INPUT_RECONCILE_INTERVAL seconds
+    """
+    if input_state['backend'] == 'edge':
+        tasks = [
+            _new_task('gas', handle_gas_detection, GAS_EDGE_PERIOD, 0, 0.05),
+            _new_task('motion', handle_motion_detection, None, 1, 0.025),
+            _new_task('ir_fingerprint', handle_ir_fingerprint, None, 2, 0.05),
+            _new_task('input_reconcile', reconcile_inputs, INPUT_RECONCILE_INTERVAL, 3, 0.05)
+        ]
+    else:
+        tasks = [
+            _new_task('gas', handle_gas_detection, 0.1, 0, 0.05),
+            _new_task('motion', handle_motion_detection, 0.05, 1, 0.025),
+            _new_task('ir_fingerprint', handle_ir_fingerprint, 0.1, 2, 0.05)
+        ]
+    return tasks + [
+        _new_task('garage_auto_close', handle_garage_auto_close, 1.0, 3, 0.5),
+        _new_task('automation_rules', process_automation_rules, 0.2, 4, 0.1),
+        _new_task('temperature', handle_temperature_control, 2.0, 5, 0.5),
+        _new_task('state_emit', emit_state_if_changed, 0.1, 6, 0.1)
+    ]
+
+def run_sensor_task(task, now):
+    """Run one scheduled handler and record its jitter, duration and overruns"""
+    stats = task['stats']
+    release = task['next_run']
+    jitter = max(0.0, now - release)
+    
+    try:
+        task['handler']()
+    except Exception as e:
+        stats['errors'] += 1
+        print(f"Error in sensor task {task['name']}: {e}")
+    
+    finished = time.time()
+    duration = finished - now
+    
+    stats['runs'] += 1
+    stats['last_duration'] = duration
+    stats['max_duration'] = max(stats['max_duration'], duration)
+    stats['total_duration'] += duration
+    stats['last_jitter'] = jitter
+    stats['max_jitter'] = max(stats['max_jitter'], jitter)
+    stats['total_jitter'] += jitter
+    if finished - release > task['deadline']:
+        stats['overruns'] += 1
+    
+    if task['period'] is None:
+        # Event-only handler: waits for the next input event to release it
+        task['next_run'] = float('inf')
+        return
+    
+    # Fixed-rate release times so the period does not drift with handler cost;
+    # if we fell more than a full period behind, skip ahead instead of bursting
+    next_run = release + task['period']
+    if next_run <= finished:
+        missed = int((finished - release) // task['period'])
+        stats['skipped_periods'] += max(0, missed - 1)
+        next_run = finished + task['period']
+    task['next_run'] = next_run
+
+def get_scheduler_stats():
+    """Get per-handler timing statistics for the sensor loop"""
+    result = {}
+    for task in sensor_tasks:
+        stats = dict(task['stats'])
+        runs = stats['runs'] or 1
+        stats['avg_duration'] = stats['total_duration'] / runs
+        stats['avg_jitter'] = stats['total_jitter'] / runs
+        stats['period'] = task['period']
+        stats['priority'] = task['priority']
+        stats['deadline'] = task['deadline']
+        result[task['name']] = stats
+    return result
+
+# Sensor monitoring thread function
+def sensor_monitor():
+    """Run every sensor handler on its own period, highest priority first when due together"""
+    sensor_tasks[:] = build_sensor_tasks()
+    start = time.time()
+    for task in sensor_tasks:
+        task['next_run'] = start
+    
+    while True:
+        now = time.time()
         
-        # Handle garage door auto-close
-        handle_garage_auto_close()
+        # Input edges release their handler, the rules and the emit immediately
+        released = drain_input_events()
+        if released:
+            released.update(('automation_rules', 'state_emit'))
+            for task in sensor_tasks:
+                if task['name'] in released and task['next_run'] > now:
+                    task['next_run'] = now
         
-        # Process automation rules
-        process_automation_rules()
+        due = [task for task in sensor_tasks if task['next_run'] <= now]
         
-        # Update clients with the latest state
-        socketio.emit('state_update', system_state)
+        if due:
+            due.sort(key=lambda task: task['priority'])
+            for task in due:
+                run_sensor_task(task, time.time())
+            continue
         
-        # Sleep for a short duration before next read
-        time.sleep(1)
+        # Sleep until the next release or until an input edge arrives
+        next_release = min(task['next_run'] for task in sensor_tasks)
+        input_wakeup.wait(max(0.0, next_release - now))
+        input_wakeup.clear()
 
 # Automation rule functions
 def add_rule(rule):
-    """Add a new automation rule to the system"""
-    # Generate unique ID if not provided
-    if 'id' not in rule:
-        rule['id'] = f"rule{len(system_state['automation_rules']) + 1}"
-    
-    # Set rule to active by default
-    if 'active' not in rule:
-        rule['active'] = True
-    
-    # Add the rule to the system
-    system_state['automation_rules'].append(rule)
-    save_rules_to_file()
+    """
+    Add a new automation rule to the system
+    Raises ValueError if the rule brings an ID that is already in use
+    """
+    with rules_lock:
+        # Set rule to active by default
+        if 'active' not in rule:
+            rule['active'] = True
+        
+        # Add the rule to the system (generates a unique ID if not provided)
+        rule_store.add(rule)
+        rule_engine.add(rule)
+        rules_persistence.put(rule)
     return rule['id']
 
 def update_rule(rule_id, updated_rule):
     """Update an existing automation rule"""
-    for i, rule in enumerate(system_state['automation_rules']):
-        if rule['id'] == rule_id:
-            # Keep the original ID
-            updated_rule['id'] = rule_id
-            system_state['automation_rules'][i] = updated_rule
-            save_rules_to_file()
-            return True
-    return False
+    with rules_lock:
+        if not rule_store.update(rule_id, updated_rule):
+            return False
+        rule_engine.update(updated_rule)
+        rules_persistence.put(updated_rule)
+    return True
 
 def delete_rule(rule_id):
     """Delete an automation rule"""
-    for i, rule in enumerate(system_state['automation_rules']):
-        if rule['id'] == rule_id:
-            del system_state['automation_rules'][i]
-            save_rules_to_file()
-            return True
-    return False
+    with rules_lock:
+        if rule_store.remove(rule_id) is None:
+            return False
+        rule_engine.remove(rule_id)
+        rules_persistence.delete(rule_id)
+    return True
 
 def toggle_rule(rule_id, active=None):
     """Enable or disable a rule"""
-    for rule in system_state['automation_rules']:
-        if rule['id'] == rule_id:
-            if active is None:
-                # Toggle current state
-                rule['active'] = not rule['active']
-            else:
-                # Set to specified state
-                rule['active'] = active
-            save_rules_to_file()
-            return True
-    return False
+    with rules_lock:
+        rule = rule_store.get(rule_id)
+        if rule is None:
+            return False
+        if active is None:
+            # Toggle current state
+            rule['active'] = not rule['active']
+        else:
+            # Set to specified state
+            rule['active'] = active
+        rules_persistence.put(rule)
+    return True
+
+def replace_rules(rules):
+    """Replace every automation rule (used for defaults and resets)"""
+    with rules_lock:
+        rule_store.replace(rules)
+        rule_engine.load(rule_store.values())
+        rules_persistence.replace(rule_store.to_list())
 
 def save_rules_to_file():
-    """Save automation rules to a file"""
+    """Write any unsaved rule changes to disk now (normally done by the write-behind thread)"""
     try:
-        with open('automation_rules.json', 'w') as f:
-            json.dump(system_state['automation_rules'], f, indent=4)
+        rules_persistence.flush()
         return True
     except Exception as e:
         print(f"Error saving rules: {e}")
@@ -621,82 +1554,22 @@ def save_rules_to_file():
 def load_rules_from_file():
     """Load automation rules from a file"""
     try:
-        if os.path.exists('automation_rules.json'):
-            with open('automation_rules.json', 'r') as f:
-                rules = json.load(f)
-            system_state['automation_rules'] = rules
+        rules = rules_persistence.load()
+        if rules is not None:
+            with rules_lock:
+                rule_store.replace(rules, rules_persistence.meta.get('highest_id', 0))
+                rule_engine.load(rule_store.values())
             return True
         else:
             # Create file with default rules if it doesn't exist
-            system_state['automation_rules'] = default_rules.copy()
-            save_rules_to_file()
+            replace_rules(copy.deepcopy(default_rules))
             return True
     except Exception as e:
         print(f"Error loading rules: {e}")
         # Fall back to default rules
-        system_state['automation_rules'] = default_rules.copy()
-        return False
-
-def evaluate_condition(condition):
-    """Evaluate a rule condition against the current system state"""
-    condition_type = condition['type']
-    operator = condition['operator']
-    value = condition['value']
-    
-    # Get the current state value based on condition type
-    if condition_type == 'temperature':
-        current_value = system_state['temperature']
-    elif condition_type == 'humidity':
-        current_value = system_state['humidity']
-    elif condition_type == 'gas':
-        current_value = system_state['gas_detected']
-    elif condition_type == 'motion':
-        if condition.get('location', 'any') == 'any':
-            # Check if motion is detected in any room
-            current_value = any(system_state['motion'].values())
-        else:
-            # Check specific room
-            room = condition['location']
-            if room in system_state['motion']:
-                current_value = system_state['motion'][room]
-            else:
-                return False
-    elif condition_type == 'time':
-        # Time-based condition
-        import datetime
-        current_time = datetime.datetime.now().time()
-        time_value = datetime.datetime.strptime(value, "%H:%M").time()
-        
-        # For time comparisons
-        if operator == '>':
-            return current_time > time_value
-        elif operator == '<':
-            return current_time < time_value
-        elif operator == '==':
-            # Allow 1-minute tolerance for equality
-            return abs((datetime.datetime.combine(datetime.date.today(), current_time) - 
-                      datetime.datetime.combine(datetime.date.today(), time_value)).total_seconds()) < 60
-        else:
-            return False
-    else:
-        # Unknown condition type
-        return False
-    
-    # Evaluate condition using appropriate operator
-    if operator == '>':
-        return current_value > value
-    elif operator == '<':
-        return current_value < value
-    elif operator == '>=':
-        return current_value >= value
-    elif operator == '<=':
-        return current_value <= value
-    elif operator == '==':
-        return current_value == value
-    elif operator == '!=':
-        return current_value != value
-    else:
-        # Unknown operator
+        with rules_lock:
+            rule_store.replace(copy.deepcopy(default_rules))
+            rule_engine.load(rule_store.values())
         return False
 
 def execute_action(action, condition=None):
@@ -743,20 +1616,20 @@ def execute_action(action, condition=None):
     
     elif action_type == 'door':
         if command == 'lock':
-            set_door_lock(True)
+            request_door_lock(True)
         elif command == 'unlock':
-            set_door_lock(False)
+            request_door_lock(False)
         elif command == 'auto':
             system_state['manual_override']['door'] = False
-            set_door_lock(True)  # Default to locked when in auto mode
+            request_door_lock(True)  # Default to locked when in auto mode
     
     elif action_type == 'garage':
         if command == 'open':
             system_state['manual_override']['garage'] = True
-            set_garage_door(True)
+            request_garage_door(True)
         elif command == 'close':
             system_state['manual_override']['garage'] = True
-            set_garage_door(False)
+            request_garage_door(False)
         elif command == 'auto':
             system_state['manual_override']['garage'] = False
             # Default to closed when in auto mode
@@ -766,8 +1639,9 @@ def execute_action(action, condition=None):
     
     elif action_type == 'alert':
         if command == 'emergency':
-            system_state['emergency_mode'] = True
-            all_leds_red()
+            with state_store.transaction():
+                system_state['emergency_mode'] = True
+                all_leds_red()
             play_alert_pattern('gas')
         elif command == 'sound':
             alert_type = action.get('alert_type', 'welcome')
@@ -775,12 +1649,170 @@ def execute_action(action, condition=None):
     
     return True
 
+def apply_control_command(command, led_colors=None):
+    """
+    Apply one manual control command, as sent to the /api/control/* endpoints
+    command: {'device': 'fan'|'light'|'door'|'garage', 'state': bool,
+    'room': light room or 'all', 'auto': True to return the device to automatic control}
+    led_colors: optional dict collecting LED colors so a batch writes them in one call
+    Returns the command's response dict; raises ValueError if the command is invalid
+    """
+    device = command.get('device')
+    auto = bool(command.get('auto', False))
+    
+    if device == 'fan':
+        if auto:
+            system_state['manual_override']['fans'] = False
+            control_fans()  # Return to temperature-based control
+        elif 'state' in command:
+            system_state['manual_override']['fans'] = True
+            control_fans(bool(command['state']))
+        else:
+            raise ValueError('Invalid request')
+        return {'success': True, 'fans_on': system_state['fans_on']}
+    
+    if device == 'light':
+        room = command.get('room')
+        rooms = list(RGB_PINS) if room == 'all' else [room]
+        if room != 'all' and room not in RGB_PINS:
+            raise ValueError('Invalid room' if auto else 'Invalid request')
+        if auto:
+            for room in rooms:
+                system_state['manual_override']['lights'][room] = False
+                if led_colors is not None:
+                    # A later auto command wins over an earlier deferred color
+                    led_colors.pop(room, None)
+            # Return to motion-based control
+            handle_motion_detection()
+        elif 'state' in command:
+            level = GPIO.HIGH if command['state'] else GPIO.LOW
+            for room in rooms:
+                system_state['manual_override']['lights'][room] = True
+                if led_colors is not None:
+                    led_colors[room] = (level, level, level)
+                else:
+                    set_led_color(room, level, level, level)
+        else:
+            raise ValueError('Invalid request')
+        return {'success': True}
+    
+    if device == 'door':
+        if auto:
+            system_state['manual_override']['door'] = False
+            lock_state = True  # Default to locked state when returning to auto
+        else:
+            system_state['manual_override']['door'] = True
+            lock_state = command.get('state', True)  # Default to locked
+        # Queue the door lock command; the servo moves on the door worker
+        queued = request_door_lock(lock_state)
+        return {'success': True, 'door_locked': system_state['door_locked'],
+                'command_id': queued['id'], 'status': queued['status']}
+    
+    if device == 'garage':
+        if auto:
+            system_state['manual_override']['garage'] = False
+            # If garage is open, set auto-close timer
+            if system_state['garage_door_open']:
+                system_state['garage_auto_close_time'] = time.time() + GARAGE_AUTO_CLOSE_DELAY
+            return {'success': True, 'garage_door_open': system_state['garage_door_open']}
+        system_state['manual_override']['garage'] = True
+        # Queue the garage door command; the servo moves on the garage worker
+        queued = request_garage_door(command.get('state', False))  # Default to closed
+        return {'success': True, 'garage_door_open': system_state['garage_door_open'],
+                'command_id': queued['id'], 'status': queued['status']}
+    
+    raise ValueError(f"Unknown device: {device}")
+
+def run_control_batch(commands, wait=0.0):
+    """
+    Apply a list of control commands as one state version
+    LEDs are written in a single GPIO call once the version is published; door
+    and garage commands go to their own workers, so the servos move in parallel. With wait > 0, waits up to that
+    many seconds for them and reports their final status
+    Returns one result dict per command, in order
+    """
+    results = []
+    led_colors = {}
+    with state_store.transaction():
+        for command in commands:
+            try:
+                if not isinstance(command, dict):
+                    raise ValueError('Command must be an object')
+                results.append(apply_control_command(command, led_colors))
+            except ValueError as e:
+                results.append({'success': False, 'error': str(e)})
+        if led_colors:
+            set_led_colors(led_colors)
+    
+    # Waiting happens outside the transaction: the workers write the state when they finish
+    command_ids = [result['command_id'] for result in results if 'command_id' in result]
+    if wait > 0 and command_ids:
+        finished = ActuatorWorker.wait_for(command_ids, wait)
+        for result in results:
+            command = finished.get(result.get('command_id'))
+            if command is not None:
+                result['status'] = command['status']
+                result['result'] = command['result']
+                if command['status'] == 'error':
+                    result['success'] = False
+        # Door and garage fields were read when the commands were queued
+        for result in results:
+            for key in ('door_locked', 'garage_door_open'):
+                if key in result:
+                    result[key] = system_state[key]
+    return results
+
+def run_scene(scene_id, wait=0.0):
+    """Run a stored scene; returns its per-command results, or None if unknown"""
+    with scenes_persistence.lock:
+        scene = scenes.get(scene_id)
+        commands = copy.deepcopy(scene['commands']) if scene else None
+    if commands is None:
+        return None
+    print(f"Running scene {scene_id}")
+    return run_control_batch(commands, wait)
+
+def save_scene(scene):
+    """Add or replace a scene (ID from the scene, else derived from its name)"""
+    if 'id' not in scene:
+        scene['id'] = re.sub(r'[^a-z0-9]+', '_', scene['name'].lower()).strip('_') or 'scene'
+    with scenes_persistence.lock:
+        scenes[scene['id']] = scene
+        scenes_persistence.put(scene)
+    return scene['id']
+
+def delete_scene(scene_id):
+    """Delete a scene; returns False if unknown"""
+    with scenes_persistence.lock:
+        if scenes.pop(scene_id, None) is None:
+            return False
+        scenes_persistence.delete(scene_id)
+    return True
+
+def load_scenes_from_file():
+    """Load saved scenes, writing the defaults if there are none"""
+    try:
+        saved = scenes_persistence.load()
+    except Exception as e:
+        print(f"Error loading scenes: {e}")
+        return False
+    with scenes_persistence.lock:
+        if saved is None:
+            scenes_persistence.replace(list(scenes.values()))
+        else:
+            scenes.clear()
+            scenes.update((scene['id'], scene) for scene in saved)
+    return True
+
 def process_automation_rules():
-    """Process all active automation rules"""
-    for rule in system_state['automation_rules']:
-        if rule['active']:
-            if evaluate_condition(rule['condition']):
-                execute_action(rule['action'], rule['condition'])
+    """Process active automation rules that fire on this tick"""
+    # Rules fire when their condition turns true (or every tick for 'while_true'
+    # rules), subject to each rule's cooldown. The engine is evaluated under the
+    # rules lock the API mutators hold; actions run after it is released
+    with rules_lock:
+        fired = rule_engine.evaluate(state_store.snapshot())
+    for compiled in fired:
+        execute_action(compiled.rule['action'], compiled.rule['condition'])
 
 # Flask routes
 @app.route('/')
@@ -795,138 +1827,291 @@ def automation_page():
 
 @app.route('/api/state')
 def get_state():
-    """API endpoint to get current system state"""
-    return jsonify(system_state)
+    """
+    API endpoint to get current system state
+    Serialized once per state version; supports If-None-Match (304) and gzip
+    """
+    accept_gzip = request.accept_encodings.quality('gzip') > 0
+    version, etag, body, encoding = get_state_response(accept_gzip)
+    
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        with state_response_lock:
+            state_response_cache['stats']['not_modified'] += 1
+    else:
+        response = app.response_class(body, mimetype='application/json')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+            with state_response_lock:
+                state_response_cache['stats']['gzip_responses'] += 1
+    response.set_etag(etag)
+    response.headers['X-State-Version'] = str(version)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+@app.route('/api/state/stream/stats')
+def state_stream_stats():
+    """API endpoint to get state version and broadcast counters"""
+    with state_response_lock:
+        responses = dict(state_response_cache['stats'])
+    return jsonify({'version': state_stream['version'], **state_stream['stats'],
+                    'store_version': state_store.version, 'store': state_store.stats,
+                    'responses': responses})
+
+# SocketIO events
+@socketio.on('connect')
+def handle_connect():
+    """Send a full versioned snapshot to a newly connected client"""
+    handle_snapshot_request()
+
+@socketio.on('request_snapshot')
+def handle_snapshot_request():
+    """Send a full versioned snapshot to a client that detected a gap"""
+    version, snapshot = get_state_snapshot()
+    state_stream['stats']['snapshots'] += 1
+    emit('state_snapshot', {'version': version, 'state': snapshot})
+
+@app.route('/api/history')
+def get_history():
+    """
+    API endpoint for sensor history
+    Query: metric (required), from/to (epoch seconds), step (seconds, optional),
+    stat (mean/min/max/count/last, used with step)
+    Steps that are multiples of a minute, hour or day are served from rollups
+    """
+    metric = request.args.get('metric')
+    if not metric:
+        return jsonify({'error': 'Missing metric', 'metrics': history.metrics()}), 400
+    
+    try:
+        end = float(request.args.get('to', time.time()))
+        start = float(request.args.get('from', end - HISTORY_DEFAULT_RANGE))
+        step = request.args.get('step', type=float)
+    except ValueError:
+        return jsonify({'error': 'from, to and step must be numbers'}), 400
+    if step is not None and step <= 0:
+        return jsonify({'error': 'step must be positive'}), 400
+    stat = request.args.get('stat', 'mean')
+    if stat not in HISTORY_STATS:
+        return jsonify({'error': f"stat must be one of {', '.join(HISTORY_STATS)}"}), 400
+    
+    timestamps, values, resolution = history.query_with_resolution(metric, start, end, step, stat)
+    return jsonify({
+        'metric': metric,
+        'from': start,
+        'to': end,
+        'step': step,
+        'stat': stat,
+        'resolution': resolution,
+        'points': [[t, v] for t, v in zip(timestamps.tolist(), values.tolist())]
+    })
+
+@app.route('/api/sensors/dht')
+def get_dht_status():
+    """API endpoint to get the cached DHT11 reading and read statistics"""
+    return jsonify(get_dht_reading())
+
+@app.route('/api/sensors/gas')
+def get_gas_status():
+    """API endpoint to get the filtered MQ-7 reading, analog alarm and sampler statistics"""
+    return jsonify(get_gas_reading())
+
+@app.route('/api/inputs')
+def get_inputs():
+    """API endpoint to get the digital input backend and recent input edges"""
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify(get_input_events(limit))
+
+# Simulator API endpoints (only available with the 'sim' backend)
+@app.route('/api/sim/state', methods=['GET'])
+def get_sim_state():
+    """Get simulated outputs (LEDs, motors, servos, buzzer) and sensor values"""
+    if hardware.name != 'sim':
+        return jsonify({'error': 'Simulator not active'}), 404
+    return jsonify(hardware.get_outputs())
+
+@app.route('/api/sim/inputs', methods=['POST'])
+def set_sim_inputs():
+    """Drive simulated sensors, e.g. {"motion": {"Room1": true}, "gas": true}"""
+    if hardware.name != 'sim':
+        return jsonify({'error': 'Simulator not active'}), 404
+    try:
+        hardware.apply_inputs(request.get_json() or {})
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True})
+
+@app.route('/api/gpio/stats')
+def get_gpio_stats():
+    """API endpoint to get issued and suppressed GPIO output writes"""
+    with output_lock:
+        return jsonify(dict(output_stats))
+
+@app.route('/api/buzzer')
+def get_buzzer_status():
+    """API endpoint to get the buzzer queue and counters"""
+    return jsonify(buzzer_scheduler.get_status())
+
+@app.route('/api/scheduler/stats')
+def scheduler_stats():
+    """API endpoint to get sensor loop timing statistics"""
+    return jsonify(get_scheduler_stats())
+
+def _control_response(command):
+    """Apply one control command from an endpoint and build its JSON response"""
+    try:
+        return jsonify(apply_control_command(command))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)})
 
 @app.route('/api/control/fan', methods=['POST'])
 def control_fan_api():
     """API endpoint to control fan manually"""
-    data = request.get_json()
-    if 'state' in data:
-        # Set manual override
-        system_state['manual_override']['fans'] = True
-        control_fans(data['state'])
-        return jsonify({'success': True, 'fans_on': system_state['fans_on']})
-    return jsonify({'success': False, 'error': 'Invalid request'})
+    return _control_response({**(request.get_json() or {}), 'device': 'fan', 'auto': False})
 
 @app.route('/api/control/fan/auto', methods=['POST'])
 def fan_auto_mode():
     """API endpoint to return fan to automatic control"""
-    system_state['manual_override']['fans'] = False
-    control_fans()  # Return to temperature-based control
-    return jsonify({'success': True, 'fans_on': system_state['fans_on']})
+    return _control_response({'device': 'fan', 'auto': True})
 
 @app.route('/api/control/light', methods=['POST'])
 def control_light_api():
     """API endpoint to control room lights manually"""
-    data = request.get_json()
-    if 'room' in data and 'state' in data and data['room'] in RGB_PINS:
-        room = data['room']
-        # Set manual override for this room
-        system_state['manual_override']['lights'][room] = True
-        
-        if data['state']:
-            led_white(room)
-        else:
-            led_off(room)
-            
-        return jsonify({'success': True})
-    return jsonify({'success': False, 'error': 'Invalid request'})
+    return _control_response({**(request.get_json() or {}), 'device': 'light', 'auto': False})
 
 @app.route('/api/control/light/auto', methods=['POST'])
 def light_auto_mode():
     """Disable manual override for a room's light"""
-    data = request.json
-    room = data.get('room')
-    
-    if room in system_state['manual_override']['lights']:
-        system_state['manual_override']['lights'][room] = False
-        print(f"Light auto mode enabled for {room}")
-        
-        # Return to motion-based control
-        handle_motion_detection()
-        
-        return jsonify({'success': True})
-    else:
-        return jsonify({'success': False, 'error': 'Invalid room'})
+    data = request.json or {}
+    return _control_response({'device': 'light', 'room': data.get('room'), 'auto': True})
 
 @app.route('/api/control/door', methods=['POST'])
 def control_door_api():
     """Control door lock"""
-    data = request.json
-    lock_state = data.get('state', True)  # Default to locked
-    
-    # Set manual override
-    system_state['manual_override']['door'] = True
-    
-    # Control the door lock
-    set_door_lock(lock_state)
-    
-    return jsonify({
-        'success': True, 
-        'door_locked': system_state['door_locked']
-    })
+    return _control_response({**(request.json or {}), 'device': 'door', 'auto': False})
 
 @app.route('/api/control/door/auto', methods=['POST'])
 def door_auto_mode():
     """Disable manual override for door lock"""
-    # Disable manual override
-    system_state['manual_override']['door'] = False
-    
-    # Default to locked state when returning to auto
-    set_door_lock(True)
-    
-    return jsonify({
-        'success': True,
-        'door_locked': system_state['door_locked']
-    })
+    return _control_response({'device': 'door', 'auto': True})
 
 # Garage door API endpoints
 @app.route('/api/control/garage', methods=['POST'])
 def control_garage_api():
     """Control garage door"""
-    data = request.json
-    open_state = data.get('state', False)  # Default to closed
-    
-    # Set manual override
-    system_state['manual_override']['garage'] = True
-    
-    # Control the garage door
-    set_garage_door(open_state)
-    
-    return jsonify({
-        'success': True, 
-        'garage_door_open': system_state['garage_door_open']
-    })
+    return _control_response({**(request.json or {}), 'device': 'garage', 'auto': False})
+
+@app.route('/api/commands/<command_id>', methods=['GET'])
+def get_command_status(command_id):
+    """Get the completion status of a queued actuator command"""
+    command = ActuatorWorker.get_command(command_id)
+    if command is None:
+        return jsonify({'error': 'Command not found'}), 404
+    return jsonify(command)
 
 @app.route('/api/control/garage/auto', methods=['POST'])
 def garage_auto_mode():
     """Disable manual override for garage door"""
-    # Disable manual override
-    system_state['manual_override']['garage'] = False
-    
-    # If garage is open, set auto-close timer
-    if system_state['garage_door_open']:
-        system_state['garage_auto_close_time'] = time.time() + GARAGE_AUTO_CLOSE_DELAY
+    return _control_response({'device': 'garage', 'auto': True})
+
+def _batch_wait():
+    """Read the optional 'wait' query/body value for batch and scene runs"""
+    data = request.get_json(silent=True) or {}
+    wait = request.args.get('wait', data.get('wait', 0))
+    try:
+        return min(max(float(wait), 0.0), CONTROL_BATCH_MAX_WAIT)
+    except (TypeError, ValueError):
+        return 0.0
+
+@app.route('/api/control/batch', methods=['POST'])
+def control_batch_api():
+    """
+    Apply many control commands in one request and one state version
+    Body: {'commands': [{'device': ..., ...}, ...], 'wait': seconds (optional)}
+    """
+    data = request.get_json(silent=True) or {}
+    commands = data.get('commands')
+    if not isinstance(commands, list) or not commands:
+        return jsonify({'success': False, 'error': 'commands must be a non-empty list'}), 400
+    if len(commands) > CONTROL_BATCH_MAX:
+        return jsonify({'success': False,
+                        'error': f"At most {CONTROL_BATCH_MAX} commands per batch"}), 400
     
-    return jsonify({
-        'success': True,
-        'garage_door_open': system_state['garage_door_open']
-    })
+    results = run_control_batch(commands, _batch_wait())
+    return jsonify({'success': all(result['success'] for result in results), 'results': results})
+
+# Scene API endpoints
+@app.route('/api/scenes', methods=['GET'])
+def get_scenes():
+    """Get all stored scenes"""
+    with scenes_persistence.lock:
+        return jsonify(list(scenes.values()))
+
+@app.route('/api/scenes', methods=['POST'])
+def create_scene():
+    """Create or replace a scene"""
+    data = request.get_json(silent=True) or {}
+    if 'name' not in data or not isinstance(data.get('commands'), list):
+        return jsonify({'error': 'Missing required fields'}), 400
+    return jsonify({'success': True, 'id': save_scene(data)}), 201
+
+@app.route('/api/scenes/<scene_id>', methods=['DELETE'])
+def delete_scene_api(scene_id):
+    """Delete a scene"""
+    if delete_scene(scene_id):
+        return jsonify({'success': True})
+    return jsonify({'error': 'Scene not found'}), 404
+
+@app.route('/api/scenes/<scene_id>/run', methods=['POST'])
+def run_scene_api(scene_id):
+    """Run a stored scene as one batch"""
+    results = run_scene(scene_id, _batch_wait())
+    if results is None:
+        return jsonify({'error': 'Scene not found'}), 404
+    return jsonify({'success': all(result['success'] for result in results),
+                    'scene': scene_id, 'results': results})
 
 # Automation rules API endpoints
 @app.route('/api/rules', methods=['GET'])
 def get_rules():
-    """Get all automation rules"""
-    return jsonify(system_state['automation_rules'])
+    """
+    Get all automation rules
+    Query: condition_type (e.g. temperature) and/or target (e.g. fan, light:Room1) to filter
+    """
+    condition_type = request.args.get('condition_type')
+    target = request.args.get('target')
+    with rules_lock:
+        return jsonify(rule_store.find(condition_type, target))
+
+@app.route('/api/rules/stats', methods=['GET'])
+def get_rule_stats():
+    """Get rule engine evaluation and firing counters"""
+    with rules_lock:
+        return jsonify(rule_engine.stats)
+
+@app.route('/api/rules/schedule', methods=['GET'])
+def get_rule_schedule():
+    """Get the next fire/re-evaluation times of time and cron rules"""
+    limit = request.args.get('limit', 20, type=int)
+    with rules_lock:
+        upcoming = rule_engine.upcoming(limit)
+    return jsonify([{'rule_id': rule_id, 'timestamp': timestamp,
+                     'time': datetime.fromtimestamp(timestamp).isoformat()}
+                    for timestamp, rule_id in upcoming])
+
+@app.route('/api/rules/persistence', methods=['GET'])
+def get_rule_persistence_stats():
+    """Get rule file write, journal and coalescing counters"""
+    return jsonify(rules_persistence.get_stats())
 
 @app.route('/api/rules/<rule_id>', methods=['GET'])
 def get_rule(rule_id):
     """Get a specific automation rule"""
-    for rule in system_state['automation_rules']:
-        if rule['id'] == rule_id:
-            return jsonify(rule)
-    return jsonify({'error': 'Rule not found'}), 404
+    rule = rule_store.get(rule_id)
+    if rule is None:
+        return jsonify({'error': 'Rule not found'}), 404
+    return jsonify(rule)
 
 @app.route('/api/rules', methods=['POST'])
 def create_rule():
@@ -938,7 +2123,10 @@ def create_rule():
         return jsonify({'error': 'Missing required fields'}), 400
     
     # Add the rule
-    rule_id = add_rule(data)
+    try:
+        rule_id = add_rule(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
     
     return jsonify({'success': True, 'id': rule_id}), 201
 
@@ -979,8 +2167,7 @@ def toggle_rule_api(rule_id):
 @app.route('/api/rules/reset', methods=['POST'])
 def reset_rules():
     """Reset to default rules"""
-    system_state['automation_rules'] = default_rules.copy()
-    save_rules_to_file()
+    replace_rules(copy.deepcopy(default_rules))
     return jsonify({'success': True})
 
 # Create HTML template
@@ -1114,6 +2301,28 @@ def create_html_template():
 
     <script>
         const socket = io();
+        let currentState = null;
+        let stateVersion = 0;
+        
+        // Apply JSON-patch style operations to the local state copy
+        function applyStatePatch(state, ops) {
+            ops.forEach(op => {
+                const keys = op.path.split('/').slice(1)
+                    .map(key => key.replace(/~1/g, '/').replace(/~0/g, '~'));
+                const last = keys.pop();
+                let target = state;
+                keys.forEach(key => { target = target[key]; });
+                if (op.op === 'remove') {
+                    delete target[last];
+                } else {
+                    target[last] = op.value;
+                }
+            });
+        }
+        
+        function requestSnapshot() {
+            socket.emit('request_snapshot');
+        }
         
         // Function to create room status elements
         function initRooms() {
@@ -1337,14 +2546,28 @@ def create_html_template():
             setupDoorButtons();
             setupGarageButtons();
             
-            // Get initial state
-            fetch('/api/state')
-                .then(response => response.json())
-                .then(state => updateUI(state));
+            // Full snapshots arrive on connect and whenever we ask after a gap
+            socket.on('state_snapshot', (message) => {
+                currentState = message.state;
+                stateVersion = message.version;
+                updateUI(currentState);
+            });
             
-            // Listen for state updates via Socket.IO
-            socket.on('state_update', (state) => {
-                updateUI(state);
+            // Compact diffs; anything out of sequence triggers a resync
+            socket.on('state_patch', (message) => {
+                if (currentState === null || message.base_version !== stateVersion) {
+                    requestSnapshot();
+                    return;
+                }
+                applyStatePatch(currentState, message.ops);
+                stateVersion = message.version;
+                updateUI(currentState);
+            });
+            
+            socket.on('state_version', (message) => {
+                if (message.version !== stateVersion) {
+                    requestSnapshot();
+                }
             });
         });
     </script>
@@ -1424,6 +2647,7 @@ def create_automation_template():
                                         <option value="motion">Motion</option>
                                         <option value="gas">Gas Detection</option>
                                         <option value="time">Time</option>
+                                        <option value="cron">Schedule (cron)</option>
                                     </select>
                                 </div>
                                 
@@ -1596,13 +2820,36 @@ if __name__ == "__main__":
         
         # Load automation rules
         load_rules_from_file()
-        print(f"Loaded {len(system_state['automation_rules'])} automation rules")
+        print(f"Loaded {len(rule_store)} automation rules")
+        load_scenes_from_file()
+        print(f"Loaded {len(scenes)} scenes")
+        
+        # Register GPIO edge detection for PIR, IR and gas inputs
+        setup_input_backend()
+        
+        # Start the DHT11 sampler so slow reads never stall the sensor loop
+        dht_thread = threading.Thread(target=dht_sampler)
+        dht_thread.daemon = True
+        dht_thread.start()
+        
+        # Start the gas sampler so the handler only reads filtered values
+        gas_thread = threading.Thread(target=gas_sampler)
+        gas_thread.daemon = True
+        gas_thread.start()
         
         # Start the sensor monitoring in a separate thread
         sensor_thread = threading.Thread(target=sensor_monitor)
         sensor_thread.daemon = True
         sensor_thread.start()
         
+        # Drive the simulator from a script file or random activity if asked to
+        if hardware.name == 'sim':
+            if os.environ.get('SMART_HOME_SIM_SCRIPT'):
+                hardware.run_script(hardware_backend.load_script(os.environ['SMART_HOME_SIM_SCRIPT']),
+                                    loop=os.environ.get('SMART_HOME_SIM_LOOP') == '1')
+            if os.environ.get('SMART_HOME_SIM_ACTIVITY') == '1':
+                hardware.start_activity()
+        
         # Start the Flask web server
         print("Starting web server...")
         socketio.run(app, host='0.0.0.0', port=5000, debug=False)
@@ -1611,6 +2858,9 @@ if __name__ == "__main__":
         print("\nExiting program")
     finally:
         # Clean up
+        history.flush()
+        save_rules_to_file()
+        scenes_persistence.flush()
         buzzer.stop()
         door_servo.stop()
         GPIO.cleanup()
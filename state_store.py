@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+System State Store
+Copy-on-write store for the shared system state: every change publishes a new
+version of the state tree and readers take the current version with a single
+reference read, so a snapshot is always consistent and never changes under
+the reader (readers must treat snapshots as read-only)
+
+Writers are serialized by one lock. A change copies only the dicts on the path
+to the changed key, so unchanged sub-trees are shared between versions and
+`old is new` identifies untouched branches. transaction() groups several
+changes into one published version, e.g. emergency mode plus all LEDs red
+
+Hardware side effects of a change (GPIO writes, buzzer alerts) are registered
+with after_commit() and run once the version is published, after the writer
+lock is released, so other writers never wait on I/O. They run in commit order
+"""
+
+import copy
+import threading
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+
+
+class StateStore:
+    def __init__(self, initial):
+        """Initialize the store with a deep copy of the initial state dict"""
+        self._published = (0, copy.deepcopy(initial))  # (version, state), swapped atomically
+        self._lock = threading.RLock()
+        self._draft = None      # Working copy while a transaction is open
+        self._owned = None      # ids of draft dicts already copied (safe to change in place)
+        self._owner = None      # Thread ident of the open transaction
+        self._depth = 0         # Transaction nesting depth
+        self._changed = False   # Whether the open transaction changed anything
+        self._effects = None    # Callables to run after the open transaction commits
+        # Held from publishing a version until its effects have run, so effects of
+        # successive versions never interleave or run out of order
+        self._effects_lock = threading.RLock()
+        self.stats = {'versions': 0, 'transactions': 0, 'rollbacks': 0,
+                      'writes': 0, 'unchanged_writes': 0}
+
+    def snapshot(self):
+        """Get the latest published state (read-only, never modified afterwards)"""
+        return self._published[1]
+
+    def versioned(self):
+        """Get (version, state) of the latest published state"""
+        return self._published
+
+    @property
+    def version(self):
+        return self._published[0]
+
+    def _root(self):
+        """State tree this thread should read: its own draft inside a transaction"""
+        if self._draft is not None and self._owner == threading.get_ident():
+            return self._draft
+        return self._published[1]
+
+    def get(self, path):
+        """Read the value at a path (tuple of keys)"""
+        node = self._root()
+        for key in path:
+            node = node[key]
+        return node
+
+    def view(self, path=()):
+        """Get a dict-like view that reads and writes through the store"""
+        return StateView(self, tuple(path))
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group changes into one published version; other writers wait, readers
+        keep seeing the previous version until the outermost block exits
+        If the block raises, its changes are discarded; a nested block that raises
+        discards only its own changes
+        """
+        effects = None
+        self._lock.acquire()
+        try:
+            savepoint = None
+            if self._depth == 0:
+                # The draft is copied on the first change, so no-op transactions are free
+                self._draft = None
+                self._owned = set()
+                self._owner = threading.get_ident()
+                self._changed = False
+                self._effects = []
+            else:
+                # Changes inside the nested block copy their path again, leaving the
+                # draft as it is now intact to roll back to
+                savepoint = (self._draft, self._owned, self._changed, len(self._effects))
+                self._owned = set()
+            self._depth += 1
+            try:
+                yield self.view()
+            except BaseException:
+                self.stats['rollbacks'] += 1
+                if savepoint is None:
+                    self._changed = False
+                    self._effects = []
+                else:
+                    self._draft, self._owned, self._changed, effect_count = savepoint
+                    del self._effects[effect_count:]
+                raise
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    if self._changed:
+                        self._published = (self._published[0] + 1, self._draft)
+                        self.stats['versions'] += 1
+                    self.stats['transactions'] += 1
+                    self._draft = None
+                    self._owned = None
+                    self._owner = None
+                    effects = self._effects
+                    self._effects = None
+                    if effects:
+                        # Taken before the writer lock is released to keep commit order
+                        self._effects_lock.acquire()
+        finally:
+            self._lock.release()
+
+        if effects:
+            try:
+                for effect in effects:
+                    effect()
+            finally:
+                self._effects_lock.release()
+
+    def after_commit(self, effect):
+        """
+        Run effect() once the current transaction publishes, outside the writer
+        lock; it is dropped if the transaction is rolled back. Outside a
+        transaction it runs immediately
+        """
+        if self._depth and self._owner == threading.get_ident():
+            self._effects.append(effect)
+        else:
+            with self._effects_lock:
+                effect()
+
+    def set(self, path, value):
+        """Set the value at a path; returns True if the state changed"""
+        if isinstance(value, StateView):
+            value = value.to_dict()
+        elif isinstance(value, (dict, list)):
+            # Callers keep their object; the store must own an unshared copy
+            value = copy.deepcopy(value)
+
+        with self._lock:
+            self.stats['writes'] += 1
+            if self._depth == 0:
+                # Cheap unchanged check before copying anything
+                try:
+                    node = self._published[1]
+                    for key in path[:-1]:
+                        node = node[key]
+                    if path[-1] in node and node[path[-1]] == value:
+                        self.stats['unchanged_writes'] += 1
+                        return False
+                except (KeyError, TypeError):
+                    pass
+                with self.transaction():
+                    return self._assign(path, value)
+            return self._assign(path, value)
+
+    def update(self, changes):
+        """Apply {path tuple or top-level key: value} atomically as one version"""
+        with self.transaction():
+            changed = False
+            for path, value in changes.items():
+                if not isinstance(path, tuple):
+                    path = (path,)
+                changed = self.set(path, value) or changed
+            return changed
+
+    def _assign(self, path, value):
+        """Copy-on-write assignment into the draft (lock held, transaction open)"""
+        node = self._draft if self._draft is not None else self._published[1]
+        if id(node) not in self._owned:
+            node = dict(node)
+            self._owned.add(id(node))
+            self._draft = node
+        for key in path[:-1]:
+            child = node[key]
+            if id(child) not in self._owned:
+                child = dict(child)
+                node[key] = child
+                self._owned.add(id(child))
+            node = child
+        key = path[-1]
+        if key in node and node[key] == value:
+            self.stats['unchanged_writes'] += 1
+            return False
+        node[key] = value
+        self._changed = True
+        return True
+
+
+class StateView(MutableMapping):
+    """Dict-like access to one branch of a StateStore; nested dicts come back as views"""
+
+    def __init__(self, store, path):
+        self._store = store
+        self._path = path
+
+    def _node(self):
+        return self._store.get(self._path)
+
+    def __getitem__(self, key):
+        value = self._node()[key]
+        if isinstance(value, dict):
+            return StateView(self._store, self._path + (key,))
+        return value
+
+    def __setitem__(self, key, value):
+        self._store.set(self._path + (key,), value)
+
+    def __delitem__(self, key):
+        raise TypeError("State keys cannot be deleted")
+
+    def __iter__(self):
+        return iter(self._node())
+
+    def __len__(self):
+        return len(self._node())
+
+    def __contains__(self, key):
+        return key in self._node()
+
+    def to_dict(self):
+        """Deep copy of this branch as plain dicts"""
+        return copy.deepcopy(self._node())
+
+    def __repr__(self):
+        return f"StateView({self._path!r}, {self._node()!r})"
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Upstream State Subscription
+Keeps one SocketIO connection from the web server to the main smart home
+system and mirrors its versioned state stream: a full 'state_snapshot' on
+connect, 'state_patch' diffs as the state changes and 'state_version'
+heartbeats. A patch or heartbeat that does not follow the local version asks
+for a new snapshot
+
+Patches are applied copy-on-write, so each state handed to on_state is a new
+object that is never modified afterwards. When the connection drops it is
+retried with exponential backoff; callers check live() and poll meanwhile
+"""
+
+import random
+import threading
+import time
+
+import socketio
+
+
+def _unescape_pointer(part):
+    """Undo JSON pointer escaping of one path segment"""
+    return part.replace('~1', '/').replace('~0', '~')
+
+
+def apply_patch(state, ops):
+    """
+    Apply JSON-patch style operations (add/replace/remove) from the main system
+    Returns a new state; dicts on changed paths are copied, the rest is shared
+    """
+    for op in ops:
+        path = [_unescape_pointer(part) for part in op['path'].split('/')[1:]]
+        if not path:
+            state = op.get('value')
+            continue
+        state = dict(state)
+        node = state
+        for key in path[:-1]:
+            child = dict(node[key])
+            node[key] = child
+            node = child
+        if op['op'] == 'remove':
+            node.pop(path[-1], None)
+        else:
+            node[path[-1]] = op['value']
+    return state
+
+
+class StateSubscription:
+    def __init__(self, url, on_state, backoff_initial=0.5, backoff_max=30.0):
+        """
+        url: main system server root, e.g. http://localhost:5000
+        on_state: called with (state, version) for every new state version
+        backoff_initial/backoff_max: reconnect delay bounds in seconds
+        """
+        self.url = url
+        self.on_state = on_state
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.state = None
+        self.version = None
+        self.synced = False       # Connected and holding a snapshot at the current version
+        self.awaiting_snapshot = False  # A snapshot has been requested and not yet received
+        self.connected = threading.Event()
+        self.lock = threading.Lock()
+        self.stats = {'connects': 0, 'disconnects': 0, 'connect_failures': 0,
+                      'snapshots': 0, 'patches': 0, 'resyncs': 0,
+                      'last_event': None, 'last_error': None}
+
+        # Reconnection is handled by _run() so the first connect gets the same backoff
+        self.client = socketio.Client(reconnection=False)
+        self.client.on('connect', self._on_connect)
+        self.client.on('disconnect', self._on_disconnect)
+        self.client.on('state_snapshot', self._on_snapshot)
+        self.client.on('state_patch', self._on_patch)
+        self.client.on('state_version', self._on_version)
+        self.thread = None
+
+    def start(self):
+        """Connect in a background thread and keep the connection up"""
+        self.thread = threading.Thread(target=self._run, name='state-subscription')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def live(self):
+        """Whether pushed state is current (connected and in sequence)"""
+        return self.connected.is_set() and self.synced
+
+    def _run(self):
+        """Connect, wait for the disconnect, back off, repeat"""
+        delay = self.backoff_initial
+        while True:
+            try:
+                self.client.connect(self.url, wait_timeout=5)
+                connected_at = time.monotonic()
+                self.client.wait()
+                if time.monotonic() - connected_at > self.backoff_max:
+                    # The connection held for a while, so start backing off from scratch
+                    delay = self.backoff_initial
+            except Exception as e:
+                with self.lock:
+                    self.stats['connect_failures'] += 1
+                    self.stats['last_error'] = str(e)
+            self._mark_down()
+            time.sleep(delay * random.uniform(0.8, 1.2))
+            delay = min(delay * 2, self.backoff_max)
+
+    def _mark_down(self):
+        """Stop serving pushed state until the next snapshot arrives"""
+        with self.lock:
+            self.synced = False
+        self.connected.clear()
+
+    def _resync(self):
+        """Ask the main system for a full snapshot after a gap"""
+        with self.lock:
+            self.synced = False
+            if self.awaiting_snapshot:
+                return
+            self.awaiting_snapshot = True
+            self.stats['resyncs'] += 1
+        try:
+            self.client.emit('request_snapshot')
+        except Exception as e:
+            with self.lock:
+                self.awaiting_snapshot = False
+                self.stats['last_error'] = str(e)
+
+    def _on_connect(self):
+        with self.lock:
+            # The main system sends a snapshot to every new connection
+            self.awaiting_snapshot = True
+            self.stats['connects'] += 1
+        self.connected.set()
+
+    def _on_disconnect(self, *args):
+        with self.lock:
+            self.stats['disconnects'] += 1
+        self._mark_down()
+
+    def _on_snapshot(self, message):
+        with self.lock:
+            self.state = message['state']
+            self.version = message['version']
+            self.synced = True
+            self.awaiting_snapshot = False
+            self.stats['snapshots'] += 1
+            self.stats['last_event'] = time.time()
+            state, version = self.state, self.version
+        self.on_state(state, version)
+
+    def _on_patch(self, message):
+        with self.lock:
+            in_sequence = (self.synced and self.state is not None and
+                           message.get('base_version') == self.version)
+            if in_sequence:
+                self.state = apply_patch(self.state, message['ops'])
+                self.version = message['version']
+                self.stats['patches'] += 1
+                self.stats['last_event'] = time.time()
+                state, version = self.state, self.version
+        if in_sequence:
+            self.on_state(state, version)
+        else:
+            self._resync()
+
+    def _on_version(self, message):
+        with self.lock:
+            self.stats['last_event'] = time.time()
+            behind = message.get('version') != self.version
+        if behind:
+            self._resync()
+
+    def get_stats(self):
+        """Get connection and event counters"""
+        with self.lock:
+            stats = dict(self.stats)
+            stats['version'] = self.version
+        stats['connected'] = self.connected.is_set()
+        stats['live'] = self.live()
+        return stats
@@ -120,6 +120,9 @@ function formatCondition(condition) {
         case 'time':
             text = `Time ${formatOperator(condition.operator)} ${condition.value}`;
             break;
+        case 'cron':
+            text = `On schedule ${condition.value}`;
+            break;
         default:
             text = 'Unknown condition';
     }
@@ -481,6 +484,11 @@ function updateConditionFields() {
         valueField.type = 'time';
         valueHelp.textContent = 'Time in 24-hour format (HH:MM)';
         
+    } else if (conditionType === 'cron') {
+        locationField.style.display = 'none';
+        valueField.type = 'text';
+        valueHelp.textContent = 'Cron schedule: minute hour day month weekday (e.g., 0 22 * * 1-5)';
+        
     } else {
         locationField.style.display = 'none';
         valueHelp.textContent = '';
@@ -623,7 +631,7 @@ function populateForm(rule) {
         document.getElementById('condition-value').value = rule.condition.value;
     } else if (rule.condition.type === 'motion' || rule.condition.type === 'gas') {
         document.getElementById('condition-value').value = rule.condition.value.toString();
-    } else if (rule.condition.type === 'time') {
+    } else if (rule.condition.type === 'time' || rule.condition.type === 'cron') {
         document.getElementById('condition-value').value = rule.condition.value;
     }
     
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Upstream API Client
+Shared HTTP client the web server uses to talk to the main smart home system:
+one keep-alive requests.Session with a bounded connection pool, per-endpoint
+timeouts, retry with exponential backoff and connection-reuse/latency stats
+
+Retries: connection failures (nothing was sent) are retried for every method;
+timeouts and 502/503/504 responses are retried only for idempotent methods, so
+a control POST is never applied twice
+"""
+
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# (connect, read) timeouts in seconds by the first path segment under the API base
+DEFAULT_TIMEOUTS = {
+    'state': (1.0, 3.0),
+    'control': (1.0, 5.0),
+    'rules': (1.0, 5.0),
+    'scenes': (1.0, 5.0),
+    'history': (1.0, 10.0),
+}
+FALLBACK_TIMEOUT = (1.0, 5.0)
+LATENCY_WINDOW = 200  # Recent requests per endpoint kept for percentiles
+
+
+class UpstreamClient:
+    def __init__(self, base_url, pool_size=8, retries=2, backoff=0.2, timeouts=None):
+        """
+        base_url: API root, e.g. http://localhost:5000/api
+        pool_size: most connections kept open (callers wait for a free one beyond this)
+        retries: attempts after the first one
+        backoff: backoff factor; waits backoff, 2*backoff, ... between attempts
+        timeouts: {endpoint: (connect, read)} overriding DEFAULT_TIMEOUTS
+        """
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        if timeouts:
+            self.timeouts.update(timeouts)
+
+        retry = Retry(total=retries, connect=retries, read=retries, status=retries,
+                      backoff_factor=backoff, status_forcelist=(502, 503, 504),
+                      allowed_methods=frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS']),
+                      raise_on_status=False)
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                                   pool_block=True, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'errors': 0, 'status_errors': 0}
+        self.endpoints = {}  # Endpoint -> {'count', 'errors', 'total', 'max', 'recent'}
+
+    def endpoint(self, path):
+        """Get the endpoint name a path is timed and reported under"""
+        return path.lstrip('/').split('/', 1)[0]
+
+    def request(self, method, path, **kwargs):
+        """
+        Send a request to base_url/path and return the response
+        Raises requests exceptions like requests.request() once retries run out
+        """
+        name = self.endpoint(path)
+        kwargs.setdefault('timeout', self.timeouts.get(name, FALLBACK_TIMEOUT))
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, f"{self.base_url}/{path.lstrip('/')}", **kwargs)
+        except requests.exceptions.RequestException:
+            self._record(name, time.perf_counter() - started, error=True)
+            raise
+        self._record(name, time.perf_counter() - started, error=False,
+                     status_error=response.status_code >= 500)
+        return response
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+    def _record(self, name, elapsed, error, status_error=False):
+        """Add one request to the counters and latency window"""
+        with self.lock:
+            self.stats['requests'] += 1
+            if error:
+                self.stats['errors'] += 1
+            if status_error:
+                self.stats['status_errors'] += 1
+            entry = self.endpoints.get(name)
+            if entry is None:
+                entry = {'count': 0, 'errors': 0, 'total': 0.0, 'max': 0.0,
+                         'recent': deque(maxlen=LATENCY_WINDOW)}
+                self.endpoints[name] = entry
+            entry['count'] += 1
+            if error:
+                entry['errors'] += 1
+            entry['total'] += elapsed
+            entry['max'] = max(entry['max'], elapsed)
+            entry['recent'].append(elapsed)
+
+    def _connection_counts(self):
+        """Get (connections opened, requests sent) over every pool, including retries"""
+        opened = sent = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+                sent += pool.num_requests
+        return opened, sent
+
+    def get_stats(self):
+        """Get request counts, connection reuse and per-endpoint latency (ms)"""
+        opened, sent = self._connection_counts()
+        with self.lock:
+            stats = dict(self.stats)
+            endpoints = {}
+            for name, entry in self.endpoints.items():
+                recent = sorted(entry['recent'])
+                endpoints[name] = {
+                    'count': entry['count'],
+                    'errors': entry['errors'],
+                    'mean_ms': round(entry['total'] / entry['count'] * 1000, 2),
+                    'p50_ms': round(recent[len(recent) // 2] * 1000, 2),
+                    'p95_ms': round(recent[int(len(recent) * 0.95)] * 1000, 2),
+                    'max_ms': round(entry['max'] * 1000, 2),
+                }
+        stats['connections_opened'] = opened
+        stats['http_requests_sent'] = sent
+        stats['connection_reuse_ratio'] = round(1 - opened / sent, 3) if sent else None
+        stats['pool_size'] = self.pool_size
+        stats['endpoints'] = endpoints
+        return stats
@@ -14,6 +14,9 @@ import requests
 from datetime import datetime, timedelta
 import logging
 
+from upstream_client import UpstreamClient
+from state_subscription import StateSubscription
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -23,23 +26,52 @@ app.config['SECRET_KEY'] = 'smart_home_secret_key_2024'
 socketio = SocketIO(app, cors_allowed_origins="*")
 
 # Configuration
-SMART_HOME_API_BASE = "http://localhost:5000/api"
-UPDATE_INTERVAL = 2  # seconds
+SMART_HOME_URL = "http://localhost:5000"
+SMART_HOME_API_BASE = f"{SMART_HOME_URL}/api"
+UPDATE_INTERVAL = 2  # seconds, polling interval while the state stream is down
+UPSTREAM_POOL_SIZE = 8  # Keep-alive connections to the main system
+UPSTREAM_RETRIES = 2  # Retries after a failed upstream request
+UPSTREAM_BACKOFF = 0.2  # Backoff factor between retries (seconds)
+STATE_CACHE_TTL = 1.0  # Serve cached_state without an upstream call for this long (seconds)
+STREAM_BACKOFF_INITIAL = 0.5  # First reconnect delay for the state stream (seconds)
+STREAM_BACKOFF_MAX = 30.0  # Longest reconnect delay for the state stream (seconds)
+
+# Shared keep-alive client for every call to the main system
+upstream = UpstreamClient(SMART_HOME_API_BASE, pool_size=UPSTREAM_POOL_SIZE,
+                          retries=UPSTREAM_RETRIES, backoff=UPSTREAM_BACKOFF)
 
 # Global state to cache system data
 cached_state = {
     'last_update': None,
     'system_data': {},
+    'etag': None,  # ETag of system_data, sent as If-None-Match
+    'fetched_at': None,  # time.monotonic() of the last successful fetch
     'connection_status': False
 }
 
+# Single-flight state fetches: one caller fetches, concurrent callers wait for its result
+state_fetch_condition = threading.Condition()
+state_fetch = {'in_flight': False, 'generation': 0, 'result': None}
+state_cache_stats = {'hits': 0, 'fetches': 0, 'coalesced': 0, 'pushes': 0, 'polls': 0}
+
 def get_system_state():
     """Get current system state from the main smart home system"""
     try:
-        response = requests.get(f"{SMART_HOME_API_BASE}/state", timeout=5)
+        headers = {}
+        if cached_state['etag']:
+            headers['If-None-Match'] = cached_state['etag']
+        response = upstream.get("state", headers=headers)
+        if response.status_code == 304:
+            # Unchanged since the last poll: nothing to download or parse
+            cached_state['last_update'] = datetime.now()
+            cached_state['fetched_at'] = time.monotonic()
+            cached_state['connection_status'] = True
+            return cached_state['system_data']
         if response.status_code == 200:
             cached_state['system_data'] = response.json()
+            cached_state['etag'] = response.headers.get('ETag')
             cached_state['last_update'] = datetime.now()
+            cached_state['fetched_at'] = time.monotonic()
             cached_state['connection_status'] = True
             logger.info("Successfully retrieved system state")
             return cached_state['system_data']
@@ -60,12 +92,77 @@ def get_system_state():
         cached_state['connection_status'] = False
         return None
 
+def get_cached_system_state(max_age=STATE_CACHE_TTL):
+    """
+    Get the system state, from cached_state if it is younger than max_age
+    Concurrent callers share one upstream fetch instead of each making their own
+    """
+    with state_fetch_condition:
+        fetched_at = cached_state['fetched_at']
+        if state_subscription.live() and fetched_at is not None:
+            # Pushed updates keep cached_state current however old the last change is
+            state_cache_stats['hits'] += 1
+            return cached_state['system_data']
+        if (cached_state['connection_status'] and fetched_at is not None and
+                time.monotonic() - fetched_at < max_age):
+            state_cache_stats['hits'] += 1
+            return cached_state['system_data']
+        if state_fetch['in_flight']:
+            # Wait for the fetch already running and use its result
+            state_cache_stats['coalesced'] += 1
+            generation = state_fetch['generation']
+            while state_fetch['generation'] == generation:
+                state_fetch_condition.wait()
+            return state_fetch['result']
+        state_fetch['in_flight'] = True
+        state_cache_stats['fetches'] += 1
+
+    result = None
+    try:
+        result = get_system_state()
+    finally:
+        with state_fetch_condition:
+            state_fetch['result'] = result
+            state_fetch['in_flight'] = False
+            state_fetch['generation'] += 1
+            state_fetch_condition.notify_all()
+    return result
+
+def handle_pushed_state(state, version):
+    """Store a state version pushed by the main system and forward it to clients"""
+    with state_fetch_condition:
+        cached_state['system_data'] = state
+        cached_state['etag'] = None  # The next poll after an outage fetches in full
+        cached_state['last_update'] = datetime.now()
+        cached_state['fetched_at'] = time.monotonic()
+        cached_state['connection_status'] = True
+        state_cache_stats['pushes'] += 1
+    socketio.emit('system_update', {
+        'data': state,
+        'timestamp': datetime.now().isoformat(),
+        'connection_status': True
+    })
+
+# Persistent subscription to the main system's state stream
+state_subscription = StateSubscription(SMART_HOME_URL, handle_pushed_state,
+                                       backoff_initial=STREAM_BACKOFF_INITIAL,
+                                       backoff_max=STREAM_BACKOFF_MAX)
+
+def get_state_cache_stats():
+    """Get state cache counters and the share of calls served without an upstream fetch"""
+    with state_fetch_condition:
+        stats = dict(state_cache_stats)
+    calls = stats['hits'] + stats['fetches'] + stats['coalesced']
+    stats['calls'] = calls
+    stats['hit_ratio'] = round((stats['hits'] + stats['coalesced']) / calls, 3) if calls else None
+    stats['ttl'] = STATE_CACHE_TTL
+    return stats
+
 def send_control_command(endpoint, data):
     """Send control command to the main smart home system"""
     try:
         logger.info(f"Sending command to {endpoint} with data: {data}")
-        response = requests.post(f"{SMART_HOME_API_BASE}/{endpoint}", 
-                               json=data, timeout=5)
+        response = upstream.post(endpoint, json=data)
         if response.status_code == 200:
             logger.info(f"Command to {endpoint} successful")
             return True
@@ -85,7 +182,7 @@ def send_control_command(endpoint, data):
 def get_automation_rules():
     """Get automation rules from the main system"""
     try:
-        response = requests.get(f"{SMART_HOME_API_BASE}/rules", timeout=5)
+        response = upstream.get("rules")
         if response.status_code == 200:
             return response.json()
         return []
@@ -123,7 +220,7 @@ def settings():
 @app.route('/api/dashboard/data')
 def dashboard_data():
     """Get dashboard data"""
-    state = get_system_state()
+    state = get_cached_system_state()
     if state:
         return jsonify({
             'success': True,
@@ -165,6 +262,49 @@ def control_garage():
     success = send_control_command('control/garage', data)
     return jsonify({'success': success})
 
+def _batch_timeout(data):
+    """Read timeout for a batch or scene run: the usual one plus the time it may wait"""
+    try:
+        wait = max(float(request.args.get('wait', (data or {}).get('wait', 0))), 0.0)
+    except (TypeError, ValueError, AttributeError):
+        wait = 0.0
+    connect, read = upstream.timeouts['control']
+    return (connect, read + wait)
+
+@app.route('/api/control/batch', methods=['POST'])
+def control_batch():
+    """Apply many device commands in one upstream round trip"""
+    data = request.get_json(silent=True)
+    try:
+        response = upstream.post("control/batch", json=data, params=request.args,
+                                 timeout=_batch_timeout(data))
+        return jsonify(response.json()), response.status_code
+    except Exception as e:
+        logger.error(f"Error sending command batch: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 502
+
+@app.route('/api/scenes')
+def get_scenes():
+    """Get stored scenes"""
+    try:
+        response = upstream.get("scenes")
+        return jsonify(response.json()), response.status_code
+    except Exception as e:
+        logger.error(f"Error getting scenes: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 502
+
+@app.route('/api/scenes/<scene_id>/run', methods=['POST'])
+def run_scene(scene_id):
+    """Run a stored scene"""
+    data = request.get_json(silent=True)
+    try:
+        response = upstream.post(f"scenes/{scene_id}/run", json=data, params=request.args,
+                                 timeout=_batch_timeout(data))
+        return jsonify(response.json()), response.status_code
+    except Exception as e:
+        logger.error(f"Error running scene {scene_id}: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 502
+
 @app.route('/api/automation/rules')
 def get_rules():
     """Get automation rules"""
@@ -176,7 +316,7 @@ def create_rule():
     """Create new automation rule"""
     data = request.get_json()
     try:
-        response = requests.post(f"{SMART_HOME_API_BASE}/rules", json=data, timeout=5)
+        response = upstream.post("rules", json=data)
         return jsonify({'success': response.status_code == 200})
     except Exception as e:
         logger.error(f"Error creating rule: {e}")
@@ -187,7 +327,7 @@ def update_rule(rule_id):
     """Update automation rule"""
     data = request.get_json()
     try:
-        response = requests.put(f"{SMART_HOME_API_BASE}/rules/{rule_id}", json=data, timeout=5)
+        response = upstream.put(f"rules/{rule_id}", json=data)
         return jsonify({'success': response.status_code == 200})
     except Exception as e:
         logger.error(f"Error updating rule: {e}")
@@ -197,7 +337,7 @@ def update_rule(rule_id):
 def delete_rule(rule_id):
     """Delete automation rule"""
     try:
-        response = requests.delete(f"{SMART_HOME_API_BASE}/rules/{rule_id}", timeout=5)
+        response = upstream.delete(f"rules/{rule_id}")
         return jsonify({'success': response.status_code == 200})
     except Exception as e:
         logger.error(f"Error deleting rule: {e}")
@@ -207,12 +347,30 @@ def delete_rule(rule_id):
 def toggle_rule(rule_id):
     """Toggle automation rule"""
     try:
-        response = requests.post(f"{SMART_HOME_API_BASE}/rules/{rule_id}/toggle", timeout=5)
+        response = upstream.post(f"rules/{rule_id}/toggle")
         return jsonify({'success': response.status_code == 200})
     except Exception as e:
         logger.error(f"Error toggling rule: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/history')
+def get_history():
+    """Proxy sensor history queries to the main system"""
+    try:
+        response = upstream.get("history", params=request.args)
+        return jsonify(response.json()), response.status_code
+    except Exception as e:
+        logger.error(f"Error getting history: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 502
+
+@app.route('/api/upstream/stats')
+def get_upstream_stats():
+    """Connection reuse and latency of calls to the main system, and state cache hits"""
+    stats = upstream.get_stats()
+    stats['state_cache'] = get_state_cache_stats()
+    stats['subscription'] = state_subscription.get_stats()
+    return jsonify(stats)
+
 # WebSocket events
 @socketio.on('connect')
 def handle_connect():
@@ -228,7 +386,7 @@ def handle_disconnect():
 @socketio.on('request_update')
 def handle_update_request():
     """Handle real-time update request"""
-    state = get_system_state()
+    state = get_cached_system_state()
     if state:
         emit('system_update', {
             'data': state,
@@ -237,10 +395,14 @@ def handle_update_request():
         })
 
 def background_updater():
-    """Background thread to send periodic updates"""
+    """Poll for updates while the state stream is down (pushes are forwarded as they arrive)"""
     while True:
         try:
-            state = get_system_state()
+            if state_subscription.live():
+                time.sleep(UPDATE_INTERVAL)
+                continue
+            state_cache_stats['polls'] += 1
+            state = get_cached_system_state()
             if state:
                 socketio.emit('system_update', {
                     'data': state,
@@ -258,6 +420,9 @@ if __name__ == '__main__':
     os.makedirs('static/css', exist_ok=True)
     os.makedirs('static/js', exist_ok=True)
     
+    # Subscribe to pushed state; the updater polls whenever the stream is down
+    state_subscription.start()
+    
     # Start background updater thread
     updater_thread = threading.Thread(target=background_updater)
     updater_thread.daemon = True